@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# Compares decoding docker inspect responses and AuthZ container bodies with keys lowercased during JSON
+# parsing against the previous approach of json.loads followed by DockerHelper.rename_keys_to_lower copies.
+#
+# Run from the repository root: python -m benchmarks.bench_lowercase_keys
+#
+# Decoding a single inspect response costs about the same either way (between 1.0x and 1.25x from run to run) with
+# ~17% higher peak allocations; the win is on containers/create bodies, which are no longer lowercased twice.
+import json
+import os
+import statistics
+import timeit
+import tracemalloc
+
+from dockerenforcer.docker_helper import DockerHelper
+
+ROUNDS = 500
+REPEATS = 21
+INSPECT_FILE = os.path.join(os.path.dirname(__file__), "data", "container_inspect.json")
+
+
+def decode_inspect_before(raw):
+    return DockerHelper.rename_keys_to_lower(json.loads(raw))
+
+
+def decode_inspect_after(raw):
+    return DockerHelper.loads_with_lower_keys(raw)
+
+
+def decode_authz_body_before(raw):
+    # the container body was lowercased once in authz_request and again in make_container_periodic_check_compatible
+    return DockerHelper.rename_keys_to_lower(DockerHelper.rename_keys_to_lower(json.loads(raw)))
+
+
+def decode_authz_body_after(raw):
+    return DockerHelper.loads_with_lower_keys(raw)
+
+
+def measure_time(before, after, raw):
+    # the variants take turns, so that both see the same machine state (CPU frequency, other load)
+    times = {before: [], after: []}
+    for _ in range(REPEATS):
+        for func in (before, after):
+            times[func].append(timeit.timeit(lambda: func(raw), number=ROUNDS) / ROUNDS)
+    return statistics.median(times[before]), statistics.median(times[after])
+
+
+def measure_peak(func, raw):
+    tracemalloc.start()
+    func(raw)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def report(name, before, after, raw):
+    t_before, t_after = measure_time(before, after, raw)
+    m_before, m_after = measure_peak(before, raw), measure_peak(after, raw)
+    print("{0} ({1} bytes):".format(name, len(raw)))
+    print("  before: {0:8.1f} us/op, peak allocations {1:8d} B".format(t_before * 10 ** 6, m_before))
+    print("  after:  {0:8.1f} us/op, peak allocations {1:8d} B".format(t_after * 10 ** 6, m_after))
+    print("  speedup: {0:.2f}x, peak allocations: {1:.0%} of before".format(t_before / t_after, m_after / m_before))
+
+
+def main():
+    with open(INSPECT_FILE, "rb") as file:
+        inspect_raw = file.read()
+    create_body = {k: v for k, v in json.loads(inspect_raw.decode())["Config"].items()}
+    create_body["HostConfig"] = json.loads(inspect_raw.decode())["HostConfig"]
+    create_raw = json.dumps(create_body).encode()
+
+    report("container inspect", decode_inspect_before, decode_inspect_after, inspect_raw)
+    report("authz containers/create body", decode_authz_body_before, decode_authz_body_after, create_raw)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# Measures the memory kept by detection stats for tens of thousands of synthetic containers, comparing the
+# previous Stat layout (a __dict__ object keeping each container's own image string, reasons list and labels
+# dict) with the current slotted Stat that interns repeated strings and shares identical labels.
+#
+# Run from the repository root: python -m benchmarks.bench_stats_memory
+import datetime
+import gc
+import json
+import tracemalloc
+
+from dockerenforcer.docker_helper import Container, CheckSource
+from dockerenforcer.killer import StatusDictionary, Verdict
+
+DETECTIONS = 50000
+IMAGES = 50
+PROJECTS = 20
+OWNERS = 5
+
+
+class DictStat:
+    # the layout used before: one __dict__ per record and references to each container's own decoded values
+    def __init__(self, name):
+        self.counter = 0
+        self.name = name
+        self.last_timestamp = None
+        self.reasons = None
+        self.image = None
+        self.labels = None
+        self.source = None
+        self.owner = None
+
+    def record_new(self, reasons, image, labels, source, owner):
+        self.counter += 1
+        self.last_timestamp = datetime.datetime.utcnow()
+        self.reasons = reasons
+        self.image = image
+        self.labels = labels
+        self.source = source
+        self.owner = owner
+
+
+def make_verdict(i):
+    # decoded from JSON like docker responses are, so that equal values are separate objects
+    params = json.loads(json.dumps({
+        "name": "/ci-job-{0}".format(i),
+        "config": {
+            "image": "registry.local/team-{0}/app:latest".format(i % IMAGES),
+            "labels": {"com.docker.compose.project": "project-{0}".format(i % PROJECTS),
+                       "com.docker.compose.service": "worker",
+                       "com.docker.compose.version": "1.29.2",
+                       "maintainer": "ci@example.com"}}}))
+    container = Container("{0:064x}".format(i), params, {}, 0, CheckSource.Periodic,
+                          owner=json.loads('"ci-runner-{0}"'.format(i % OWNERS)))
+    return Verdict(True, container, json.loads('["must have memory limit", "must have CPU limit"]'))
+
+
+def record_before(table, verdict):
+    params = verdict.subject.params
+    table.setdefault(verdict.subject.cid, DictStat(params["name"])).record_new(
+        verdict.reasons, params["config"]["image"], params["config"]["labels"], verdict.subject.check_source,
+        verdict.subject.owner)
+
+
+def record_after(status, verdict):
+    status.register_killed(verdict)
+
+
+def measure(make_table, record):
+    gc.collect()
+    tracemalloc.start()
+    table = make_table()
+    for i in range(DETECTIONS):
+        record(table, make_verdict(i))
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current
+
+
+def main():
+    before = measure(dict, record_before)
+    after = measure(StatusDictionary, record_after)
+    print("{0} detections:".format(DETECTIONS))
+    print("  before: {0:8.1f} MiB, {1:6.0f} B/record".format(before / 2 ** 20, before / DETECTIONS))
+    print("  after:  {0:8.1f} MiB, {1:6.0f} B/record".format(after / 2 ** 20, after / DETECTIONS))
+    print("  after/before: {0:.0%}".format(after / before))
+
+
+if __name__ == "__main__":
+    main()
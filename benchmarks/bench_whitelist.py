@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# Compares matching container names against large whitelists with one compiled regex per entry (the previous
+# approach) and with WhitelistMatcher, then measures whole periodic verdicts of a Judge using such whitelists.
+#
+# Run from the repository root: python -m benchmarks.bench_whitelist
+import re
+import timeit
+
+from dockerenforcer.config import Config
+from dockerenforcer.docker_helper import Container, CheckSource
+from dockerenforcer.killer import Judge
+from dockerenforcer.whitelist import WhitelistMatcher
+
+ROUNDS = 2000
+ENTRIES = 500
+RULES = 20
+
+
+def make_whitelist(entries):
+    # half of the entries are plain names, the rest are patterns, like in a typical deployment
+    return ["service-{0}".format(i) if i % 2 == 0 else "batch-{0}-.*".format(i) for i in range(entries)]
+
+
+def match_before(regexes, name):
+    return any(rn.match(name) for rn in regexes)
+
+
+def report(name, t_before, t_after):
+    print("{0}:".format(name))
+    print("  before: {0:8.2f} us/op".format(t_before * 10 ** 6))
+    print("  after:  {0:8.2f} us/op".format(t_after * 10 ** 6))
+    print("  speedup: {0:.1f}x".format(t_before / t_after))
+
+
+def bench_matching():
+    whitelist = make_whitelist(ENTRIES)
+    regexes = [re.compile("^{0}$".format(r)) for r in whitelist]
+    matcher = WhitelistMatcher(whitelist)
+    names = ["service-{0}".format(ENTRIES - 2), "batch-{0}-x".format(ENTRIES - 1), "not-whitelisted"]
+    for name in names:
+        assert match_before(regexes, name) == matcher.match(name)
+        t_before = min(timeit.repeat(lambda: match_before(regexes, name), number=ROUNDS, repeat=5)) / ROUNDS
+        t_after = min(timeit.repeat(lambda: matcher.match(name), number=ROUNDS, repeat=5)) / ROUNDS
+        report("match '{0}' against {1} entries".format(name, ENTRIES), t_before, t_after)
+
+
+def bench_verdicts():
+    rules = [{"name": "rule {0}".format(i), "rule": lambda c: c.params["hostconfig"]["memory"] == 0}
+             for i in range(RULES)]
+    config = Config()
+    config.white_list = make_whitelist(ENTRIES) + ["{0}|rule {1}".format(w, i % RULES)
+                                                   for i, w in enumerate(make_whitelist(ENTRIES))]
+    config.image_white_list = ["registry.local/team-{0}/.*".format(i) for i in range(ENTRIES)]
+    judge = Judge(rules, "container", config)
+    container = Container("cid", {"name": "/not-whitelisted", "config": {"image": "busybox", "labels": {}},
+                                  "hostconfig": {"memory": 1024}}, {}, 0, CheckSource.Periodic)
+    seconds = min(timeit.repeat(lambda: judge.should_be_killed(container), number=ROUNDS // 10, repeat=5))
+    print("verdict with {0} rules, {1} name and {2} image whitelist entries: {3:.1f} us/op".format(
+        RULES, len(config.white_list), len(config.image_white_list), seconds / (ROUNDS // 10) * 10 ** 6))
+
+
+def main():
+    bench_matching()
+    bench_verdicts()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,10 @@
+import datetime
 import inspect
 import json
 import logging
 import re
 import signal
 import sys
-from base64 import b64decode
 from logging import StreamHandler
 
 from docker import APIClient
@@ -15,25 +15,42 @@ from pygments.lexers.data import JsonLexer
 from pygments.lexers.python import Python3Lexer
 from rx import Observable
 from rx.concurrency import NewThreadScheduler
+from typing import List, Optional
 from urllib import parse
 
+from dockerenforcer import metrics
+from dockerenforcer.api_guard import DockerApiGuard
+from dockerenforcer.authz_request import AuthzRequest
 from dockerenforcer.config import Config, ConfigEncoder, Mode
 from dockerenforcer.docker_helper import DockerHelper, Container, CheckSource
 from dockerenforcer.docker_image_helper import DockerImageHelper
+from dockerenforcer.event_coalescer import EventCoalescer
 from dockerenforcer.killer import Killer, Judge, TriggerHandler
+from dockerenforcer.render_cache import RenderCache
+from dockerenforcer.scan_scheduler import PriorityScanScheduler
+from dockerenforcer.scheduler import BoundedThreadPoolScheduler
 from rules.rules import rules
 from request_rules.request_rules import request_rules
 from whitelist_rules.whitelist_rules import whitelist_rules
 
 config = Config()
-client: APIClient = APIClient(base_url=config.docker_socket, timeout=config.docker_req_timeout_sec)
-docker_helper = DockerHelper(config, client)
-docker_image_helper = DockerImageHelper(config, client)
+client: APIClient = APIClient(base_url=config.docker_socket, timeout=config.docker_req_timeout_sec,
+                              max_pool_size=max(10, config.scan_concurrency + config.pipeline_workers))
+api_guard = DockerApiGuard(config)
+docker_helper = DockerHelper(config, client, api_guard)
+docker_image_helper = DockerImageHelper(config, client, api_guard)
 judge = Judge(rules, "container", config, run_whitelists=True, custom_whitelist_rules=whitelist_rules,
               docker_image_helper=docker_image_helper)
 requests_judge = Judge(request_rules, "request", config, run_whitelists=False)
-jurek = Killer(docker_helper, config.mode)
+jurek = Killer(docker_helper, config.mode, config.stats_max_entries, config.stats_max_age_sec)
 trigger_handler = TriggerHandler()
+docker_helper.limit_data_sources(judge.data_sources | trigger_handler.data_sources)
+render_cache = RenderCache(config.render_cache_size)
+event_coalescer = EventCoalescer(config.event_coalesce_window_ms / 1000)
+scan_scheduler = PriorityScanScheduler(docker_helper, config.interval_sec, config.priority_scan_tick_sec,
+                                       config.scan_api_calls_per_sec, config.scan_concurrency) \
+    if config.priority_scan else None
+pipeline_scheduler = BoundedThreadPoolScheduler("pipeline", config.pipeline_workers, config.pipeline_queue_size)
 containers_regex = re.compile("^(/v.+?)?/containers/.+?$")
 
 
@@ -53,51 +70,67 @@ def create_app():
     flask_app.logger.info("Starting docker-enforcer v{0} with docker socket {1}".format(config.version,
                                                                                         config.docker_socket))
 
-    task_scheduler = NewThreadScheduler()
-    # task_scheduler = ThreadPoolScheduler(multiprocessing.cpu_count())
-    if config.run_start_events:
-        events = Observable.from_iterable(docker_helper.get_events_observable()) \
-            .observe_on(scheduler=task_scheduler) \
+    # the subscription keeps one thread reading docker events, the checks run on the bounded pipeline workers
+    subscription_scheduler = NewThreadScheduler()
+    watch_events = config.run_start_events or config.stats_drop_on_destroy \
+        or (config.run_periodic and config.cache_params)
+    if watch_events:
+        container_events = Observable.from_iterable(docker_helper.get_events_observable()) \
+            .do_action(lambda e: on_container_event(e))
+        events = container_events \
             .where(lambda e: is_configured_event(e)) \
-            .map(lambda e: e['id']) \
-            .map(lambda cid: docker_helper.check_container(cid, CheckSource.Event, remove_from_cache=True))
+            .map(lambda e: e['id'])
+        events = event_coalescer.coalesce(events) \
+            .flat_map(lambda cid: Observable.start(
+                lambda: docker_helper.check_container(cid, CheckSource.Event, remove_from_cache=True),
+                scheduler=pipeline_scheduler))
 
     if config.run_periodic:
-        periodic = Observable.interval(config.interval_sec * 1000)
+        periodic = Observable.interval(config.priority_scan_tick_sec * 1000 if scan_scheduler is not None
+                                       else config.interval_sec * 1000 / config.scan_buckets)
 
         if config.immediate_periodical_start:
             flask_app.logger.debug("Run periodic immediately")
             periodic = periodic.start_with(-1)
 
-        periodic = periodic.observe_on(scheduler=task_scheduler) \
-            .map(lambda _: docker_helper.check_containers(CheckSource.Periodic)) \
+        periodic = periodic.observe_on(scheduler=pipeline_scheduler) \
+            .map(lambda tick: run_periodic_check(tick)) \
             .flat_map(lambda c: c)
 
     detections = Observable.empty()
-    if config.run_start_events:
+    if watch_events:
         detections = detections.merge(events)
     if config.run_periodic:
         detections = detections.merge(periodic)
 
     verdicts = detections \
-        .map(lambda container: judge.should_be_killed(container)) \
-        .where(lambda v: v.verdict)
+        .map(lambda container: judge.should_be_killed(container))
+    if scan_scheduler is not None:
+        verdicts = verdicts.do_action(lambda v: scan_scheduler.on_verdict(v))
+    verdicts = verdicts.where(lambda v: v.verdict)
 
     threaded_verdicts = verdicts \
         .retry() \
-        .subscribe_on(task_scheduler) \
+        .subscribe_on(subscription_scheduler) \
         .publish() \
         .auto_connect(2)
 
+    events_subs = None
     if not config.run_start_events and not config.run_periodic:
         flask_app.logger.info("Neither start events or periodic checks are enabled. Docker Enforcer will be working in "
                               "authz plugin mode only.")
+        if watch_events:
+            # no container is checked on events, but the stats of removed containers are still dropped
+            events_subs = container_events.subscribe_on(subscription_scheduler).subscribe()
     else:
         killer_subs = threaded_verdicts.subscribe(jurek)
         trigger_subs = threaded_verdicts.subscribe(trigger_handler)
 
     def on_exit(sig, frame):
         flask_app.logger.info("Stopping docker monitoring")
+        docker_helper.stop_events()
+        if events_subs is not None:
+            events_subs.dispose()
         if config.run_start_events or config.run_periodic:
             killer_subs.dispose()
             trigger_subs.dispose()
@@ -113,6 +146,31 @@ def create_app():
 app = create_app()
 
 
+def run_periodic_check(tick):
+    if scan_scheduler is not None:
+        return scan_scheduler.check_due_containers()
+    # with SCAN_BUCKETS > 1, every sub-tick checks one bucket of containers, so all of them are still checked
+    # once per CHECK_INTERVAL_S, but the load on the docker daemon is spread over the interval; the immediate
+    # start (tick -1) checks all of them
+    if tick < 0:
+        return docker_helper.check_containers(CheckSource.Periodic)
+    return docker_helper.check_containers(CheckSource.Periodic, tick % config.scan_buckets, config.scan_buckets)
+
+
+def on_container_event(e):
+    docker_helper.on_container_event(e)
+    if scan_scheduler is not None and e.get('Type') == 'container' and e.get('Action') in ('start', 'update'):
+        scan_scheduler.on_container_changed(e['id'])
+    if e.get('Type') == 'container' and e.get('Action') == 'destroy':
+        judge.forget_container(e['id'])
+        if config.stats_drop_on_destroy:
+            jurek.forget_container(e['id'])
+            # detections of the AuthZ plugin are recorded by the name of the container the request creates
+            name = e.get('Actor', {}).get('Attributes', {}).get('name')
+            if name:
+                jurek.forget_container(name)
+
+
 def is_configured_event(e):
     if e['Action'] == 'rename' and config.run_rename_events:
         return True
@@ -125,16 +183,30 @@ def is_configured_event(e):
 
 def python_file_to_json(req, file_name: str):
     try:
-        with open(file_name, "r") as file:
-            data = file.read()
+        data = render_cache.read_file(file_name)
     except IOError as e:
         data = "Error: {}".format(e.strerror)
 
     if req.accept_mimetypes.accept_html:
-        html = highlight(data, Python3Lexer(), HtmlFormatter(full=True, linenos='table'))
-        return Response(html, content_type="text/html")
+        return cached_response(req, data, Python3Lexer)
     json_res = json.dumps(data, sort_keys=True, indent=4, separators=(',', ': '))
-    return Response(json_res, content_type="application/json")
+    return cached_response(req, json_res)
+
+
+def cached_response(req, data: str, lexer=None) -> Response:
+    # the ETag is computed from the unrendered data, so a matching If-None-Match skips highlighting altogether
+    etag = RenderCache.etag(data, lexer.__name__ if lexer is not None else "json")
+    if req.if_none_match.contains(etag):
+        res = Response(status=304)
+    elif lexer is not None:
+        html = render_cache.render(etag, data,
+                                   lambda d: highlight(d, lexer(), HtmlFormatter(full=True, linenos='table')))
+        res = Response(html, content_type="text/html")
+    else:
+        res = Response(data, content_type="application/json")
+    res.set_etag(etag)
+    res.vary.add("Accept")
+    return res
 
 
 @app.route('/rules')
@@ -152,9 +224,22 @@ def show_triggers():
     return python_file_to_json(request, "triggers/triggers.py")
 
 
+@app.route('/debug/rules/profile')
+def show_rules_profile():
+    data = {"enabled": judge.profiler is not None or requests_judge.profiler is not None,
+            "rules": judge.profiler.get_ranking() if judge.profiler is not None else [],
+            "request_rules": requests_judge.profiler.get_ranking() if requests_judge.profiler is not None else []}
+    return to_formatted_json(json.dumps(data, sort_keys=True, indent=4, separators=(',', ': ')))
+
+
 @app.route('/metrics')
 def show_metrics():
-    data = jurek.get_stats().to_prometheus_stats_format()
+    data = jurek.get_stats().to_prometheus_stats_format() + docker_helper.to_prometheus_stats_format() \
+        + judge.to_prometheus_stats_format() + render_cache.to_prometheus_stats_format() \
+        + pipeline_scheduler.to_prometheus_stats_format() + event_coalescer.to_prometheus_stats_format() \
+        + (scan_scheduler.to_prometheus_stats_format() if scan_scheduler is not None else "") \
+        + api_guard.to_prometheus_stats_format() \
+        + metrics.to_prometheus_stats_format()
     return Response(data, content_type="text/plain; version=0.0.4")
 
 
@@ -165,7 +250,10 @@ def show_stats():
 
 @app.route('/recent')
 def show_recent_stats():
-    return show_filtered_stats(lambda c: c.last_timestamp > docker_helper.last_check_containers_run_start_timestamp)
+    # priority checks run every tick, so the recent ones are the detections from the time every container was due
+    since = docker_helper.last_check_containers_run_start_timestamp if scan_scheduler is None \
+        else scan_scheduler.get_recent_window_start()
+    return show_filtered_stats(lambda _: True, since=since)
 
 
 @app.route('/config')
@@ -174,30 +262,58 @@ def show_config():
     return to_formatted_json(data)
 
 
-def show_filtered_stats(stats_filter):
+def parse_since(value: str) -> datetime.datetime:
+    # detections are timestamped in naive UTC
+    since = datetime.datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+    if since.tzinfo is not None:
+        since = since.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return since
+
+
+def show_filtered_stats(stats_filter, since: Optional[datetime.datetime] = None):
+    if request.args.get('since'):
+        try:
+            since = parse_since(request.args.get('since'))
+        except ValueError as e:
+            return Response(json.dumps({"error": "Invalid 'since' value: {0}".format(e)}), status=400,
+                            content_type="application/json")
     show_all_violated_rules: bool = request.args.get('show_all_violated_rules') == '1'
     show_image_and_labels: bool = request.args.get('show_image_and_labels') == '1'
+    offset: int = max(0, request.args.get('offset', 0, type=int))
+    limit: Optional[int] = request.args.get('limit', None, type=int)
+    fields: Optional[List[str]] = request.args.get('fields').split(",") if request.args.get('fields') else None
 
-    data = '{\n'
+    header = '{\n'
     if config.run_periodic:
-        data += '"last_full_check_run_timestamp_start": "{0}",\n' \
+        header += '"last_full_check_run_timestamp_start": "{0}",\n' \
            '"last_full_check_run_timestamp_end": "{1}",\n' \
            '"last_full_check_run_time": "{2}",\n'.format(
             docker_helper.last_check_containers_run_start_timestamp,
             docker_helper.last_check_containers_run_end_timestamp,
             docker_helper.last_check_containers_run_time,
             )
+    header += '"detections":\n'
+    detections = jurek.get_stats().iter_json_detail_stats(stats_filter, show_all_violated_rules,
+                                                          show_image_and_labels, offset,
+                                                          max(0, limit) if limit is not None else None, fields,
+                                                          since)
 
-    data += '"detections":\n{}\n}}'.format(
-        jurek.get_stats().to_json_detail_stats(stats_filter, show_all_violated_rules, show_image_and_labels))
-    return to_formatted_json(data)
+    def generate():
+        yield header
+        yield from detections
+        yield '\n}'
+
+    if request.accept_mimetypes.accept_html:
+        return to_formatted_json("".join(generate()))
+    return Response(generate(), content_type="application/json")
 
 
 def to_formatted_json(data):
     if request.accept_mimetypes.accept_html:
-        html = highlight(data, JsonLexer(), HtmlFormatter(full=True, linenos='table'))
-        return Response(html, content_type="text/html")
-    return Response(data, content_type="application/json")
+        return cached_response(request, data, JsonLexer)
+    if request.method != 'GET':
+        return Response(data, content_type="application/json")
+    return cached_response(request, data)
 
 
 @app.route("/Plugin.Activate", methods=['POST'])
@@ -212,10 +328,15 @@ def authz_response():
 
 @app.route("/AuthZPlugin.AuthZReq", methods=['POST'])
 def authz_request():
-    app.logger.debug("New AuthZ Request: {}".format(request.data))
+    with metrics.authz_request_duration.time():
+        return judge_authz_request()
+
+
+def judge_authz_request():
+    if app.logger.isEnabledFor(logging.DEBUG):
+        app.logger.debug("New AuthZ Request: {}".format(request.data))
     try:
-        json_data = json.loads(request.data.decode(request.charset))
-        json_data = docker_helper.rename_keys_to_lower(json_data)
+        json_data = AuthzRequest.parse(request.get_data())
         url = parse.urlparse(json_data["requesturi"])
     except Exception as e:
         app.logger.error("Error while trying to parse incoming message, resolving to default action. Error was: {}"
@@ -224,18 +345,26 @@ def authz_request():
     json_data["parseduri"] = url
     if config.log_authz_requests:
         log_authz_req(json_data)
+    is_create = url.path.endswith("/create") and containers_regex.match(url.path) is not None
+    # most API calls (pings, listings, log streams) have no request rule declared for them
+    if not is_create and not requests_judge.has_rules_for(json_data):
+        return to_formatted_json(json.dumps({"Allow": True}))
     verdict = requests_judge.should_be_killed(json_data)
     if verdict.verdict:
         return process_positive_verdict(verdict, json_data, register=False)
 
-    operation = url.path.split("/")[-1]
-    if containers_regex.match(url.path) and operation == "create" and "requestbody" in json_data:
-        int_bytes = b64decode(json_data["requestbody"])
-        int_json = json.loads(int_bytes.decode(request.charset))
+    if is_create and json_data.has_body():
         tls_user = json_data["user"] if "user" in json_data and json_data["user"] != '' else "[unknown]"
-        int_json = docker_helper.rename_keys_to_lower(int_json)
-        container = make_container_periodic_check_compatible(int_json, url, tls_user)
-        verdict = judge.should_be_killed(container)
+        cache_key = judge.get_verdict_cache_key(json_data.body_digest(), get_create_container_name(url), tls_user)
+        verdict = None
+        if cache_key is not None:
+            verdict = judge.get_cached_verdict(
+                cache_key, lambda: make_container_periodic_check_compatible(json_data.body_json(), url, tls_user))
+        if verdict is None:
+            container = make_container_periodic_check_compatible(json_data.body_json(), url, tls_user)
+            verdict = judge.should_be_killed(container)
+            if cache_key is not None:
+                judge.remember_verdict(cache_key, verdict)
         if verdict.verdict:
             return process_positive_verdict(verdict, json_data)
     return to_formatted_json(json.dumps({"Allow": True}))
@@ -252,10 +381,13 @@ def log_authz_req(json_data):
                     .format(user_info, json_data["requestmethod"], json_data["requesturi"]))
 
 
-def make_container_periodic_check_compatible(cont_json, url, owner):
+def get_create_container_name(url):
     url_params = parse.parse_qs(url.query)
-    cont_json["name"] = "<unnamed_container>" if "name" not in url_params else url_params["name"][0]
-    cont_json = docker_helper.rename_keys_to_lower(cont_json)
+    return "<unnamed_container>" if "name" not in url_params else url_params["name"][0]
+
+
+def make_container_periodic_check_compatible(cont_json, url, owner):
+    cont_json["name"] = get_create_container_name(url)
     cont_json["config"] = {}
     cont_json["config"]["labels"] = cont_json.get("labels", [])
     cont_json["hostconfig"] = cont_json.get("hostconfig", {})
@@ -0,0 +1,193 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Optional, Tuple
+
+from docker.errors import NotFound
+
+from dockerenforcer.config import Config
+from dockerenforcer.metrics import docker_api_call
+
+logger = logging.getLogger("docker_enforcer")
+
+
+class CallLimiter:
+    # A token bucket (holding at most a second worth of calls) combined with a cap on calls in flight. Background
+    # callers (periodic checks) wait while any foreground caller (AuthZ requests, events, stopping containers)
+    # is waiting, so the scan never takes the capacity the other ones need.
+    def __init__(self, rate_per_sec: float = 0, max_in_flight: int = 0) -> None:
+        super().__init__()
+        self._condition = threading.Condition()
+        self._rate_per_sec: float = rate_per_sec
+        self._max_in_flight: int = max_in_flight
+        self._tokens: float = max(1.0, rate_per_sec)
+        self._last_refill: float = time.monotonic()
+        self._foreground_waiting: int = 0
+        self.in_flight: int = 0
+        self.throttled: int = 0
+
+    def _get_token_wait(self) -> float:
+        if self._rate_per_sec <= 0:
+            return 0
+        now = time.monotonic()
+        self._tokens = min(max(1.0, self._rate_per_sec),
+                           self._tokens + (now - self._last_refill) * self._rate_per_sec)
+        self._last_refill = now
+        return 0 if self._tokens >= 1 else (1 - self._tokens) / self._rate_per_sec
+
+    def acquire(self, background: bool) -> None:
+        with self._condition:
+            if not background:
+                self._foreground_waiting += 1
+            throttled = False
+            try:
+                while True:
+                    if (self._max_in_flight <= 0 or self.in_flight < self._max_in_flight) \
+                            and (not background or self._foreground_waiting == 0):
+                        wait = self._get_token_wait()
+                        if wait <= 0:
+                            if self._rate_per_sec > 0:
+                                self._tokens -= 1
+                            self.in_flight += 1
+                            return
+                    else:
+                        wait = None
+                    if not throttled:
+                        throttled = True
+                        self.throttled += 1
+                    self._condition.wait(wait)
+            finally:
+                if not background:
+                    self._foreground_waiting -= 1
+                    self._condition.notify_all()
+
+    def release(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+
+class CircuitBreaker:
+    # Opens when the average latency or the error rate of the last window_size docker API calls crosses its
+    # threshold; while it's open, periodic checks are paused, so they don't add to the load of a struggling daemon.
+    # Calls that are slow by design are recorded without a latency and only count for the error rate.
+    def __init__(self, latency_threshold_sec: float = 0, error_rate_threshold: float = 0, window_size: int = 50,
+                 pause_sec: float = 60) -> None:
+        super().__init__()
+        self._padlock = threading.Lock()
+        self._latency_threshold_sec: float = latency_threshold_sec
+        self._error_rate_threshold: float = error_rate_threshold
+        self._window_size: int = max(1, window_size)
+        self._pause_sec: float = pause_sec
+        self._window: Deque[Tuple[Optional[float], bool]] = deque(maxlen=self._window_size)
+        self._latency_sum: float = 0.0
+        self._timed: int = 0
+        self._errors: int = 0
+        self._open_until: float = 0.0
+        self.opened: int = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._latency_threshold_sec > 0 or self._error_rate_threshold > 0
+
+    def record(self, latency_sec: Optional[float], failed: bool) -> None:
+        if not self.enabled:
+            return
+        with self._padlock:
+            if len(self._window) == self._window_size:
+                old_latency, old_failed = self._window[0]
+                if old_latency is not None:
+                    self._latency_sum -= old_latency
+                    self._timed -= 1
+                self._errors -= old_failed
+            self._window.append((latency_sec, failed))
+            if latency_sec is not None:
+                self._latency_sum += latency_sec
+                self._timed += 1
+            self._errors += failed
+            if len(self._window) < self._window_size or self.is_open():
+                return
+            latency = self._latency_sum / self._timed if self._timed > 0 else 0.0
+            error_rate = self._errors / len(self._window)
+            if not (0 < self._latency_threshold_sec <= latency or 0 < self._error_rate_threshold <= error_rate):
+                return
+            self._open_until = time.monotonic() + self._pause_sec
+            self.opened += 1
+            # the calls made before the pause shouldn't open the breaker again right after it
+            self._window.clear()
+            self._latency_sum, self._timed, self._errors = 0.0, 0, 0
+        logger.warning("Docker API average latency is {0:.3f}s and error rate {1:.0%}, pausing periodic checks for "
+                       "{2}s".format(latency, error_rate, self._pause_sec))
+
+    def is_open(self) -> bool:
+        return time.monotonic() < self._open_until
+
+
+class DockerApiGuard:
+    def __init__(self, config: Config) -> None:
+        super().__init__()
+        self._local = threading.local()
+        categories = set(config.docker_api_rate_limits) | set(config.docker_api_max_in_flight)
+        self._limiters: Dict[str, CallLimiter] = {
+            c: CallLimiter(config.docker_api_rate_limits.get(c, 0), config.docker_api_max_in_flight.get(c, 0))
+            for c in sorted(categories)}
+        self.circuit_breaker = CircuitBreaker(config.circuit_breaker_latency_ms / 1000,
+                                              config.circuit_breaker_error_rate, config.circuit_breaker_window,
+                                              config.circuit_breaker_pause_sec)
+
+    @contextmanager
+    def background(self, enabled: bool = True) -> Iterator[None]:
+        previous = getattr(self._local, "background", False)
+        self._local.background = enabled
+        try:
+            yield
+        finally:
+            self._local.background = previous
+
+    def periodic_checks_allowed(self) -> bool:
+        return not self.circuit_breaker.is_open()
+
+    @contextmanager
+    def call(self, category: str, timed: bool = True) -> Iterator[None]:
+        # timed=False for calls that take long on a healthy daemon too, like the regular stats call waiting for a 2nd
+        # CPU sample, so their latency doesn't open the circuit breaker
+        limiter = self._limiters.get(category)
+        if limiter is not None:
+            limiter.acquire(getattr(self._local, "background", False))
+        start = time.perf_counter()
+        failed = False
+        try:
+            with docker_api_call(category):
+                yield
+        except NotFound:
+            raise
+        except Exception:
+            failed = True
+            raise
+        finally:
+            if limiter is not None:
+                limiter.release()
+            self.circuit_breaker.record(time.perf_counter() - start if timed else None, failed)
+
+    def to_prometheus_stats_format(self) -> str:
+        res = ""
+        if self._limiters:
+            res += "# HELP docker_api_in_flight The current number of docker API calls in flight.\n" \
+                   "# TYPE docker_api_in_flight gauge\n"
+            res += "".join("docker_api_in_flight{{call=\"{0}\"}} {1}\n".format(c, l.in_flight)
+                           for c, l in self._limiters.items())
+            res += "# HELP docker_api_throttled_total The total number of docker API calls delayed by the limits.\n" \
+                   "# TYPE docker_api_throttled_total counter\n"
+            res += "".join("docker_api_throttled_total{{call=\"{0}\"}} {1}\n".format(c, l.throttled)
+                           for c, l in self._limiters.items())
+        if self.circuit_breaker.enabled:
+            res += """# HELP docker_api_circuit_open Whether periodic checks are paused because of a struggling daemon.
+# TYPE docker_api_circuit_open gauge
+docker_api_circuit_open {0}
+# HELP docker_api_circuit_opened_total The total number of times periodic checks were paused.
+# TYPE docker_api_circuit_opened_total counter
+docker_api_circuit_opened_total {1}
+""".format(int(self.circuit_breaker.is_open()), self.circuit_breaker.opened)
+        return res
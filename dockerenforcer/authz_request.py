@@ -0,0 +1,69 @@
+import hashlib
+import re
+from base64 import b64decode
+from typing import Any, Dict, Optional
+
+from dockerenforcer.docker_helper import DockerHelper
+
+_REQUEST_BODY_START = re.compile(rb'"RequestBody"\s*:\s*"')
+_BODY_KEY = "requestbody"
+
+
+class AuthzRequest(dict):
+    # AuthZ plugin message with lowercase keys. Its "requestbody" is cut out of the raw message before parsing
+    # and is base64 decoded only when a rule or the containers/create check actually reads it.
+    def __init__(self, message: Dict[str, Any], raw_body: Optional[memoryview] = None) -> None:
+        super().__init__(message)
+        self._raw_body: Optional[memoryview] = raw_body
+        self._body_json: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def parse(cls, raw: bytes) -> 'AuthzRequest':
+        key_pos = raw.find(b'"RequestBody"')
+        match = _REQUEST_BODY_START.match(raw, key_pos) if key_pos >= 0 else None
+        if match is None:
+            return cls(DockerHelper.loads_with_lower_keys(raw))
+        # docker sends the body base64 encoded, so the JSON string ends at the first quote that follows it
+        start = match.end()
+        end = raw.find(b'"', start)
+        if end < 0:
+            return cls(DockerHelper.loads_with_lower_keys(raw))
+        # the body is replaced with an empty string, so the rest of the message stays valid JSON
+        message = DockerHelper.loads_with_lower_keys(raw[:start] + raw[end:])
+        message.pop(_BODY_KEY, None)
+        return cls(message, memoryview(raw)[start:end])
+
+    def has_body(self) -> bool:
+        return self._raw_body is not None or dict.__contains__(self, _BODY_KEY)
+
+    def body_digest(self) -> Optional[bytes]:
+        if self._raw_body is not None:
+            return hashlib.sha256(self._raw_body).digest()
+        body = dict.get(self, _BODY_KEY)
+        return hashlib.sha256(body.encode()).digest() if body is not None else None
+
+    def body_json(self) -> Dict[str, Any]:
+        if self._body_json is None:
+            body = self._raw_body if self._raw_body is not None else self[_BODY_KEY]
+            self._body_json = DockerHelper.loads_with_lower_keys(b64decode(body))
+        return self._body_json
+
+    def _load_body(self) -> None:
+        if self._raw_body is not None:
+            dict.__setitem__(self, _BODY_KEY, bytes(self._raw_body).decode("ascii"))
+            self._raw_body = None
+
+    def __getitem__(self, key: str) -> Any:
+        if key == _BODY_KEY:
+            self._load_body()
+        return super().__getitem__(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key == _BODY_KEY:
+            self._load_body()
+        return super().get(key, default)
+
+    def __contains__(self, key: object) -> bool:
+        if key == _BODY_KEY:
+            return self.has_body()
+        return super().__contains__(key)
@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, Optional, Tuple
+
+
+class LruCache:
+    default_max_invalidated: int = 1000
+
+    def __init__(self, name: str, max_entries: int = 0, ttl_sec: float = 0) -> None:
+        super().__init__()
+        self._padlock = threading.Lock()
+        self._name: str = name
+        self._max_entries: int = max_entries
+        self._ttl_sec: float = ttl_sec
+        self._entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        # the generation of the last invalidation of each key, so that a value fetched before it isn't stored; only
+        # the latest ones are kept, a fetch started before the oldest of them is treated as if its key was invalidated
+        self._generation: int = 0
+        self._cleared_generation: int = 0
+        self._invalidated: 'OrderedDict[Hashable, int]' = OrderedDict()
+        self._max_invalidated: int = max_entries if max_entries > 0 else self.default_max_invalidated
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.invalidations: int = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._padlock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if self._ttl_sec > 0 and time.monotonic() - entry[0] > self._ttl_sec:
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def get_generation(self) -> int:
+        with self._padlock:
+            return self._generation
+
+    def put(self, key: Hashable, value: Any, generation: Optional[int] = None) -> bool:
+        # with a generation taken from get_generation() before the value was fetched, the value isn't stored if
+        # the key was invalidated since then, as it could be outdated already
+        with self._padlock:
+            if generation is not None and generation < self._get_invalidated_generation(key):
+                return False
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while 0 < self._max_entries < len(self._entries):
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def _get_invalidated_generation(self, key: Hashable) -> int:
+        return max(self._cleared_generation, self._invalidated.get(key, 0))
+
+    def invalidate(self, key: Hashable) -> bool:
+        with self._padlock:
+            self._generation += 1
+            self._invalidated[key] = self._generation
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self._max_invalidated:
+                self._cleared_generation = self._invalidated.popitem(last=False)[1]
+            if self._entries.pop(key, None) is None:
+                return False
+            self.invalidations += 1
+            return True
+
+    def retain_only(self, keys: Iterable[Hashable]) -> None:
+        keys = set(keys)
+        with self._padlock:
+            diff = [k for k in self._entries.keys() if k not in keys]
+            for key in diff:
+                del self._entries[key]
+            self.invalidations += len(diff)
+            for key in [k for k in self._invalidated.keys() if k not in keys]:
+                del self._invalidated[key]
+
+    def clear(self) -> None:
+        with self._padlock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._generation += 1
+            self._cleared_generation = self._generation
+            self._invalidated.clear()
+
+    def keys(self) -> Iterable[Hashable]:
+        with self._padlock:
+            return list(self._entries.keys())
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __getitem__(self, key: Hashable) -> Any:
+        return self._entries[key][1]
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self.put(key, value)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def hit_ratio(self) -> Optional[float]:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else None
+
+    def to_prometheus_stats_format(self) -> str:
+        with self._padlock:
+            ratio = self.hit_ratio()
+            res = """# HELP {0}_hits_total The total number of lookups that found an entry in the {1}.
+# TYPE {0}_hits_total counter
+{0}_hits_total {2}
+# HELP {0}_misses_total The total number of lookups that didn't find an entry in the {1}.
+# TYPE {0}_misses_total counter
+{0}_misses_total {3}
+# HELP {0}_evictions_total The total number of entries evicted from the {1} because of its size or age limits.
+# TYPE {0}_evictions_total counter
+{0}_evictions_total {4}
+# HELP {0}_invalidations_total The total number of entries removed from the {1} because they became outdated.
+# TYPE {0}_invalidations_total counter
+{0}_invalidations_total {5}
+# HELP {0}_entries The current number of entries in the {1}.
+# TYPE {0}_entries gauge
+{0}_entries {6}
+# HELP {0}_hit_ratio The fraction of lookups that found an entry in the {1}.
+# TYPE {0}_hit_ratio gauge
+{0}_hit_ratio {7}
+""".format(self._name, self._name.replace("_", " "), self.hits, self.misses, self.evictions, self.invalidations,
+           len(self._entries), ratio if ratio is not None else "NaN")
+        return res
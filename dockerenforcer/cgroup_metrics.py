@@ -0,0 +1,160 @@
+import datetime
+import logging
+import os
+from typing import Dict, Any, Optional, List, Tuple
+
+logger = logging.getLogger("docker_enforcer")
+
+NANOSECONDS_IN_SECOND = 10 ** 9
+
+
+# Builds container metrics in the shape returned by the docker stats API, but reads them straight from the
+# host's cgroup v1 or v2 filesystem, created by either "cgroupfs" or "systemd" docker cgroup driver
+class CgroupMetricsReader:
+    def __init__(self, cgroup_root: str, proc_stat_path: str = "/proc/stat") -> None:
+        super().__init__()
+        self._cgroup_root: str = cgroup_root
+        self._proc_stat_path: str = proc_stat_path
+        self._clock_ticks: int = os.sysconf('SC_CLK_TCK')
+        self._host_memory: int = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        self._unified: bool = os.path.exists(os.path.join(cgroup_root, "cgroup.controllers"))
+
+    def get_metrics(self, container_id: str) -> Optional[Dict[str, Any]]:
+        if self._unified:
+            metrics = self._get_v2_metrics(container_id)
+        else:
+            metrics = self._get_v1_metrics(container_id)
+        if metrics is None:
+            logger.warning("Cgroup of container {0} not found in {1}".format(container_id, self._cgroup_root))
+            return None
+        system_cpu_usage, online_cpus = self._read_system_cpu()
+        metrics['cpu_stats']['system_cpu_usage'] = system_cpu_usage
+        metrics['cpu_stats']['online_cpus'] = online_cpus
+        metrics['read'] = datetime.datetime.utcnow().isoformat() + "Z"
+        return metrics
+
+    def _find_container_dir(self, base: str, container_id: str) -> Optional[str]:
+        for candidate in (os.path.join(base, "docker", container_id),
+                          os.path.join(base, "system.slice", "docker-{0}.scope".format(container_id))):
+            if os.path.isdir(candidate):
+                return candidate
+        return None
+
+    def _get_v1_metrics(self, container_id: str) -> Optional[Dict[str, Any]]:
+        memory_dir = self._find_container_dir(os.path.join(self._cgroup_root, "memory"), container_id)
+        cpuacct_dir = self._find_container_dir(os.path.join(self._cgroup_root, "cpuacct"), container_id)
+        if memory_dir is None or cpuacct_dir is None:
+            return None
+        cpu_dir = self._find_container_dir(os.path.join(self._cgroup_root, "cpu"), container_id)
+        pids_dir = self._find_container_dir(os.path.join(self._cgroup_root, "pids"), container_id)
+
+        cpuacct_stat = self._read_key_values(os.path.join(cpuacct_dir, "cpuacct.stat"))
+        throttling = self._read_key_values(os.path.join(cpu_dir, "cpu.stat")) if cpu_dir else {}
+        return {
+            'memory_stats': {
+                'usage': self._read_int(os.path.join(memory_dir, "memory.usage_in_bytes")),
+                'max_usage': self._read_int(os.path.join(memory_dir, "memory.max_usage_in_bytes")),
+                'limit': min(self._read_int(os.path.join(memory_dir, "memory.limit_in_bytes")), self._host_memory),
+                'failcnt': self._read_int(os.path.join(memory_dir, "memory.failcnt")),
+                'stats': self._read_key_values(os.path.join(memory_dir, "memory.stat")),
+            },
+            'cpu_stats': {
+                'cpu_usage': {
+                    'total_usage': self._read_int(os.path.join(cpuacct_dir, "cpuacct.usage")),
+                    'percpu_usage': self._read_ints(os.path.join(cpuacct_dir, "cpuacct.usage_percpu")),
+                    'usage_in_usermode': self._ticks_to_ns(cpuacct_stat.get('user', 0)),
+                    'usage_in_kernelmode': self._ticks_to_ns(cpuacct_stat.get('system', 0)),
+                },
+                'throttling_data': {
+                    'periods': throttling.get('nr_periods', 0),
+                    'throttled_periods': throttling.get('nr_throttled', 0),
+                    'throttled_time': throttling.get('throttled_time', 0),
+                },
+            },
+            'pids_stats': self._read_pids_stats(pids_dir),
+        }
+
+    def _get_v2_metrics(self, container_id: str) -> Optional[Dict[str, Any]]:
+        container_dir = self._find_container_dir(self._cgroup_root, container_id)
+        if container_dir is None:
+            return None
+
+        cpu_stat = self._read_key_values(os.path.join(container_dir, "cpu.stat"))
+        return {
+            'memory_stats': {
+                'usage': self._read_int(os.path.join(container_dir, "memory.current")),
+                'limit': min(self._read_int(os.path.join(container_dir, "memory.max"), self._host_memory),
+                             self._host_memory),
+                'stats': self._read_key_values(os.path.join(container_dir, "memory.stat")),
+            },
+            'cpu_stats': {
+                'cpu_usage': {
+                    'total_usage': cpu_stat.get('usage_usec', 0) * 1000,
+                    'usage_in_usermode': cpu_stat.get('user_usec', 0) * 1000,
+                    'usage_in_kernelmode': cpu_stat.get('system_usec', 0) * 1000,
+                },
+                'throttling_data': {
+                    'periods': cpu_stat.get('nr_periods', 0),
+                    'throttled_periods': cpu_stat.get('nr_throttled', 0),
+                    'throttled_time': cpu_stat.get('throttled_usec', 0) * 1000,
+                },
+            },
+            'pids_stats': self._read_pids_stats(container_dir),
+        }
+
+    def _read_pids_stats(self, pids_dir: Optional[str]) -> Dict[str, int]:
+        if pids_dir is None:
+            return {}
+        pids_stats = {'current': self._read_int(os.path.join(pids_dir, "pids.current"))}
+        limit = self._read_int(os.path.join(pids_dir, "pids.max"), 0)
+        if limit > 0:
+            pids_stats['limit'] = limit
+        return pids_stats
+
+    def _read_system_cpu(self) -> Tuple[int, int]:
+        system_cpu_usage = 0
+        online_cpus = 0
+        try:
+            with open(self._proc_stat_path, "r") as file:
+                for line in file:
+                    if line.startswith("cpu "):
+                        # user, nice, system, idle, iowait, irq, softirq - the same fields the docker daemon uses
+                        system_cpu_usage = self._ticks_to_ns(sum(int(v) for v in line.split()[1:8]))
+                    elif line.startswith("cpu"):
+                        online_cpus += 1
+        except (IOError, ValueError) as e:
+            logger.warning("Can't read system CPU usage from {0}: {1}".format(self._proc_stat_path, e))
+        return system_cpu_usage, online_cpus
+
+    def _ticks_to_ns(self, ticks: int) -> int:
+        return ticks * NANOSECONDS_IN_SECOND // self._clock_ticks
+
+    @staticmethod
+    def _read_int(path: str, default: int = 0) -> int:
+        try:
+            with open(path, "r") as file:
+                return int(file.read().strip())
+        except (IOError, ValueError):
+            # missing accounting files or values like "max" for unlimited resources
+            return default
+
+    @staticmethod
+    def _read_ints(path: str) -> List[int]:
+        try:
+            with open(path, "r") as file:
+                return [int(v) for v in file.read().split()]
+        except (IOError, ValueError):
+            return []
+
+    @staticmethod
+    def _read_key_values(path: str) -> Dict[str, int]:
+        values = {}
+        try:
+            with open(path, "r") as file:
+                for line in file:
+                    parts = line.split()
+                    if len(parts) == 2:
+                        values[parts[0]] = int(parts[1])
+        except (IOError, ValueError):
+            pass
+        return values
@@ -13,26 +13,71 @@ class Mode(Enum):
     Kill = 2
 
 
+class MetricsSource(Enum):
+    Docker = 1
+    Cgroup = 2
+
+
+def parse_call_limits(value: str) -> Dict[str, float]:
+    # "inspect=50,stats=20" -> {"inspect": 50.0, "stats": 20.0}
+    limits = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        call, limit = item.split("=", 1)
+        limits[call.strip()] = float(limit)
+    return limits
+
+
 class Config:
     def __init__(self) -> None:
         super().__init__()
         self.interval_sec: int = int(os.getenv('CHECK_INTERVAL_S', '600'))
         self.docker_req_timeout_sec: int = int(os.getenv('DOCKER_REQ_TIMEOUT_S', '30'))
+        self.scan_concurrency: int = max(1, int(os.getenv('SCAN_CONCURRENCY', '1')))
+        self.scan_buckets: int = max(1, int(os.getenv('SCAN_BUCKETS', '1')))
+        self.priority_scan: bool = bool(os.getenv('PRIORITY_SCAN', 'False') == 'True')
+        self.priority_scan_tick_sec: float = float(os.getenv('PRIORITY_SCAN_TICK_S', '5'))
+        self.scan_api_calls_per_sec: float = float(os.getenv('SCAN_API_CALLS_PER_S', '0'))
+        self.pipeline_workers: int = max(1, int(os.getenv('PIPELINE_WORKERS', '4')))
+        self.pipeline_queue_size: int = int(os.getenv('PIPELINE_QUEUE_SIZE', '100'))
+        self.event_coalesce_window_ms: int = int(os.getenv('EVENT_COALESCE_WINDOW_MS', '250'))
+        self.docker_api_rate_limits: Dict[str, float] = parse_call_limits(os.getenv('DOCKER_API_RATE_LIMITS', ''))
+        self.docker_api_max_in_flight: Dict[str, int] = {
+            k: int(v) for k, v in parse_call_limits(os.getenv('DOCKER_API_MAX_IN_FLIGHT', '')).items()}
+        self.circuit_breaker_latency_ms: float = float(os.getenv('CIRCUIT_BREAKER_LATENCY_MS', '0'))
+        self.circuit_breaker_error_rate: float = float(os.getenv('CIRCUIT_BREAKER_ERROR_RATE', '0'))
+        self.circuit_breaker_window: int = int(os.getenv('CIRCUIT_BREAKER_WINDOW', '50'))
+        self.circuit_breaker_pause_sec: float = float(os.getenv('CIRCUIT_BREAKER_PAUSE_S', '60'))
         self.docker_socket: str = os.getenv('DOCKER_SOCKET', 'unix:///var/run/docker.sock')
         self.white_list: str = os.getenv('WHITE_LIST', 'docker-enforcer,docker_enforcer').split(",")
         self.image_white_list: str = os.getenv('IMAGE_WHITE_LIST', '').split(",")
         self.mode: Mode = Mode[os.getenv('MODE', 'WARN').lower().capitalize()]
         self.cache_params: bool = bool(os.getenv('CACHE_PARAMS', 'True') == 'True')
+        self.cache_max_entries: int = int(os.getenv('CACHE_MAX_ENTRIES', '10000'))
+        self.cache_ttl_sec: int = int(os.getenv('CACHE_TTL_S', '0'))
+        self.stats_max_entries: int = int(os.getenv('STATS_MAX_ENTRIES', '10000'))
+        self.stats_max_age_sec: int = int(os.getenv('STATS_MAX_AGE_S', '0'))
+        self.stats_drop_on_destroy: bool = bool(os.getenv('STATS_DROP_ON_DESTROY', 'False') == 'True')
         self.log_level: str = os.getenv('LOG_LEVEL', 'INFO')
         self.disable_params: bool = bool(os.getenv('DISABLE_PARAMS', 'False') == 'True')
         self.disable_metrics: bool = bool(os.getenv('DISABLE_METRICS', 'False') == 'True')
+        self.stats_one_shot: bool = bool(os.getenv('STATS_ONE_SHOT', 'False') == 'True')
+        self.metrics_source: MetricsSource = MetricsSource[os.getenv('METRICS_SOURCE', 'DOCKER').lower().capitalize()]
+        self.cgroup_root: str = os.getenv('CGROUP_ROOT', '/sys/fs/cgroup')
         self.run_start_events: bool = bool(os.getenv('RUN_START_EVENTS', 'False') == 'True')
         self.run_update_events: bool = bool(os.getenv('RUN_UPDATE_EVENTS', 'False') == 'True')
         self.run_rename_events: bool = bool(os.getenv('RUN_RENAME_EVENTS', 'False') == 'True')
         self.run_periodic: bool = bool(os.getenv('RUN_PERIODIC', 'True') == 'True')
         self.immediate_periodical_start: bool = bool(os.getenv('IMMEDIATE_PERIODICAL_START', 'False') == 'True')
         self.stop_on_first_violation: bool = bool(os.getenv('STOP_ON_FIRST_VIOLATION', 'True') == 'True')
+        self.incremental_checks: bool = bool(os.getenv('INCREMENTAL_CHECKS', 'False') == 'True')
         self.log_authz_requests: bool = bool(os.getenv('LOG_AUTHZ_REQUESTS', 'False') == 'True')
+        self.authz_verdict_cache_size: int = int(os.getenv('AUTHZ_VERDICT_CACHE_SIZE', '0'))
+        self.rules_profiling: bool = bool(os.getenv('RULES_PROFILING', 'False') == 'True')
+        self.rule_time_budget_ms: float = float(os.getenv('RULE_TIME_BUDGET_MS', '0'))
+        self.rule_time_budget_skip_after: int = int(os.getenv('RULE_TIME_BUDGET_SKIP_AFTER', '0'))
+        self.render_cache_size: int = int(os.getenv('RENDER_CACHE_SIZE', '16'))
         self.default_allow: bool = bool(os.getenv('DEFAULT_ACTION_ALLOW', 'True') == 'True')
         self.version: str = version
         self.white_list_separator: str = "|"
@@ -41,7 +86,8 @@ class Config:
 class ConfigEncoder(JSONEncoder):
     def default(self, o: Config) -> Dict[str, str]:
         out_dict = copy.deepcopy(o).__dict__
-        mode = out_dict.pop("mode")
-        out_dict["mode"] = mode.__str__()
+        for key, value in out_dict.items():
+            if isinstance(value, Enum):
+                out_dict[key] = value.__str__()
         out_dict["version"] = version
         return out_dict
@@ -0,0 +1,215 @@
+import itertools
+import logging
+import os
+import sys
+import sysconfig
+import types
+from typing import Any, Callable, FrozenSet, Optional, Set
+
+logger = logging.getLogger("docker_enforcer")
+
+
+class DataSource:
+    Params: str = "params"
+    Metrics: str = "metrics"
+    Position: str = "position"
+
+
+ALL_DATA_SOURCES: FrozenSet[str] = frozenset([DataSource.Params, DataSource.Metrics, DataSource.Position])
+_MAX_FOLLOWED_FUNCTIONS_DEPTH = 3
+_CONVERTED_TO_STRING = "__str__"
+_CONTAINER_NAME_NAMES = frozenset(["name", "cid", _CONVERTED_TO_STRING.lower()])
+_READS_ALL_NAMES = frozenset(["__dict__", "vars"])
+# sys.stdlib_module_names only exists on python 3.10+, elsewhere a module is from stdlib when it's built in or its
+# file is in the stdlib directory, but not in the site-packages below it
+_STDLIB_MODULES = frozenset(getattr(sys, "stdlib_module_names", ())) | frozenset(sys.builtin_module_names)
+_STDLIB_DIRS = tuple(sorted({os.path.realpath(sysconfig.get_paths()[p]) for p in ("stdlib", "platstdlib")}))
+_THIRD_PARTY_DIRS = frozenset(["site-packages", "dist-packages"])
+_stdlib_modules_found: Set[str] = set()
+
+
+class _AnyValue:
+    # stands for any value read from a probed container, so that a rule can be evaluated as far as possible;
+    # string keys and call arguments are recorded, as a rule can read c.params[NAME] with NAME = "name"
+    def __init__(self, accessed: Set[str]) -> None:
+        super().__init__()
+        self._accessed = accessed
+
+    def _record(self, *values: Any) -> None:
+        self._accessed.update(v for v in values if isinstance(v, str))
+
+    def __getattr__(self, name: str) -> '_AnyValue':
+        self._record(name)
+        return self
+
+    def __getitem__(self, key: Any) -> '_AnyValue':
+        self._record(key)
+        return self
+
+    def __call__(self, *args, **kwargs) -> '_AnyValue':
+        self._record(*args)
+        return self
+
+    def __contains__(self, item: Any) -> bool:
+        return True
+
+    def __iter__(self):
+        return iter([self])
+
+    def __len__(self) -> int:
+        return 1
+
+    def __bool__(self) -> bool:
+        return True
+
+    def __eq__(self, other: Any) -> bool:
+        return True
+
+    def __hash__(self) -> int:
+        return 0
+
+    def __str__(self) -> str:
+        return ""
+
+    def _any(self, *args: Any) -> '_AnyValue':
+        return self
+
+    __ne__ = __lt__ = __le__ = __gt__ = __ge__ = __eq__
+    __add__ = __radd__ = __sub__ = __rsub__ = __mul__ = __rmul__ = __truediv__ = __rtruediv__ = _any
+    __floordiv__ = __rfloordiv__ = __mod__ = __rmod__ = __pow__ = __rpow__ = _any
+
+
+class _ProbeContainer:
+    def __init__(self, accessed: Set[str]) -> None:
+        super().__init__()
+        self._accessed = accessed
+
+    def __getattr__(self, name: str) -> _AnyValue:
+        self._accessed.add(name)
+        return _AnyValue(self._accessed)
+
+    def __str__(self) -> str:
+        self._accessed.update([DataSource.Params, _CONVERTED_TO_STRING])
+        return ""
+
+
+class RuleUsage:
+    # what a rule reads from the container it checks; a rule is assumed to read everything (the container name
+    # included) unless it's a plain function, all the objects it references could be followed and probing it
+    # didn't raise an exception
+    # probe=False only analyzes the code, for callables that could have side effects, like triggers
+    def __init__(self, rule: Callable[..., Any], *extra_args: Any, probe: bool = True) -> None:
+        super().__init__()
+        self._names: Optional[FrozenSet[str]] = None
+        if not isinstance(rule, types.FunctionType):
+            return
+        used = set()
+        if not _collect_code_names(rule, used, set(), _MAX_FOLLOWED_FUNCTIONS_DEPTH) \
+                or not used.isdisjoint(_READS_ALL_NAMES):
+            logger.debug("Rule {0} uses objects that can't be analyzed, assuming it reads all data".format(rule))
+            return
+        if not probe:
+            self._names = frozenset(used)
+            return
+        try:
+            rule(_ProbeContainer(used), *extra_args)
+        except Exception as e:
+            logger.debug("Probing rule {0} raised {1}: {2}, assuming it reads all data"
+                         .format(rule, e.__class__.__name__, e))
+            return
+        self._names = frozenset(used)
+
+    @property
+    def data_sources(self) -> FrozenSet[str]:
+        return ALL_DATA_SOURCES if self._names is None else self._names & ALL_DATA_SOURCES
+
+    @property
+    def reads_container_name(self) -> bool:
+        return self._names is None or any(n.lower() in _CONTAINER_NAME_NAMES for n in self._names)
+
+
+def get_rule_data_sources(rule: Callable[..., Any], *extra_args: Any) -> FrozenSet[str]:
+    return RuleUsage(rule, *extra_args).data_sources
+
+
+def _collect_code_names(func: types.FunctionType, names: Set[str], visited: Set[int], depth: int) -> bool:
+    # returns False if the function references something that can't be followed, like a function too deep in the
+    # calls chain, a non standard library module or class, or an object whose methods could read the container
+    if id(func.__code__) in visited:
+        return True
+    visited.add(id(func.__code__))
+    code_names = set()
+    _collect_names_from_code(func.__code__, code_names)
+    names.update(code_names)
+
+    referenced = [func.__globals__[name] for name in code_names if name in func.__globals__]
+    if func.__closure__:
+        referenced.extend(cell.cell_contents for cell in func.__closure__ if _is_cell_set(cell))
+    if func.__defaults__:
+        referenced.extend(func.__defaults__)
+    if func.__kwdefaults__:
+        referenced.extend(func.__kwdefaults__.values())
+    return all(_follow_reference(ref, names, visited, depth) for ref in referenced)
+
+
+def _follow_reference(ref: Any, names: Set[str], visited: Set[int], depth: int) -> bool:
+    if isinstance(ref, types.FunctionType):
+        return depth > 0 and _collect_code_names(ref, names, visited, depth - 1)
+    if isinstance(ref, types.ModuleType):
+        return _is_from_stdlib(ref.__name__)
+    if isinstance(ref, type):
+        return _is_from_stdlib(ref.__module__)
+    if isinstance(ref, str):
+        # the value of a global can be used as a key or attribute name
+        names.add(ref)
+        return True
+    if isinstance(ref, (list, tuple, set, frozenset, dict)):
+        if id(ref) in visited:
+            return True
+        visited.add(id(ref))
+        items = itertools.chain(ref.keys(), ref.values()) if isinstance(ref, dict) else ref
+        return all(_follow_reference(item, names, visited, depth) for item in items)
+    return _is_from_stdlib(type(ref).__module__)
+
+
+def _is_from_stdlib(module_name: Optional[str]) -> bool:
+    if module_name is None:
+        return False
+    top_name = module_name.split(".")[0]
+    if top_name in _STDLIB_MODULES or top_name in _stdlib_modules_found:
+        return True
+    module = sys.modules.get(top_name)
+    spec = getattr(module, "__spec__", None)
+    if getattr(spec, "origin", None) == "frozen":
+        found = True
+    else:
+        path = getattr(module, "__file__", None)
+        found = path is not None and _is_in_stdlib_dir(os.path.realpath(path))
+    if found:
+        _stdlib_modules_found.add(top_name)
+    return found
+
+
+def _is_in_stdlib_dir(path: str) -> bool:
+    for stdlib_dir in _STDLIB_DIRS:
+        if path.startswith(stdlib_dir + os.sep):
+            return not _THIRD_PARTY_DIRS.intersection(os.path.relpath(path, stdlib_dir).split(os.sep))
+    return False
+
+
+def _collect_names_from_code(code: types.CodeType, names: Set[str]) -> None:
+    # attribute and global names, plus string constants to catch lookups like getattr(c, "metrics")
+    names.update(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, str):
+            names.add(const)
+        elif isinstance(const, types.CodeType):
+            _collect_names_from_code(const, names)
+
+
+def _is_cell_set(cell) -> bool:
+    try:
+        cell.cell_contents
+    except ValueError:
+        return False
+    return True
@@ -1,21 +1,35 @@
 import datetime
+import json
+import math
 import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from json import JSONDecodeError
 
 import time
 import logging
-from typing import Dict, Any, Iterable, Optional
+from typing import Dict, Any, Iterable, Optional, Tuple, FrozenSet, List, Set, Union
 
 from docker import APIClient
 from docker.errors import NotFound
+from docker.utils import version_gte
 from requests import ReadTimeout
 from requests.packages.urllib3.exceptions import ProtocolError
 
-from dockerenforcer.config import Config
+from dockerenforcer.cache import LruCache
+from dockerenforcer.cgroup_metrics import CgroupMetricsReader
+from dockerenforcer.config import Config, MetricsSource
+from dockerenforcer.data_sources import ALL_DATA_SOURCES, DataSource
+from dockerenforcer.api_guard import DockerApiGuard
+from dockerenforcer.metrics import events_reconnects, periodic_scan_duration
 
 logger = logging.getLogger("docker_enforcer")
 
 
+def _dict_with_lower_keys(pairs: List[Tuple[str, Any]]) -> Dict[str, Any]:
+    return {key.lower(): value for key, value in pairs}
+
+
 class CheckSource:
     AuthzPlugin: str = "authz_plugin"
     Periodic: str = "periodic"
@@ -23,6 +37,8 @@ class CheckSource:
 
 
 class Container:
+    __slots__ = ('params', 'check_source', 'position', 'metrics', 'cid', 'owner')
+
     def __init__(self, cid: str, params: Dict[str, Any], metrics: Dict[str, Any], position: int,
                  check_source: CheckSource, owner: str="[unknown]") -> None:
         super().__init__()
@@ -38,34 +54,54 @@ class Container:
 
 
 class DockerHelper:
-    def __init__(self, config: Config, client: APIClient) -> None:
+    cache_invalidating_actions = frozenset(['start', 'update', 'rename', 'die', 'destroy'])
+    events_reconnect_delay_sec: float = 5
+    cpu_sample_interval_sec: float = 1
+
+    def __init__(self, config: Config, client: APIClient, api_guard: Optional[DockerApiGuard] = None) -> None:
         super().__init__()
         self._padlock = threading.Lock()
         self._check_in_progress: bool = False
         self._config: Config = config
         self._client: APIClient = client
-        self._params_cache: Dict[str, Any] = {}
+        self._api_guard: DockerApiGuard = api_guard if api_guard is not None else DockerApiGuard(config)
+        self._params_cache: LruCache = LruCache("params_cache", config.cache_max_entries, config.cache_ttl_sec)
+        self._data_sources: FrozenSet[str] = ALL_DATA_SOURCES
+        # written by scan and event workers at the same time, so only accessed with _cpu_stats_padlock held
+        self._cpu_stats_padlock = threading.Lock()
+        self._previous_cpu_stats: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        self._cgroup_metrics_reader: Optional[CgroupMetricsReader] = \
+            CgroupMetricsReader(config.cgroup_root) if config.metrics_source == MetricsSource.Cgroup else None
         self.last_check_containers_run_end_timestamp: datetime.datetime = datetime.datetime.min
         self.last_check_containers_run_start_timestamp: datetime.datetime = datetime.datetime.min
         self.last_check_containers_run_time: datetime.timedelta = datetime.timedelta.min
         self.last_periodic_run_ok: bool = False
+        self._events_stopped = threading.Event()
+        self._first_listed: Dict[str, float] = {}
+        self._last_checked: Dict[str, float] = {}
+        self._skipped_buckets: Set[int] = set()
+        self.skipped_buckets: int = 0
 
     def check_container(self, container_id: str, check_source: CheckSource, remove_from_cache: bool=False) \
             -> Optional[Container]:
+        if check_source == CheckSource.Periodic and not self.periodic_checks_allowed():
+            logger.debug("[{0}] Periodic checks are paused, skipping container {1}"
+                         .format(threading.current_thread().name, container_id))
+            return None
         try:
             if remove_from_cache:
                 self.remove_from_cache(container_id)
 
-            if not self._config.disable_params:
-                params = self.get_params(container_id)
-            else:
-                params = {}
-            if not self._config.disable_metrics:
-                logger.debug("[{0}] Starting to fetch metrics for {1}".format(threading.current_thread().name,
-                                                                              container_id))
-                metrics = self._client.stats(container=container_id, decode=True, stream=False)
-            else:
-                metrics = {}
+            # the calls of periodic checks give way to the ones made for AuthZ requests and events
+            with self._api_guard.background(check_source == CheckSource.Periodic):
+                if not self._config.disable_params and DataSource.Params in self._data_sources:
+                    params = self.get_params(container_id)
+                else:
+                    params = {}
+                if not self._config.disable_metrics and DataSource.Metrics in self._data_sources:
+                    metrics = self.get_metrics(container_id)
+                else:
+                    metrics = {}
             logger.debug("[{0}] Fetched data for container {1}".format(threading.current_thread().name, container_id))
         except NotFound as e:
             logger.warning("Container {0} not found - {1}.".format(container_id, e))
@@ -82,56 +118,157 @@ class DockerHelper:
             return None
         return Container(container_id, params, metrics, 0, check_source)
 
-    def check_containers(self, check_source: CheckSource) -> Iterable[Container]:
+    def limit_data_sources(self, data_sources: FrozenSet[str]) -> None:
+        self._data_sources = frozenset(data_sources)
+        skipped = sorted(s for s in (DataSource.Params, DataSource.Metrics) if s not in self._data_sources)
+        if skipped:
+            logger.info("No rule uses container's {0}, these won't be fetched from docker".format(", ".join(skipped)))
+
+    @staticmethod
+    def get_scan_bucket(container_id: str, buckets: int) -> int:
+        return zlib.crc32(container_id.encode()) % buckets if buckets > 1 else 0
+
+    def check_containers(self, check_source: CheckSource, bucket: int = 0, buckets: int = 1) -> Iterable[Container]:
+        # with more than 1 bucket, only the containers whose id hashes to the given bucket are checked, together with
+        # the buckets skipped before because the previous check was still running; the run of the first bucket
+        # starts a full check cycle and the run of the last one ends it
         with self._padlock:
+            if not self.periodic_checks_allowed():
+                logger.warning("Docker API is struggling, skipping the periodic check")
+                self._skip_bucket(bucket, buckets)
+                return
             if self._check_in_progress:
                 logger.warning("[{0}] Previous check did not yet complete, consider increasing CHECK_INTERVAL_S"
                                .format(threading.current_thread().name))
+                self._skip_bucket(bucket, buckets)
                 return
             self._check_in_progress = True
+            selected_buckets = {bucket} | self._skipped_buckets if buckets > 1 else {0}
+            self._skipped_buckets = set()
         logger.debug("Periodic check start: connecting to get the list of containers")
+        scan_start = self.start_periodic_run() if 0 in selected_buckets else time.perf_counter()
+        ids = self.list_running_containers()
+        if ids is None:
+            with self._padlock:
+                self._check_in_progress = False
+                if buckets > 1:
+                    self._skipped_buckets.update(selected_buckets)
+            self.finish_periodic_run(False, scan_start)
+            return
+        selected = ids if buckets <= 1 \
+            else [cid for cid in ids if self.get_scan_bucket(cid, buckets) in selected_buckets]
+        for container in self._check_containers_by_ids(selected, check_source):
+            self.record_periodic_check(container.cid)
+            yield container
+        logger.debug("Containers checked")
+        self.purge_stopped_containers(ids)
+        self.finish_periodic_run(True, scan_start, cycle_done=buckets - 1 in selected_buckets or buckets <= 1)
+        logger.debug("Periodic check done")
+        with self._padlock:
+            self._check_in_progress = False
+
+    def _skip_bucket(self, bucket: int, buckets: int) -> None:
+        # the skipped bucket is checked together with the next one, so its containers don't miss the cycle
+        if buckets > 1:
+            self._skipped_buckets.add(bucket)
+            self.skipped_buckets += 1
+
+    def start_periodic_run(self) -> float:
         self.last_check_containers_run_start_timestamp = datetime.datetime.utcnow()
+        return time.perf_counter()
+
+    def finish_periodic_run(self, ok: bool, scan_start: float, cycle_done: bool = True) -> None:
+        # the end timestamp and the run time describe a whole check cycle, the duration histogram every run
+        self.last_periodic_run_ok = ok
+        if not ok:
+            return
+        periodic_scan_duration.observe(time.perf_counter() - scan_start)
+        if not cycle_done:
+            return
+        self.last_check_containers_run_end_timestamp = datetime.datetime.utcnow()
+        self.last_check_containers_run_time = self.last_check_containers_run_end_timestamp \
+            - self.last_check_containers_run_start_timestamp
+
+    def periodic_checks_allowed(self) -> bool:
+        return self._api_guard.periodic_checks_allowed()
+
+    def list_running_containers(self) -> Optional[List[str]]:
         try:
-            containers = self._client.containers(quiet=True)
+            with self._api_guard.background(), self._api_guard.call("containers"):
+                containers = self._client.containers(quiet=True)
             logger.debug("[{0}] Fetched containers list from docker daemon".format(threading.current_thread().name))
         except (ReadTimeout, ProtocolError, JSONDecodeError) as e:
             logger.error("Timeout while trying to get list of containers from docker: {0}".format(e))
-            with self._padlock:
-                self._check_in_progress = False
-            self.last_periodic_run_ok = False
-            return
+            return None
         except Exception as e:
             logger.error("Unexpected error while trying to get list of containers from docker: {0}".format(e))
-            with self._padlock:
-                self._check_in_progress = False
-            self.last_periodic_run_ok = False
-            return
+            return None
         ids = [container['Id'] for container in containers]
-        for container_id in ids:
-            container = self.check_container(container_id, check_source)
-            if container is None:
-                continue
-            yield container
-        logger.debug("Containers checked")
+        self._track_running_containers(ids)
+        return ids
+
+    def record_periodic_check(self, container_id: str) -> None:
+        with self._padlock:
+            self._last_checked[container_id] = time.monotonic()
+
+    def purge_stopped_containers(self, running_container_ids: List[str]) -> None:
         if self._config.cache_params:
             logger.debug("Purging cache")
-            self.purge_cache(ids)
-        self.last_periodic_run_ok = True
-        self.last_check_containers_run_end_timestamp = datetime.datetime.utcnow()
-        self.last_check_containers_run_time = self.last_check_containers_run_end_timestamp \
-            - self.last_check_containers_run_start_timestamp
-        logger.debug("Periodic check done")
+            self.purge_cache(running_container_ids)
+        self.purge_previous_cpu_stats(running_container_ids)
+
+    def api_calls_per_check(self) -> int:
+        # cached params don't cost a call, but they still have to be fetched once per container
+        calls = 0
+        if not self._config.disable_params and DataSource.Params in self._data_sources:
+            calls += 1
+        if not self._config.disable_metrics and DataSource.Metrics in self._data_sources \
+                and self._cgroup_metrics_reader is None:
+            calls += 1
+        return calls
+
+    def _track_running_containers(self, running_container_ids: List[str]) -> None:
+        # containers not checked yet are as stale as the time since they were first listed
+        now = time.monotonic()
         with self._padlock:
-            self._check_in_progress = False
+            self._first_listed = {cid: self._first_listed.get(cid, now) for cid in running_container_ids}
+            self._last_checked = {cid: t for cid, t in self._last_checked.items() if cid in self._first_listed}
+
+    def _check_containers_by_ids(self, ids: Iterable[str], check_source: CheckSource) -> Iterable[Container]:
+        workers = min(self._config.scan_concurrency, len(ids))
+        if workers <= 1:
+            for container_id in ids:
+                container = self.check_container(container_id, check_source)
+                if container is None:
+                    continue
+                yield container
+            return
+
+        logger.debug("[{0}] Checking {1} containers with {2} workers".format(threading.current_thread().name,
+                                                                             len(ids), workers))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="check_containers") as executor:
+            futures = [executor.submit(self.check_container, container_id, check_source) for container_id in ids]
+            try:
+                for future in as_completed(futures):
+                    container = future.result()
+                    if container is None:
+                        continue
+                    yield container
+            finally:
+                for future in futures:
+                    future.cancel()
 
     def get_params(self, container_id: str) -> Optional[Dict[str, Any]]:
-        if self._config.cache_params and container_id in self._params_cache:
-            logger.debug("Returning cached params for container {0}".format(container_id))
-            return self._params_cache[container_id]
+        if self._config.cache_params:
+            params = self._params_cache.get(container_id)
+            if params is not None:
+                logger.debug("Returning cached params for container {0}".format(container_id))
+                return params
 
         logger.debug("[{0}] Starting to fetch params for {1}".format(threading.current_thread().name, container_id))
+        generation = self._params_cache.get_generation()
         try:
-            params = self._client.inspect_container(container_id)
+            params = self.inspect_container(container_id)
         except NotFound as e:
             logger.warning("Container {0} not found - {1}.".format(container_id, e))
             return None
@@ -143,58 +280,205 @@ class DockerHelper:
             return {}
         logger.debug("[{0}] Params fetched for {1}".format(threading.current_thread().name, container_id))
 
-        params = self.rename_keys_to_lower(params)
         if not self._config.cache_params:
             return params
 
         logger.debug("[{0}] Storing params of {1} in cache".format(threading.current_thread().name, container_id))
-        self._params_cache[container_id] = params
+        if not self._params_cache.put(container_id, params, generation):
+            logger.debug("[{0}] Params of {1} changed while they were fetched, not caching them"
+                         .format(threading.current_thread().name, container_id))
         return params
 
+    def get_metrics(self, container_id: str) -> Optional[Dict[str, Any]]:
+        logger.debug("[{0}] Starting to fetch metrics for {1}".format(threading.current_thread().name, container_id))
+        if self._cgroup_metrics_reader is not None:
+            return self._get_cgroup_metrics(container_id)
+
+        one_shot = self._config.stats_one_shot and version_gte(self._client.api_version, "1.41")
+        previous = self._get_previous_cpu_stats(container_id) if one_shot else None
+        if previous is None:
+            # the regular call waits for the daemon to take the 2nd CPU sample; with one-shot stats, it's used for
+            # the first check of a container, as there's no previous sample to compare the single one with yet
+            with self._api_guard.call("stats", timed=False):
+                metrics = self._client.stats(container=container_id, stream=False)
+            if one_shot:
+                self._set_previous_cpu_stats(container_id, metrics)
+            return metrics
+
+        with self._api_guard.call("stats"):
+            url = self._client._url("/containers/{0}/stats", container_id)
+            metrics = self._client._result(self._client._get(url, params={'stream': False, 'one-shot': True}),
+                                           json=True)
+        return self._with_previous_cpu_stats(container_id, metrics, previous)
+
+    def _get_cgroup_metrics(self, container_id: str) -> Optional[Dict[str, Any]]:
+        previous = self._get_previous_cpu_stats(container_id)
+        if previous is None:
+            # like the docker stats API, take the 2nd CPU sample a while after the first one
+            first = self._cgroup_metrics_reader.get_metrics(container_id)
+            if first is None:
+                return None
+            previous = (first.get('read'), first.get('cpu_stats', {}))
+            time.sleep(self.cpu_sample_interval_sec)
+        metrics = self._cgroup_metrics_reader.get_metrics(container_id)
+        return None if metrics is None else self._with_previous_cpu_stats(container_id, metrics, previous)
+
+    def _with_previous_cpu_stats(self, container_id: str, metrics: Dict[str, Any],
+                                 previous: Tuple[str, Dict[str, Any]]) -> Dict[str, Any]:
+        # one-shot and cgroup metrics come without the second CPU sample, so the previous one is taken from
+        # the last check
+        self._set_previous_cpu_stats(container_id, metrics)
+        metrics['preread'], metrics['precpu_stats'] = previous
+        return metrics
+
+    def _get_previous_cpu_stats(self, container_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        with self._cpu_stats_padlock:
+            return self._previous_cpu_stats.get(container_id)
+
+    def _set_previous_cpu_stats(self, container_id: str, metrics: Dict[str, Any]) -> None:
+        with self._cpu_stats_padlock:
+            self._previous_cpu_stats[container_id] = (metrics.get('read'), metrics.get('cpu_stats', {}))
+
+    def purge_previous_cpu_stats(self, running_container_ids) -> None:
+        running = set(running_container_ids)
+        with self._cpu_stats_padlock:
+            for cid in [c for c in self._previous_cpu_stats if c not in running]:
+                del self._previous_cpu_stats[cid]
+
+    def inspect_container(self, container_id: str) -> Dict[str, Any]:
+        # the same as APIClient.inspect_container, but the response is decoded directly with lowercase keys
+        with self._api_guard.call("inspect"):
+            res = self._client._get(self._client._url("/containers/{0}/json", container_id))
+            self._client._raise_for_status(res)
+        return self.loads_with_lower_keys(res.content)
+
     def purge_cache(self, running_container_ids) -> None:
-        diff = [c for c in self._params_cache.keys() if c not in running_container_ids]
-        for cid in diff:
-            self._params_cache.pop(cid, None)
+        self._params_cache.retain_only(running_container_ids)
 
     def remove_from_cache(self, container_id: str) -> None:
-        self._params_cache.pop(container_id, None)
+        self._params_cache.invalidate(container_id)
 
-    def rename_keys_to_lower(self, iterable):
+    def on_container_event(self, event: Dict[str, Any]) -> None:
+        if event.get('Type') != 'container' or event.get('Action') not in self.cache_invalidating_actions:
+            return
+        logger.debug("[{0}] Container {1} got '{2}' event, removing its params from cache"
+                     .format(threading.current_thread().name, event['id'], event['Action']))
+        self.remove_from_cache(event['id'])
+        if event['Action'] == 'destroy':
+            with self._cpu_stats_padlock:
+                self._previous_cpu_stats.pop(event['id'], None)
+
+    def to_prometheus_stats_format(self) -> str:
+        res = self._params_cache.to_prometheus_stats_format()
+        if not self._config.run_periodic:
+            return res
+        now = time.monotonic()
+        with self._padlock:
+            ages = [now - self._last_checked.get(cid, first) for cid, first in self._first_listed.items()]
+            covered = sum(1 for cid in self._first_listed
+                          if now - self._last_checked.get(cid, -math.inf) <= self._config.interval_sec)
+        res += """# HELP periodic_check_running_containers The running containers seen by the last periodic check.
+# TYPE periodic_check_running_containers gauge
+periodic_check_running_containers {0}
+# HELP periodic_check_covered_containers The number of running containers checked within the check interval.
+# TYPE periodic_check_covered_containers gauge
+periodic_check_covered_containers {1}
+# HELP periodic_check_max_age_seconds The time since the least recently checked running container was checked.
+# TYPE periodic_check_max_age_seconds gauge
+periodic_check_max_age_seconds {2}
+# HELP periodic_check_skipped_buckets_total The total number of buckets postponed as the previous check still ran.
+# TYPE periodic_check_skipped_buckets_total counter
+periodic_check_skipped_buckets_total {3}
+""".format(len(ages), covered, round(max(ages), 3) if ages else 0, self.skipped_buckets)
+        return res
+
+    @staticmethod
+    def loads_with_lower_keys(data: Union[str, bytes]) -> Any:
+        return json.loads(data, object_pairs_hook=_dict_with_lower_keys)
+
+    @staticmethod
+    def rename_keys_to_lower(iterable):
         new = None
         if type(iterable) is dict:
             new = {}
             for key in iterable.keys():
                 lower_key = key.lower()
                 if type(iterable[key]) is dict or type(iterable[key]) is list:
-                    new[lower_key] = self.rename_keys_to_lower(iterable[key])
+                    new[lower_key] = DockerHelper.rename_keys_to_lower(iterable[key])
                 else:
                     new[lower_key] = iterable[key]
         elif type(iterable) is list:
             new = []
             for item in iterable:
-                new.append(self.rename_keys_to_lower(item))
+                new.append(DockerHelper.rename_keys_to_lower(item))
         else:
             new = iterable
         return new
 
+    def get_event_filters(self) -> Dict[str, List[str]]:
+        # only the container events docker enforcer reacts to are sent by the daemon
+        actions = {'destroy'}
+        if self._config.run_start_events:
+            actions.add('start')
+        if self._config.run_update_events:
+            actions.add('update')
+        if self._config.run_rename_events:
+            actions.add('rename')
+        if self._config.cache_params:
+            actions |= self.cache_invalidating_actions
+        return {'type': ['container'], 'event': sorted(actions)}
+
+    @staticmethod
+    def _get_event_time_nano(event: Dict[str, Any]) -> Optional[int]:
+        if 'timeNano' in event:
+            return int(event['timeNano'])
+        return int(event['time']) * 10 ** 9 if 'time' in event else None
+
+    def stop_events(self) -> None:
+        self._events_stopped.set()
+
     def get_events_observable(self) -> Iterable[Any]:
-        successful = False
-        ev = None
-        while not successful:
+        # after the stream breaks, it's opened again from the time of the last received event (or, before any was
+        # received, from the time it was first opened), so the daemon replays the events sent in between; the ones
+        # already received at that very time are skipped
+        opened_time: Optional[int] = None
+        last_time: Optional[int] = None
+        last_time_keys: Set[Tuple[Any, Any]] = set()
+        while not self._events_stopped.is_set():
+            since_time = last_time if last_time is not None else opened_time
+            since = None if since_time is None else "{0}.{1:09d}".format(*divmod(since_time, 10 ** 9))
+            if opened_time is None:
+                opened_time = time.time_ns()
             try:
-                ev = self._client.events(decode=True)
+                with self._api_guard.call("events", timed=False):
+                    stream = self._client.events(since=since, filters=self.get_event_filters(), decode=True)
+                for event in stream:
+                    event_time = self._get_event_time_nano(event)
+                    if event_time is not None:
+                        key = (event.get('id'), event.get('Action', event.get('status')))
+                        if last_time is not None and (event_time < last_time
+                                                      or event_time == last_time and key in last_time_keys):
+                            continue
+                        if last_time is None or event_time > last_time:
+                            last_time, last_time_keys = event_time, set()
+                        last_time_keys.add(key)
+                    yield event
+                logger.warning("Docker events stream ended, reconnecting in {0}s"
+                               .format(self.events_reconnect_delay_sec))
             except (ReadTimeout, ProtocolError, JSONDecodeError) as e:
-                logger.error("Communication error when subscribing for container events, retrying in 5s: {0}".format(e))
-                time.sleep(5)
+                logger.error("Communication error when reading container events, reconnecting in {0}s: {1}"
+                             .format(self.events_reconnect_delay_sec, e))
             except Exception as e:
-                logger.error("Unexpected error when subscribing for container events, retrying in 5s: {0}".format(e))
-                time.sleep(5)
-            successful = True
-        return ev
+                logger.error("Unexpected error when reading container events, reconnecting in {0}s: {1}"
+                             .format(self.events_reconnect_delay_sec, e))
+            if self._events_stopped.wait(self.events_reconnect_delay_sec):
+                break
+            events_reconnects.inc()
 
     def kill_container(self, container: Container) -> None:
         try:
-            self._client.stop(container.params['id'])
+            with self._api_guard.call("stop"):
+                self._client.stop(container.params['id'])
         except (ReadTimeout, ProtocolError) as e:
             logger.error("Communication error when stopping container {0}: {1}".format(container.cid, e))
         except Exception as e:
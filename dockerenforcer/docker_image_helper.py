@@ -1,25 +1,28 @@
 import logging
 
 from functools import lru_cache
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 from docker import APIClient
 from docker.errors import NotFound
 
 from dockerenforcer.config import Config
+from dockerenforcer.api_guard import DockerApiGuard
 
 logger = logging.getLogger("docker_enforcer")
 
 class DockerImageHelper:
-    def __init__(self, config: Config, client: APIClient) -> None:
+    def __init__(self, config: Config, client: APIClient, api_guard: Optional[DockerApiGuard] = None) -> None:
         super().__init__()
         self._config: Config = config
         self._client: APIClient = client
+        self._api_guard: DockerApiGuard = api_guard if api_guard is not None else DockerApiGuard(config)
 
     @lru_cache(maxsize=1024)
     def get_image_uniq_tag_by_id(self, image_id):
         try:
-            image_inspect_data: Dict = self._client.inspect_image(image_id)
+            with self._api_guard.call("inspect_image"):
+                image_inspect_data: Dict = self._client.inspect_image(image_id)
         except NotFound as e:
             logger.warning("Image {0} not found".format(image_id, e))
             return image_id
@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import List
+
+from rx import Observable, AnonymousObservable
+from rx.disposables import AnonymousDisposable
+
+
+class EventCoalescer:
+    # Collapses the events of a container that come within window_sec from its first event into a single check.
+    # The window is the same for all containers, so the pending ids are ordered by their deadlines as well.
+    def __init__(self, window_sec: float) -> None:
+        super().__init__()
+        self._condition = threading.Condition()
+        self._window_sec: float = window_sec
+        self._pending: 'OrderedDict[str, float]' = OrderedDict()
+        self.received: int = 0
+        self.merged: int = 0
+
+    def add(self, container_id: str) -> bool:
+        with self._condition:
+            self.received += 1
+            if container_id in self._pending:
+                self.merged += 1
+                return False
+            self._pending[container_id] = time.monotonic() + self._window_sec
+            self._condition.notify_all()
+            return True
+
+    def take_due(self, stopped: threading.Event, timeout: float = 1.0) -> List[str]:
+        with self._condition:
+            while not stopped.is_set():
+                if not self._pending:
+                    self._condition.wait(timeout)
+                    continue
+                now = time.monotonic()
+                deadline = next(iter(self._pending.values()))
+                if deadline > now:
+                    self._condition.wait(min(timeout, deadline - now))
+                    continue
+                due = []
+                while self._pending and next(iter(self._pending.values())) <= now:
+                    due.append(self._pending.popitem(last=False)[0])
+                return due
+        return []
+
+    def coalesce(self, container_ids: Observable) -> Observable:
+        if self._window_sec <= 0:
+            return container_ids
+
+        def subscribe(observer):
+            stopped = threading.Event()
+
+            def flush():
+                while not stopped.is_set():
+                    for container_id in self.take_due(stopped):
+                        observer.on_next(container_id)
+
+            threading.Thread(target=flush, name="event_coalescer", daemon=True).start()
+            subscription = container_ids.subscribe(self.add, observer.on_error, observer.on_completed)
+
+            def dispose():
+                stopped.set()
+                with self._condition:
+                    self._condition.notify_all()
+                subscription.dispose()
+
+            return AnonymousDisposable(dispose)
+
+        return AnonymousObservable(subscribe)
+
+    def to_prometheus_stats_format(self) -> str:
+        if self._window_sec <= 0:
+            return ""
+        with self._condition:
+            res = """# HELP container_events_received_total The total number of docker events requesting a check.
+# TYPE container_events_received_total counter
+container_events_received_total {0}
+# HELP container_events_merged_total The total number of docker events merged into a pending check.
+# TYPE container_events_merged_total counter
+container_events_merged_total {1}
+# HELP container_events_pending The current number of containers waiting for their event window to end.
+# TYPE container_events_pending gauge
+container_events_pending {2}
+""".format(self.received, self.merged, len(self._pending))
+        return res
@@ -1,17 +1,25 @@
+import bisect
 import json
 import threading
 import datetime
-import re
 import logging
-from copy import deepcopy
+import sys
+import time
+import weakref
 
 import itertools
-from typing import Optional, Dict, Iterable, Callable, Any, Tuple, Union
+from typing import Optional, Dict, Iterable, Callable, Any, Tuple, Union, FrozenSet, Set, List, Hashable, Iterator
 
 from rx import Observer
 
+from dockerenforcer.cache import LruCache
+from dockerenforcer.data_sources import DataSource, RuleUsage, ALL_DATA_SOURCES
 from dockerenforcer.docker_helper import CheckSource, Container, DockerHelper
 from dockerenforcer.docker_image_helper import DockerImageHelper
+from dockerenforcer.metrics import rule_duration, rule_errors, rule_violations
+from dockerenforcer.request_rules_index import RequestRulesIndex
+from dockerenforcer.rule_profiler import RuleKind, RuleProfiler
+from dockerenforcer.whitelist import WhitelistMatcher
 from .config import Mode, Config
 from triggers.triggers import triggers
 
@@ -20,6 +28,7 @@ logger = logging.getLogger("docker_enforcer")
 Rule = Dict[str, Union[str, Callable[[Any], bool]]]
 Rules = Iterable[Rule]
 Subject = Union[Container, Dict[str, Any]]
+RuleResult = Tuple[Optional[str], bool]
 
 
 class Verdict:
@@ -30,93 +39,332 @@ class Verdict:
         self.verdict: bool = verdict
 
 
+class Evaluation:
+    def __init__(self, container: Container, on_global_whitelist: bool) -> None:
+        super().__init__()
+        self.params: Dict[str, Any] = container.params
+        self.metrics: Dict[str, Any] = container.metrics
+        self.position: int = container.position
+        self.on_global_whitelist: bool = on_global_whitelist
+        self.rule_results: Dict[str, RuleResult] = {}
+
+    def changed_data_sources(self, container: Container) -> Set[str]:
+        changed = set()
+        if self.params is not container.params and self.params != container.params:
+            changed.add(DataSource.Params)
+        if self.metrics is not container.metrics and self.metrics != container.metrics:
+            changed.add(DataSource.Metrics)
+        if self.position != container.position:
+            changed.add(DataSource.Position)
+        return changed
+
+
+class WhitelistIdentity:
+    # name and image a subject is matched against whitelists with, resolved once per verdict
+    def __init__(self, has_name: bool, name: str, image_resolver: Callable[[], str]) -> None:
+        super().__init__()
+        self.has_name: bool = has_name
+        self.name: str = name
+        self._image_resolver: Callable[[], str] = image_resolver
+        self._image: Optional[str] = None
+
+    @property
+    def image(self) -> str:
+        if self._image is None:
+            self._image = self._image_resolver()
+        return self._image
+
+
+class SharedLabels(dict):
+    # a labels mapping shared by all the stats of containers with identical labels; dict can't be weakly referenced
+    __slots__ = ('__weakref__',)
+
+
+_shared_labels: 'weakref.WeakValueDictionary[Tuple[Tuple[str, Any], ...], SharedLabels]' = \
+    weakref.WeakValueDictionary()
+_shared_labels_padlock = threading.Lock()
+
+
+def intern_if_str(value: Any) -> Any:
+    return sys.intern(value) if type(value) is str else value
+
+
+def share_labels(labels: Any) -> Any:
+    if not isinstance(labels, dict) or isinstance(labels, SharedLabels):
+        return labels
+    try:
+        key = tuple(sorted(labels.items()))
+        hash(key)
+    except TypeError:
+        return labels
+    with _shared_labels_padlock:
+        shared = _shared_labels.get(key)
+        if shared is None:
+            shared = SharedLabels((intern_if_str(k), intern_if_str(v)) for k, v in key)
+            _shared_labels[key] = shared
+    return shared
+
+
 class Stat:
-    def __init__(self, name: str) -> None:
+    # never modified once created, so snapshots of the stats can share Stat objects with the live table
+    __slots__ = ('counter', 'name', 'last_timestamp', 'reasons', 'image', 'labels', 'source', 'owner')
+
+    def __init__(self, name: str, counter: int = 0, last_timestamp: Optional[datetime.datetime] = None,
+                 reasons: Optional[Iterable[str]] = None, image: Optional[str] = None,
+                 labels: Optional[Iterable[str]] = None, source: Optional[CheckSource] = None,
+                 owner: Optional[str] = None) -> None:
         super().__init__()
-        self.counter: int = 0
+        self.counter: int = counter
         self.name: str = name
-        self.last_timestamp: Optional[datetime.datetime] = None
-        self.reasons: Optional[Dict[str, str]] = None
-        self.image: Optional[str] = None
-        self.labels: Optional[Iterable[str]] = None
-        self.source: Optional[CheckSource] = None
-        self.owner: Optional[str] = None
+        self.last_timestamp: Optional[datetime.datetime] = last_timestamp
+        self.reasons: Optional[Iterable[str]] = reasons
+        self.image: Optional[str] = image
+        self.labels: Optional[Iterable[str]] = labels
+        self.source: Optional[CheckSource] = source
+        self.owner: Optional[str] = owner
 
     def record_new(self, reasons: Iterable[str], image: str, labels: Optional[Iterable[str]],
-                   source: Optional[CheckSource], owner: str) -> None:
-        self.counter += 1
-        self.last_timestamp = datetime.datetime.utcnow()
-        self.reasons = reasons
-        self.image = image
-        self.labels = labels
-        self.source = source
-        self.owner = owner
+                   source: Optional[CheckSource], owner: str) -> 'Stat':
+        # values repeated across many containers (rule names, images, owners, labels) are stored only once
+        return Stat(self.name, self.counter + 1, datetime.datetime.utcnow(),
+                    tuple(intern_if_str(r) for r in reasons), intern_if_str(image), share_labels(labels), source,
+                    intern_if_str(owner))
 
     def __str__(self, *args, **kwargs) -> str:
         return "{0} - {1}".format(self.counter, self.last_timestamp)
 
 
+_DETAIL_FIELD_GETTERS: Dict[str, Callable[[str, Stat, bool], Any]] = {
+    "id": lambda cid, stat, all_rules: cid,
+    "name": lambda cid, stat, all_rules: stat.name,
+    "violated_rule": lambda cid, stat, all_rules: list(stat.reasons) if all_rules else stat.reasons[0],
+    "owner": lambda cid, stat, all_rules: stat.owner,
+    "source": lambda cid, stat, all_rules: str(stat.source),
+    "count": lambda cid, stat, all_rules: stat.counter,
+    "last_timestamp": lambda cid, stat, all_rules: stat.last_timestamp.isoformat(),
+    "image": lambda cid, stat, all_rules: stat.image,
+    "labels": lambda cid, stat, all_rules: stat.labels,
+}
+DETAIL_FIELDS: Tuple[str, ...] = ("id", "name", "violated_rule", "owner", "source", "count", "last_timestamp")
+IMAGE_AND_LABELS_FIELDS: Tuple[str, ...] = ("image", "labels")
+
+
+class _StatRecord:
+    # an entry of the stats log; removed_in is set once, to the version of the table the container was removed (or
+    # recorded again) in, so snapshots of older versions still see it
+    __slots__ = ('cid', 'stat', 'removed_in')
+
+    def __init__(self, cid: str, stat: Stat) -> None:
+        super().__init__()
+        self.cid: str = cid
+        self.stat: Stat = stat
+        self.removed_in: Optional[int] = None
+
+
+class StatusSnapshot:
+    # a read-only view of one version of the stats; it only keeps references to the table's log, which is never
+    # modified below its end, so publishing it costs the same for any number of entries
+    def __init__(self, log: List[_StatRecord], timestamps: List[datetime.datetime], head: int, version: int,
+                 size: int, total_recorded: int, evictions: int) -> None:
+        super().__init__()
+        self._log: List[_StatRecord] = log
+        self._timestamps: List[datetime.datetime] = timestamps
+        self._head: int = head
+        self._end: int = len(log)
+        self.version: int = version
+        self._size: int = size
+        self.total_recorded: int = total_recorded
+        self.evictions: int = evictions
+
+    def _iter_records(self, start: int) -> Iterator[_StatRecord]:
+        log, version = self._log, self.version
+        for i in range(max(start, self._head), self._end):
+            record = log[i]
+            removed_in = record.removed_in
+            if removed_in is None or removed_in > version:
+                yield record
+
+    def _oldest_timestamp(self) -> Optional[datetime.datetime]:
+        return self._timestamps[self._head] if self._head < self._end else None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def get_items(self) -> Iterator[Tuple[str, Stat]]:
+        return ((r.cid, r.stat) for r in self._iter_records(self._head))
+
+    def to_prometheus_stats_format(self) -> str:
+        return """# HELP containers_stopped_total The total number of docker containers stopped.
+# TYPE containers_stopped_total counter
+containers_stopped_total {0}
+# HELP stats_entries The current number of containers kept in the detections stats.
+# TYPE stats_entries gauge
+stats_entries {1}
+# HELP stats_evictions_total The total number of containers removed from the detections stats.
+# TYPE stats_evictions_total counter
+stats_evictions_total {2}
+""".format(self.total_recorded, self._size, self.evictions)
+
+    def iter_json_detail_stats(self, output_filter: Callable[[Stat], bool], show_all_violated_rules: bool,
+                               show_image_and_labels: bool, offset: int = 0, limit: Optional[int] = None,
+                               fields: Optional[Iterable[str]] = None,
+                               since: Optional[datetime.datetime] = None) -> Iterator[str]:
+        # yields the JSON array piece by piece, so that a big table doesn't have to be rendered in one string
+        if fields is None:
+            fields = DETAIL_FIELDS + IMAGE_AND_LABELS_FIELDS if show_image_and_labels else DETAIL_FIELDS
+        getters = [(f, _DETAIL_FIELD_GETTERS[f]) for f in fields if f in _DETAIL_FIELD_GETTERS]
+        # the log is in the order of last_timestamp, so the first detection after since is binary searched
+        start = bisect.bisect_right(self._timestamps, since, self._head, self._end) if since is not None \
+            else self._head
+
+        yield "[\n"
+        skipped = sent = 0
+        for record in self._iter_records(start):
+            if limit is not None and sent >= limit:
+                break
+            if not output_filter(record.stat):
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            entry = {name: getter(record.cid, record.stat, show_all_violated_rules) for name, getter in getters}
+            yield ("    " if sent == 0 else ",\n    ") + json.dumps(entry)
+            sent += 1
+        yield "\n]"
+
+    def to_json_detail_stats(self, output_filter: Callable[[Stat], bool], show_all_violated_rules: bool,
+                             show_image_and_labels: bool) -> str:
+        return "".join(self.iter_json_detail_stats(output_filter, show_all_violated_rules, show_image_and_labels))
+
+
 class StatusDictionary:
-    def __init__(self, killed_containers=None) -> None:
+    # writers append to a log ordered by last_timestamp and publish a new snapshot of it by swapping a reference,
+    # so readers never copy the table and never wait for writers, nor writers for readers
+    def __init__(self, killed_containers=None, max_entries: int = 0, max_age_sec: float = 0) -> None:
         super().__init__()
         self._padlock = threading.Lock()
-        self._killed_containers = killed_containers if killed_containers else {}
+        self._max_entries: int = max_entries
+        self._max_age_sec: float = max_age_sec
+        self._records: Dict[str, _StatRecord] = {}
+        self._log: List[_StatRecord] = []
+        self._timestamps: List[datetime.datetime] = []
+        self._head: int = 0
+        self._version: int = 0
+        self.total_recorded: int = 0
+        self.evictions: int = 0
+        for cid, stat in (killed_containers or {}).items():
+            self._append(cid, stat)
+        self.total_recorded = len(self._records)
+        self._snapshot: StatusSnapshot = self._make_snapshot()
+
+    @property
+    def version(self) -> int:
+        return self._version
 
     def register_killed(self, verdict: Verdict) -> None:
         subject = verdict.subject
         reasons = verdict.reasons
         user = "[unknown]" if not hasattr(verdict.subject, "owner") else verdict.subject.owner
+        name = subject.params["name"]
+        image = subject.params["config"]["image"] \
+            if "config" in subject.params and "image" in subject.params["config"] \
+            else (subject.params['image'] if 'image' in subject.params else 'UNDEFINED')
+        labels = subject.params["config"]["labels"] if "config" in subject.params \
+            else subject.params["labels"]
         with self._padlock:
-            name = subject.params["name"]
-            image = subject.params["config"]["image"] \
-                if "config" in subject.params and "image" in subject.params["config"] \
-                else (subject.params['image'] if 'image' in subject.params else 'UNDEFINED')
-            labels = subject.params["config"]["labels"] if "config" in subject.params \
-                else subject.params["labels"]
-            self._killed_containers.setdefault(subject.cid, Stat(name))\
-                .record_new(reasons, image, labels, subject.check_source, user)
-
-    def copy(self) -> 'StatusDictionary':
+            self._version += 1
+            previous = self._remove(subject.cid)
+            if previous is None:
+                previous = Stat(name)
+                self.total_recorded += 1
+            self._append(subject.cid, previous.record_new(reasons, image, labels, subject.check_source, user))
+            self._evict()
+            self._publish()
+
+    def forget(self, container_id: str) -> None:
         with self._padlock:
-            res = StatusDictionary(deepcopy(self._killed_containers))
-        return res
+            if container_id not in self._records:
+                return
+            self._version += 1
+            self._remove(container_id)
+            self.evictions += 1
+            self._publish()
+
+    def copy(self) -> StatusSnapshot:
+        # the snapshot is shared by all readers until the next write; only expired entries make a reader write
+        if self._max_age_sec > 0 and self._has_expired(self._snapshot):
+            with self._padlock:
+                if self._has_expired(self._snapshot):
+                    self._version += 1
+                    self._evict()
+                    self._publish()
+        return self._snapshot
+
+    def _has_expired(self, snapshot: StatusSnapshot) -> bool:
+        oldest = snapshot._oldest_timestamp()
+        return oldest is not None and oldest < self._get_oldest_allowed()
+
+    def _get_oldest_allowed(self) -> datetime.datetime:
+        return datetime.datetime.utcnow() - datetime.timedelta(seconds=self._max_age_sec)
+
+    def _append(self, cid: str, stat: Stat) -> None:
+        record = _StatRecord(cid, stat)
+        self._records[cid] = record
+        self._log.append(record)
+        self._timestamps.append(stat.last_timestamp)
+
+    def _remove(self, cid: str) -> Optional[Stat]:
+        record = self._records.pop(cid, None)
+        if record is None:
+            return None
+        record.removed_in = self._version
+        return record.stat
+
+    def _evict(self) -> None:
+        self._skip_removed()
+        oldest_allowed = self._get_oldest_allowed() if self._max_age_sec > 0 else None
+        while self._head < len(self._log) and (0 < self._max_entries < len(self._records)
+                                               or oldest_allowed is not None
+                                               and self._timestamps[self._head] < oldest_allowed):
+            self._remove(self._log[self._head].cid)
+            self.evictions += 1
+            self._skip_removed()
+
+    def _skip_removed(self) -> None:
+        while self._head < len(self._log) and self._log[self._head].removed_in is not None:
+            self._head += 1
+
+    def _publish(self) -> None:
+        self._skip_removed()
+        # once most of the log is removed entries, the live ones are moved to a new log; snapshots keep the old one
+        if len(self._log) - self._head > 2 * len(self._records) + 64:
+            live = [r for r in itertools.islice(self._log, self._head, None) if r.removed_in is None]
+            self._log, self._timestamps, self._head = live, [r.stat.last_timestamp for r in live], 0
+        self._snapshot = self._make_snapshot()
+
+    def _make_snapshot(self) -> StatusSnapshot:
+        return StatusSnapshot(self._log, self._timestamps, self._head, self._version, len(self._records),
+                              self.total_recorded, self.evictions)
+
+    def __len__(self) -> int:
+        return len(self._records)
 
     def to_prometheus_stats_format(self) -> str:
-        with self._padlock:
-            res = """# HELP containers_stopped_total The total number of docker containers stopped.
-# TYPE containers_stopped_total counter
-containers_stopped_total {0}
-""".format(len(self._killed_containers))
-        return res
+        return self._snapshot.to_prometheus_stats_format()
 
-    def to_json_detail_stats(self, output_filter: Callable[[Container], bool], show_all_violated_rules: bool,
-                             show_image_and_labels: bool) -> str:
-        str_list = ""
-        with self._padlock:
-            is_first = True
-            for k, v in self._killed_containers.items():
-                if not output_filter(v):
-                    continue
-                if not is_first:
-                    str_list += ",\n"
-                else:
-                    is_first = False
-
-                violated_rule = '"%s"' % v.reasons[0]
-                if show_all_violated_rules:
-                    violated_rule = json.dumps(v.reasons)
+    def iter_json_detail_stats(self, output_filter: Callable[[Stat], bool], show_all_violated_rules: bool,
+                               show_image_and_labels: bool, offset: int = 0, limit: Optional[int] = None,
+                               fields: Optional[Iterable[str]] = None,
+                               since: Optional[datetime.datetime] = None) -> Iterator[str]:
+        return self._snapshot.iter_json_detail_stats(output_filter, show_all_violated_rules, show_image_and_labels,
+                                                     offset, limit, fields, since)
 
-                str_list += "    {{\"id\": \"{0}\", \"name\": \"{1}\", \"violated_rule\": {2}, \"owner\": \"{6}\", " \
-                            "\"source\": \"{3}\", \"count\": {4}, \"last_timestamp\": \"{5}\""\
-                    .format(k, v.name, violated_rule, v.source, v.counter, v.last_timestamp.isoformat(), v.owner)
-
-                if show_image_and_labels:
-                    str_list += ', "image": "{0}", "labels": {1}'.format(v.image, json.dumps(v.labels))
-                str_list += " }"
-            return "[\n{0}\n]".format(str_list)
+    def to_json_detail_stats(self, output_filter: Callable[[Stat], bool], show_all_violated_rules: bool,
+                             show_image_and_labels: bool) -> str:
+        return self._snapshot.to_json_detail_stats(output_filter, show_all_violated_rules, show_image_and_labels)
 
-    def get_items(self):
-        return self._killed_containers.items()
+    def get_items(self) -> Iterator[Tuple[str, Stat]]:
+        return self._snapshot.get_items()
 
 
 class Judge:
@@ -131,6 +379,29 @@ class Judge:
         self._whitelist_separator: str = config.white_list_separator
         self._docker_image_helper: DockerImageHelper = docker_image_helper
         self._load_whitelists_from_config()
+        self._load_rules_data_sources()
+        self._evaluations: LruCache = LruCache("incremental_checks_cache", config.cache_max_entries)
+        self._request_rules_index: Optional[RequestRulesIndex] = None
+        self._verdicts: LruCache = LruCache("authz_verdict_cache", config.authz_verdict_cache_size)
+        self._verdicts_fingerprint: Tuple[Any, ...] = self._get_rules_fingerprint()
+        self._profiler: Optional[RuleProfiler] = \
+            RuleProfiler(config.rule_time_budget_ms / 1000, config.rule_time_budget_skip_after) \
+            if config.rules_profiling or config.rule_time_budget_ms > 0 else None
+
+    @property
+    def data_sources(self) -> FrozenSet[str]:
+        return self._data_sources
+
+    @property
+    def has_rules(self) -> bool:
+        return len(self._rules) > 0
+
+    def has_rules_for(self, subject: Subject) -> bool:
+        return len(self._get_rules_for(subject)) > 0
+
+    @property
+    def profiler(self) -> Optional[RuleProfiler]:
+        return self._profiler
 
     @staticmethod
     def _get_name_info(container: Container) -> Tuple[bool, str]:
@@ -151,96 +422,221 @@ class Judge:
 
         return image
 
-    def _on_global_whitelist(self, container: Container) -> bool:
-        has_name, name = self._get_name_info(container)
-        on_list = has_name and any(rn.match(name) for rn in self._global_whitelist)
-        if on_list:
-            logger.debug("Container {0} is on global white list (for all rules)".format(name))
+    def _identify(self, subject: Subject) -> WhitelistIdentity:
+        has_name, name = self._get_name_info(subject)
+        return WhitelistIdentity(has_name, name, lambda: self._get_image_info(subject))
+
+    def _on_global_whitelist(self, identity: WhitelistIdentity) -> bool:
+        if identity.has_name and self._global_whitelist.match(identity.name):
+            logger.debug("Container {0} is on global white list (for all rules)".format(identity.name))
             return True
 
-        image_name = self._get_image_info(container)
-        on_list = any(rn.match(image_name) for rn in self._image_global_whitelist)
-        if on_list:
-            logger.debug("Container {0} is on global image white list (for all rules)".format(name))
+        if len(self._image_global_whitelist) > 0 and self._image_global_whitelist.match(identity.image):
+            logger.debug("Container {0} is on global image white list (for all rules)".format(identity.name))
             return True
         return False
 
-    def _on_per_rule_whitelist(self, container: Container, rule_name: str) -> bool:
-        has_name, name = self._get_name_info(container)
-        on_list = has_name and rule_name in self._per_rule_whitelist \
-            and any(rn.match(name) for rn in self._per_rule_whitelist[rule_name])
-        if on_list:
-            logger.debug("Container {} is on per rule white list for rule '{}'".format(name, rule_name))
+    def _on_per_rule_whitelist(self, identity: WhitelistIdentity, rule_name: str) -> bool:
+        names = self._per_rule_whitelist.get(rule_name)
+        if identity.has_name and names is not None and names.match(identity.name):
+            logger.debug("Container {} is on per rule white list for rule '{}'".format(identity.name, rule_name))
             return True
 
-        image_name = self._get_image_info(container)
-        on_list = rule_name in self._image_per_rule_whitelist \
-            and any(rn.match(image_name) for rn in self._image_per_rule_whitelist[rule_name])
-        if on_list:
-            logger.debug("Container {} is on image per rule white list for rule '{}'".format(name, rule_name))
+        images = self._image_per_rule_whitelist.get(rule_name)
+        if images is not None and images.match(identity.image):
+            logger.debug("Container {} is on image per rule white list for rule '{}'".format(identity.name,
+                                                                                              rule_name))
             return True
         return False
 
     def _on_custom_whitelist(self, container: Container, violated_rule_name: str) -> bool:
         for rule in self._custom_whitelist_rules:
+            start = time.perf_counter() if self._profiler is not None else 0
             try:
-                if rule['rule'](container, violated_rule_name):
-                    return True
+                whitelisted = rule['rule'](container, violated_rule_name)
             except Exception as e:
+                whitelisted = False
                 logger.warning("Exception while executing custom whitelist rule {}: class: {}, val: {}"
                                .format(rule['name'], e.__class__.__name__, str(e)))
+            if self._profiler is not None:
+                self._profiler.record(RuleKind.WhitelistRule, rule['name'], time.perf_counter() - start)
+            if whitelisted:
+                return True
         return False
 
     def should_be_killed(self, subject: Subject) -> Verdict:
         if not subject:
             logger.warning("No {} details, skipping checks".format(self._subject_type))
             return Verdict(False, subject, None)
-        if self._run_whitelists and self._on_global_whitelist(subject):
+        if self._config.incremental_checks and isinstance(subject, Container) \
+                and subject.check_source != CheckSource.AuthzPlugin:
+            return self._should_be_killed_incrementally(subject)
+        identity = self._identify(subject) if self._run_whitelists else None
+        if self._run_whitelists and self._on_global_whitelist(identity):
+            return Verdict(False, subject, None)
+
+        reasons = []
+        for rule in self._get_rules_for(subject):
+            reason, violated = self._check_rule(subject, rule, identity)
+            if reason is not None:
+                reasons.append(reason)
+            if violated and self._config.stop_on_first_violation:
+                break
+        return self._make_verdict(subject, reasons)
+
+    def _should_be_killed_incrementally(self, subject: Container) -> Verdict:
+        # rules are re-evaluated only if the container's data they read changed since the container's last check
+        previous: Optional[Evaluation] = self._evaluations.get(subject.cid)
+        changed = ALL_DATA_SOURCES if previous is None else previous.changed_data_sources(subject)
+        identity = self._identify(subject) if self._run_whitelists else None
+        if previous is not None and not changed & self._whitelist_data_sources:
+            on_global_whitelist = previous.on_global_whitelist
+        else:
+            on_global_whitelist = self._run_whitelists and self._on_global_whitelist(identity)
+        evaluation = Evaluation(subject, on_global_whitelist)
+        self._evaluations.put(subject.cid, evaluation)
+        if on_global_whitelist:
             return Verdict(False, subject, None)
 
         reasons = []
         for rule in self._rules:
-            if self._run_whitelists and (self._on_per_rule_whitelist(subject, rule['name'])
-                                         or self._on_custom_whitelist(subject, rule['name'])):
-                continue
-            try:
-                if rule['rule'](subject):
-                    reasons.append(rule['name'])
-                    if self._config.stop_on_first_violation:
-                        break
-            except Exception as e:
-                reasons.append("Exception - rule: {0}, class: {1}, val: {2}"
-                               .format(rule['name'], e.__class__.__name__, str(e)))
+            result = None
+            if previous is not None and not changed & self._whitelist_data_sources \
+                    and not changed & self._rule_data_sources.get(rule['name'], ALL_DATA_SOURCES):
+                result = previous.rule_results.get(rule['name'])
+            if result is None:
+                result = self._check_rule(subject, rule, identity)
+            evaluation.rule_results[rule['name']] = result
+            reason, violated = result
+            if reason is not None:
+                reasons.append(reason)
+            if violated and self._config.stop_on_first_violation:
+                break
+        return self._make_verdict(subject, reasons)
+
+    def _get_rules_for(self, subject: Subject) -> Rules:
+        if self._subject_type != "request" or "requestmethod" not in subject or "parseduri" not in subject:
+            return self._rules
+        if self._request_rules_index is None or self._request_rules_index.rules is not self._rules:
+            self._request_rules_index = RequestRulesIndex(self._rules)
+        return self._request_rules_index.rules_for(subject["requestmethod"], subject["parseduri"].path)
+
+    def _check_rule(self, subject: Subject, rule: Rule, identity: Optional[WhitelistIdentity]) -> RuleResult:
+        if self._profiler is not None and self._profiler.is_skipped(rule['name']):
+            return None, False
+        if self._run_whitelists and (self._on_per_rule_whitelist(identity, rule['name'])
+                                     or self._on_custom_whitelist(subject, rule['name'])):
+            return None, False
+        start = time.perf_counter()
+        error = None
+        try:
+            violated = rule['rule'](subject)
+        except Exception as e:
+            violated, error = False, e
+        elapsed = time.perf_counter() - start
+        rule_duration.observe(elapsed, rule['name'])
+        if self._profiler is not None:
+            self._profiler.record(RuleKind.Rule, rule['name'], elapsed)
+        if error is not None:
+            rule_errors.inc(rule['name'])
+            return "Exception - rule: {0}, class: {1}, val: {2}".format(rule['name'], error.__class__.__name__,
+                                                                        str(error)), False
+        if violated:
+            rule_violations.inc(rule['name'], subject.check_source if isinstance(subject, Container)
+                                else CheckSource.AuthzPlugin)
+            return rule['name'], True
+        return None, False
+
+    @staticmethod
+    def _make_verdict(subject: Subject, reasons: List[str]) -> Verdict:
         if len(reasons) > 0:
             return Verdict(True, subject, reasons)
         else:
             return Verdict(False, subject, None)
 
+    def get_verdict_cache_key(self, body_digest: bytes, name: str, owner: str) -> Optional[Hashable]:
+        if self._config.authz_verdict_cache_size <= 0 or body_digest is None:
+            return None
+        fingerprint = self._get_rules_fingerprint()
+        if any(a is not b for a, b in zip(fingerprint, self._verdicts_fingerprint)):
+            self._verdicts.clear()
+            self._load_rules_data_sources()
+            self._verdicts_fingerprint = fingerprint
+        if self._rules_read_container_name:
+            return body_digest, owner, name
+        return body_digest, owner, self._get_name_whitelists_matches(name)
+
+    def get_cached_verdict(self, key: Hashable, subject_factory: Callable[[], Subject]) -> Optional[Verdict]:
+        reasons = self._verdicts.get(key)
+        if reasons is None:
+            return None
+        return self._make_verdict(subject_factory(), list(reasons)) if reasons else Verdict(False, None, None)
+
+    def remember_verdict(self, key: Hashable, verdict: Verdict) -> None:
+        self._verdicts.put(key, tuple(verdict.reasons) if verdict.verdict else ())
+
+    def _get_rules_fingerprint(self) -> Tuple[Any, ...]:
+        return (self._rules, self._custom_whitelist_rules, self._global_whitelist, self._per_rule_whitelist,
+                self._image_global_whitelist, self._image_per_rule_whitelist)
+
+    def _get_name_whitelists_matches(self, name: str) -> Tuple[Any, ...]:
+        if not self._run_whitelists:
+            return ()
+        return (self._global_whitelist.match(name),) + tuple(
+            sorted(rule_name for rule_name, names in self._per_rule_whitelist.items() if names.match(name)))
+
+    def forget_container(self, container_id: str) -> None:
+        if self._config.incremental_checks:
+            self._evaluations.invalidate(container_id)
+
+    def to_prometheus_stats_format(self) -> str:
+        res = self._evaluations.to_prometheus_stats_format() if self._config.incremental_checks else ""
+        if self._config.authz_verdict_cache_size > 0:
+            res += self._verdicts.to_prometheus_stats_format()
+        return res
+
+    def _load_rules_data_sources(self) -> None:
+        usages = {rule['name']: RuleUsage(rule['rule']) for rule in self._rules}
+        self._rule_data_sources: Dict[str, FrozenSet[str]] = {name: u.data_sources for name, u in usages.items()}
+        whitelist_data_sources = set()
+        whitelist_usages = []
+        if self._run_whitelists:
+            whitelist_data_sources.add(DataSource.Params)
+            whitelist_usages = [RuleUsage(rule['rule'], rule['name']) for rule in self._custom_whitelist_rules]
+            for usage in whitelist_usages:
+                whitelist_data_sources.update(usage.data_sources)
+        self._whitelist_data_sources: FrozenSet[str] = frozenset(whitelist_data_sources)
+        self._data_sources: FrozenSet[str] = frozenset(
+            whitelist_data_sources.union(*self._rule_data_sources.values()))
+        self._rules_read_container_name: bool = any(
+            u.reads_container_name for u in itertools.chain(usages.values(), whitelist_usages))
+        logger.debug("Data used by {0} rules: {1}".format(self._subject_type, sorted(self._data_sources)))
+
     def _load_whitelists_from_config(self) -> None:
         self._global_whitelist, self._per_rule_whitelist = self._load_lists_pair_from_config(self._config.white_list)
         self._image_global_whitelist, self._image_per_rule_whitelist = self._load_lists_pair_from_config(
             self._config.image_white_list)
 
-    def _load_lists_pair_from_config(self, whitelist: str) -> Tuple[Iterable[Any], Dict[str, Iterable[Any]]]:
-        global_whitelist = [re.compile("^{0}$".format(r)) for r in whitelist
-                            if r.find(self._whitelist_separator) == -1]
+    def _load_lists_pair_from_config(self, whitelist: str) -> Tuple[WhitelistMatcher, Dict[str, WhitelistMatcher]]:
+        global_whitelist = WhitelistMatcher(r for r in whitelist if r.find(self._whitelist_separator) == -1)
         per_rule = [s.split(self._whitelist_separator, 1) for s in whitelist
                     if s.find(self._whitelist_separator) > -1]
         grouped = itertools.groupby(sorted(per_rule, key=lambda p: p[1]), key=lambda p: p[1])
         per_rule_whitelist = {}
         for pair in grouped:
             rule_name = pair[0]
-            containers_names = [re.compile("^{0}$".format(n[0])) for n in list(pair[1])]
-            per_rule_whitelist[rule_name] = containers_names
+            per_rule_whitelist[rule_name] = WhitelistMatcher(n[0] for n in list(pair[1]))
         return global_whitelist, per_rule_whitelist
 
 
 class Killer(Observer):
-    def __init__(self, manager: DockerHelper, mode: Mode) -> None:
+    def __init__(self, manager: DockerHelper, mode: Mode, max_stats_entries: int = 0,
+                 max_stats_age_sec: float = 0) -> None:
         super().__init__()
         self._mode = mode
         self._manager = manager
-        self._status: StatusDictionary = StatusDictionary()
+        self._status: StatusDictionary = StatusDictionary(max_entries=max_stats_entries,
+                                                          max_age_sec=max_stats_age_sec)
 
     def on_next(self, verdict: Verdict) -> None:
         logger.info("Container {0} is detected to violate the rule \"{1}\". {2} the container [{3} mode]"
@@ -257,18 +653,27 @@ class Killer(Observer):
     def on_completed(self) -> None:
         logger.error("This should never happen. Please contact the dev")
 
-    def get_stats(self) -> StatusDictionary:
+    def get_stats(self) -> StatusSnapshot:
         return self._status.copy()
 
     def register_kill(self, verdict: Verdict):
         self._status.register_killed(verdict)
 
+    def forget_container(self, container_id: str) -> None:
+        self._status.forget(container_id)
+
 
 class TriggerHandler(Observer):
     def __init__(self) -> None:
         super().__init__()
         self._triggers = triggers
 
+    @property
+    def data_sources(self) -> FrozenSet[str]:
+        # triggers get the checked container as the verdict's subject, so what they read has to be fetched as well;
+        # they aren't probed, as running them could have side effects
+        return frozenset().union(*(RuleUsage(t["trigger"], probe=False).data_sources for t in self._triggers))
+
     def on_next(self, verdict) -> None:
         for trigger in self._triggers:
             try:
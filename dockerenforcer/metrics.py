@@ -0,0 +1,139 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+LabelValues = Tuple[str, ...]
+
+DOCKER_API_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RULE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 1.0)
+SCAN_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = ",".join("{0}=\"{1}\"".format(n, _escape(v)) for n, v in zip(names, values))
+    return "{" + pairs + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()) -> None:
+        super().__init__()
+        self._padlock = threading.Lock()
+        self.name: str = name
+        self._documentation: str = documentation
+        self._label_names: LabelValues = tuple(label_names)
+        self._values: Dict[LabelValues, int] = {}
+
+    def inc(self, *label_values: str, amount: int = 1) -> None:
+        with self._padlock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values: str) -> int:
+        return self._values.get(label_values, 0)
+
+    def to_prometheus_stats_format(self) -> str:
+        with self._padlock:
+            values = sorted(self._values.items())
+        res = "# HELP {0} {1}\n# TYPE {0} counter\n".format(self.name, self._documentation)
+        for label_values, value in values:
+            res += "{0}{1} {2}\n".format(self.name, _format_labels(self._label_names, label_values), value)
+        return res
+
+
+class Histogram:
+    # observations are kept as per bucket counts and summed up into the cumulative prometheus buckets on export
+    def __init__(self, name: str, documentation: str, buckets: Iterable[float],
+                 label_names: Iterable[str] = ()) -> None:
+        super().__init__()
+        self._padlock = threading.Lock()
+        self.name: str = name
+        self._documentation: str = documentation
+        self._buckets: List[float] = sorted(buckets)
+        self._label_names: LabelValues = tuple(label_names)
+        # per label values: [count in each bucket..., count above the last bucket, sum of observed values]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        position = bisect.bisect_left(self._buckets, value)
+        with self._padlock:
+            values = self._values.get(label_values)
+            if values is None:
+                values = [0] * (len(self._buckets) + 1) + [0.0]
+                self._values[label_values] = values
+            values[position] += 1
+            values[-1] += value
+
+    @contextmanager
+    def time(self, *label_values: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def get_count(self, *label_values: str) -> int:
+        values = self._values.get(label_values)
+        return sum(values[:-1]) if values is not None else 0
+
+    def to_prometheus_stats_format(self) -> str:
+        with self._padlock:
+            values = sorted((k, list(v)) for k, v in self._values.items())
+        res = "# HELP {0} {1}\n# TYPE {0} histogram\n".format(self.name, self._documentation)
+        for label_values, counts in values:
+            cumulative = 0
+            for bound, count in zip(self._buckets + [float("inf")], counts[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                res += "{0}_bucket{1} {2}\n".format(self.name, _format_labels(
+                    self._label_names + ("le",), label_values + (le,)), cumulative)
+            labels = _format_labels(self._label_names, label_values)
+            res += "{0}_sum{1} {2}\n{0}_count{1} {3}\n".format(self.name, labels, _format_value(counts[-1]),
+                                                              cumulative)
+        return res
+
+
+periodic_scan_duration = Histogram("periodic_scan_duration_seconds",
+                                   "The time a periodic check of all (or one bucket of) the running containers took.",
+                                   SCAN_BUCKETS)
+docker_api_duration = Histogram("docker_api_request_duration_seconds",
+                                "The latency of requests sent to the docker API.", DOCKER_API_BUCKETS, ["call"])
+docker_api_errors = Counter("docker_api_errors_total", "The total number of failed requests to the docker API.",
+                            ["call"])
+events_reconnects = Counter("docker_events_reconnects_total",
+                            "The total number of times the docker events stream was opened again.")
+rule_duration = Histogram("rule_evaluation_duration_seconds", "The time it took to evaluate a rule.",
+                          RULE_BUCKETS, ["rule"])
+rule_violations = Counter("rule_violations_total", "The total number of rule evaluations that found a violation.",
+                          ["rule", "source"])
+rule_errors = Counter("rule_errors_total", "The total number of rule evaluations that raised an exception.",
+                      ["rule"])
+authz_request_duration = Histogram("authz_request_duration_seconds",
+                                   "The time it took to answer an AuthZ plugin request.", DOCKER_API_BUCKETS)
+
+ALL_METRICS = [periodic_scan_duration, docker_api_duration, docker_api_errors, events_reconnects, rule_duration,
+               rule_violations, rule_errors, authz_request_duration]
+
+
+@contextmanager
+def docker_api_call(call: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        docker_api_errors.inc(call)
+        raise
+    finally:
+        docker_api_duration.observe(time.perf_counter() - start, call)
+
+
+def to_prometheus_stats_format() -> str:
+    return "".join(m.to_prometheus_stats_format() for m in ALL_METRICS)
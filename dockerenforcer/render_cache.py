@@ -0,0 +1,49 @@
+import hashlib
+import os
+import threading
+from typing import Callable, Dict, Tuple
+
+from dockerenforcer.cache import LruCache
+
+
+class RenderCache:
+    # Keeps the files shown by the web UI until their mtime or size changes and the HTML rendered for response
+    # bodies, keyed by the hash of the body, so reloading an unchanged page doesn't run pygments again
+    def __init__(self, max_entries: int) -> None:
+        super().__init__()
+        self._padlock = threading.Lock()
+        self._max_entries: int = max_entries
+        self._files: Dict[str, Tuple[Tuple[int, int], str]] = {}
+        self._rendered: LruCache = LruCache("render_cache", max_entries)
+
+    def read_file(self, file_name: str) -> str:
+        file_stat = os.stat(file_name)
+        stamp = (file_stat.st_mtime_ns, file_stat.st_size)
+        with self._padlock:
+            cached = self._files.get(file_name)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        with open(file_name, "r") as file:
+            data = file.read()
+        with self._padlock:
+            self._files[file_name] = (stamp, data)
+        return data
+
+    @staticmethod
+    def etag(data: str, variant: str) -> str:
+        digest = hashlib.sha256(variant.encode())
+        digest.update(b"\0")
+        digest.update(data.encode())
+        return digest.hexdigest()
+
+    def render(self, etag: str, data: str, renderer: Callable[[str], str]) -> str:
+        if self._max_entries <= 0:
+            return renderer(data)
+        rendered = self._rendered.get(etag)
+        if rendered is None:
+            rendered = renderer(data)
+            self._rendered.put(etag, rendered)
+        return rendered
+
+    def to_prometheus_stats_format(self) -> str:
+        return self._rendered.to_prometheus_stats_format() if self._max_entries > 0 else ""
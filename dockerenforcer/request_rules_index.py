@@ -0,0 +1,78 @@
+import re
+from typing import Any, Dict, Iterable, List, Optional, Pattern, Tuple
+
+_API_VERSION_PREFIX = re.compile(r"^/v[0-9][0-9.]*(?=/)")
+_PLACEHOLDER = re.compile(r"^{[^/{}]*}$")
+_ANY = "*"
+
+
+class IndexedRule:
+    def __init__(self, position: int, rule: Dict[str, Any]) -> None:
+        super().__init__()
+        self.position: int = position
+        self.rule: Dict[str, Any] = rule
+        self.methods: Optional[frozenset] = frozenset(m.upper() for m in rule["methods"]) \
+            if rule.get("methods") else None
+        self.paths: Optional[List[Pattern]] = [compile_path_pattern(p) for p in rule["paths"]] \
+            if rule.get("paths") else None
+
+    def first_segments(self) -> Iterable[str]:
+        if self.paths is None:
+            return [_ANY]
+        return [first_segment(p) for p in self.rule["paths"]]
+
+    def matches_path(self, path: str) -> bool:
+        return self.paths is None or any(p.match(path) for p in self.paths)
+
+
+def strip_api_version(path: str) -> str:
+    return _API_VERSION_PREFIX.sub("", path, count=1)
+
+
+def first_segment(path: str) -> str:
+    segment = strip_api_version(path).lstrip("/").split("/", 1)[0]
+    return _ANY if _PLACEHOLDER.match(segment) else segment
+
+
+def compile_path_pattern(pattern: str) -> Pattern:
+    # "/containers/{id}/archive" - a "{...}" placeholder matches exactly one path segment, the API version
+    # prefix (like "/v1.41") is optional in both the pattern and the request
+    segments = strip_api_version(pattern).strip("/").split("/")
+    regex = "/".join("[^/]+" if _PLACEHOLDER.match(s) else re.escape(s) for s in segments)
+    return re.compile("^/{0}/?$".format(regex))
+
+
+class RequestRulesIndex:
+    # Dispatches AuthZ requests only to request rules that declared (with optional "methods" and "paths" keys)
+    # they can apply to them. Rules without declarations are run for every request, as before.
+    def __init__(self, rules: Iterable[Dict[str, Any]]) -> None:
+        super().__init__()
+        self.rules: Iterable[Dict[str, Any]] = rules
+        self._index: Dict[str, Dict[str, List[IndexedRule]]] = {}
+        for position, rule in enumerate(rules):
+            indexed = IndexedRule(position, rule)
+            for method in indexed.methods or [_ANY]:
+                by_segment = self._index.setdefault(method, {})
+                for segment in set(indexed.first_segments()):
+                    by_segment.setdefault(segment, []).append(indexed)
+        self._segments: frozenset = frozenset(s for by_segment in self._index.values() for s in by_segment)
+        self._candidates: Dict[Tuple[str, str], List[IndexedRule]] = {}
+
+    def _get_candidates(self, method: str, segment: str) -> List[IndexedRule]:
+        # methods and segments no rule declared share one entry, so the cache can't grow with unknown requests
+        key = (method if method in self._index else _ANY, segment if segment in self._segments else _ANY)
+        candidates = self._candidates.get(key)
+        if candidates is None:
+            found = {}
+            for m in {key[0], _ANY}:
+                for s in {key[1], _ANY}:
+                    for indexed in self._index.get(m, {}).get(s, []):
+                        found[indexed.position] = indexed
+            candidates = [found[p] for p in sorted(found)]
+            self._candidates[key] = candidates
+        return candidates
+
+    def rules_for(self, method: str, path: str) -> List[Dict[str, Any]]:
+        path = strip_api_version(path)
+        candidates = self._get_candidates(method.upper(), first_segment(path))
+        return [c.rule for c in candidates if c.matches_path(path)]
@@ -0,0 +1,74 @@
+import logging
+import threading
+from typing import Any, Dict, List, Set, Tuple
+
+logger = logging.getLogger("docker_enforcer")
+
+
+class RuleKind:
+    Rule: str = "rule"
+    WhitelistRule: str = "whitelist_rule"
+
+
+class RuleProfile:
+    __slots__ = ('kind', 'name', 'calls', 'total_sec', 'max_sec', 'budget_overruns', 'skipped')
+
+    def __init__(self, kind: str, name: str) -> None:
+        super().__init__()
+        self.kind: str = kind
+        self.name: str = name
+        self.calls: int = 0
+        self.total_sec: float = 0.0
+        self.max_sec: float = 0.0
+        self.budget_overruns: int = 0
+        self.skipped: bool = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"type": self.kind, "name": self.name, "calls": self.calls,
+                "total_ms": round(self.total_sec * 1000, 3),
+                "avg_ms": round(self.total_sec * 1000 / self.calls, 3) if self.calls > 0 else 0.0,
+                "max_ms": round(self.max_sec * 1000, 3), "budget_overruns": self.budget_overruns,
+                "skipped": self.skipped}
+
+
+class RuleProfiler:
+    # Collects the wall time of each rule and whitelist rule. Rules can't be interrupted, so a rule over its
+    # time budget is only logged; after "skip_after" overruns it isn't run anymore and doesn't report violations.
+    # Whitelist rules are never skipped, as that would stop the containers they are meant to allow.
+    def __init__(self, budget_sec: float = 0, skip_after: int = 0) -> None:
+        super().__init__()
+        self._padlock = threading.Lock()
+        self._budget_sec: float = budget_sec
+        self._skip_after: int = skip_after
+        self._profiles: Dict[Tuple[str, str], RuleProfile] = {}
+        self._skipped_rules: Set[str] = set()
+
+    def is_skipped(self, rule_name: str) -> bool:
+        return rule_name in self._skipped_rules
+
+    def record(self, kind: str, name: str, elapsed_sec: float) -> None:
+        with self._padlock:
+            profile = self._profiles.get((kind, name))
+            if profile is None:
+                profile = RuleProfile(kind, name)
+                self._profiles[(kind, name)] = profile
+            profile.calls += 1
+            profile.total_sec += elapsed_sec
+            profile.max_sec = max(profile.max_sec, elapsed_sec)
+            if not 0 < self._budget_sec < elapsed_sec:
+                return
+            profile.budget_overruns += 1
+            skip = kind == RuleKind.Rule and not profile.skipped and 0 < self._skip_after <= profile.budget_overruns
+            if skip:
+                profile.skipped = True
+                self._skipped_rules.add(name)
+        logger.warning("The {0} '{1}' took {2:.3f} ms, over its time budget of {3:.3f} ms"
+                       .format(kind.replace("_", " "), name, elapsed_sec * 1000, self._budget_sec * 1000))
+        if skip:
+            logger.error("The rule '{0}' went over its time budget {1} times, it won't be run anymore"
+                         .format(name, profile.budget_overruns))
+
+    def get_ranking(self) -> List[Dict[str, Any]]:
+        with self._padlock:
+            profiles = [p.to_dict() for p in self._profiles.values()]
+        return sorted(profiles, key=lambda p: (-p["total_ms"], -p["max_ms"], p["name"]))
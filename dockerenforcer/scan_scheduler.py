@@ -0,0 +1,260 @@
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from dockerenforcer.docker_helper import CheckSource, Container, DockerHelper
+
+logger = logging.getLogger("docker_enforcer")
+
+
+class ScanPriority:
+    High: str = "high"
+    Elevated: str = "elevated"
+    Normal: str = "normal"
+    Low: str = "low"
+
+
+PRIORITIES: List[str] = [ScanPriority.High, ScanPriority.Elevated, ScanPriority.Normal, ScanPriority.Low]
+
+
+class ScanState:
+    __slots__ = ('container_id', 'changed_at', 'next_due', 'last_checked', 'violated', 'verdict_changed',
+                 'compliant_checks', 'priority')
+
+    def __init__(self, container_id: str, changed_at: Optional[float], next_due: float) -> None:
+        super().__init__()
+        self.container_id: str = container_id
+        self.changed_at: Optional[float] = changed_at
+        self.next_due: float = next_due
+        self.last_checked: Optional[float] = None
+        self.violated: Optional[bool] = None
+        self.verdict_changed: bool = False
+        self.compliant_checks: int = 0
+        self.priority: str = ScanPriority.Normal
+
+
+class PriorityScanScheduler:
+    # On every tick checks the running containers that are due, the ones with the highest priority first, without
+    # going over the budget of docker API calls per second; the containers left out stay due for the next tick.
+    # How often a container is due depends on its priority:
+    # - high: started or updated within the last check interval,
+    # - elevated: violated a rule or changed its verdict on the last check,
+    # - low: stayed compliant for low_priority_after_checks checks in a row,
+    # - normal: all the other ones.
+    interval_factors: Dict[str, float] = {ScanPriority.High: 0.25, ScanPriority.Elevated: 0.5,
+                                          ScanPriority.Normal: 1.0, ScanPriority.Low: 2.0}
+    low_priority_after_checks: int = 6
+
+    def __init__(self, docker_helper: DockerHelper, interval_sec: float, tick_sec: float,
+                 api_calls_per_sec: float = 0, concurrency: int = 1) -> None:
+        super().__init__()
+        self._padlock = threading.Lock()
+        self._check_in_progress: bool = False
+        self._docker_helper: DockerHelper = docker_helper
+        self._interval_sec: float = interval_sec
+        self._tick_sec: float = tick_sec
+        self._api_calls_per_sec: float = api_calls_per_sec
+        self._concurrency: int = max(1, concurrency)
+        self._tokens: float = 0.0
+        self._last_refill: Optional[float] = None
+        self._states: Dict[str, ScanState] = {}
+        self._listed_once: bool = False
+        self._queue_lengths: Dict[str, int] = {p: 0 for p in PRIORITIES}
+        self._checks: Dict[str, int] = {p: 0 for p in PRIORITIES}
+        self.deferred_checks: int = 0
+
+    def _get_priority(self, state: ScanState, now: float) -> str:
+        if state.changed_at is not None and now - state.changed_at < self._interval_sec:
+            return ScanPriority.High
+        if state.violated or state.verdict_changed:
+            return ScanPriority.Elevated
+        if state.compliant_checks >= self.low_priority_after_checks:
+            return ScanPriority.Low
+        return ScanPriority.Normal
+
+    def _reschedule(self, state: ScanState, now: float) -> None:
+        state.priority = self._get_priority(state, now)
+        state.next_due = (state.last_checked if state.last_checked is not None else now) \
+            + self._interval_sec * self.interval_factors[state.priority]
+
+    def on_container_changed(self, container_id: str) -> None:
+        now = time.monotonic()
+        with self._padlock:
+            state = self._states.get(container_id)
+            if state is None:
+                self._states[container_id] = ScanState(container_id, now, now)
+                return
+            state.changed_at = now
+            state.next_due = now
+
+    def on_verdict(self, verdict) -> None:
+        subject = verdict.subject
+        if not isinstance(subject, Container):
+            return
+        now = time.monotonic()
+        with self._padlock:
+            state = self._states.get(subject.cid)
+            if state is None:
+                return
+            violated = bool(verdict.verdict)
+            state.verdict_changed = state.violated is not None and state.violated != violated
+            state.violated = violated
+            state.compliant_checks = 0 if violated else state.compliant_checks + 1
+            self._reschedule(state, now)
+
+    def _sync_running(self, running_container_ids: List[str], now: float) -> None:
+        # containers that show up after the first listing are treated as just started
+        states = {}
+        for cid in running_container_ids:
+            state = self._states.get(cid)
+            states[cid] = state if state is not None else ScanState(cid, now if self._listed_once else None, now)
+        self._states = states
+        self._listed_once = True
+
+    def _take_budget(self, cost: int, deadline: float) -> bool:
+        # a token bucket holding at most a second worth of calls; checks wait for their calls to be available,
+        # so the daemon gets a steady rate of requests instead of a burst at the beginning of every tick
+        if self._api_calls_per_sec <= 0:
+            return True
+        capacity = max(cost, self._api_calls_per_sec)
+        while True:
+            now = time.monotonic()
+            with self._padlock:
+                if self._last_refill is None:
+                    self._tokens = capacity
+                else:
+                    self._tokens = min(capacity, self._tokens + (now - self._last_refill) * self._api_calls_per_sec)
+                self._last_refill = now
+                if self._tokens >= cost:
+                    self._tokens -= cost
+                    return True
+                wait = (cost - self._tokens) / self._api_calls_per_sec
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def check_due_containers(self) -> Iterable[Container]:
+        # every tick is a periodic run: it updates the last run timestamps and duration of the docker helper
+        with self._padlock:
+            if self._check_in_progress:
+                logger.warning("[{0}] Previous priority check did not yet complete"
+                               .format(threading.current_thread().name))
+                return
+            self._check_in_progress = True
+        try:
+            if not self._docker_helper.periodic_checks_allowed():
+                logger.warning("Docker API is struggling, skipping the priority check")
+                return
+            scan_start = self._docker_helper.start_periodic_run()
+            now = time.monotonic()
+            deadline = now + self._tick_sec
+            # listing the containers is a docker API call as well
+            if not self._take_budget(1, deadline):
+                self._docker_helper.finish_periodic_run(False, scan_start)
+                return
+            ids = self._docker_helper.list_running_containers()
+            if ids is None:
+                self._docker_helper.finish_periodic_run(False, scan_start)
+                return
+            with self._padlock:
+                self._sync_running(ids, now)
+                for state in self._states.values():
+                    state.priority = self._get_priority(state, now)
+                due = sorted((s for s in self._states.values() if s.next_due <= now),
+                             key=lambda s: (PRIORITIES.index(s.priority), s.next_due))
+            cost = max(1, self._docker_helper.api_calls_per_check())
+            started = []
+            yield from self._check_states(due, cost, deadline, started)
+            with self._padlock:
+                self.deferred_checks += len(due) - len(started)
+                self._queue_lengths = {p: 0 for p in PRIORITIES}
+                for state in due[len(started):]:
+                    self._queue_lengths[state.priority] += 1
+            self._docker_helper.purge_stopped_containers(ids)
+            self._docker_helper.finish_periodic_run(True, scan_start)
+        finally:
+            with self._padlock:
+                self._check_in_progress = False
+
+    def _next_state(self, due: Iterator[ScanState], cost: int, deadline: float) -> Optional[ScanState]:
+        state = next(due, None)
+        # the circuit breaker can open in the middle of the tick as well
+        if state is None or not self._docker_helper.periodic_checks_allowed() \
+                or not self._take_budget(cost, deadline):
+            return None
+        return state
+
+    def _check_states(self, due: List[ScanState], cost: int, deadline: float,
+                      started: List[ScanState]) -> Iterable[Container]:
+        # checks the due containers in order, on up to `concurrency` threads, until the budget runs out
+        states = iter(due)
+        if self._concurrency <= 1:
+            state = self._next_state(states, cost, deadline)
+            while state is not None:
+                started.append(state)
+                container = self._check(state)
+                if container is not None:
+                    yield container
+                state = self._next_state(states, cost, deadline)
+            return
+
+        with ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix="priority_scan") as executor:
+            pending: Set[Future] = set()
+            try:
+                while True:
+                    if len(pending) >= self._concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for container in (f.result() for f in done):
+                            if container is not None:
+                                yield container
+                    state = self._next_state(states, cost, deadline)
+                    if state is None:
+                        break
+                    started.append(state)
+                    pending.add(executor.submit(self._check, state))
+                for future in as_completed(pending):
+                    container = future.result()
+                    if container is not None:
+                        yield container
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _check(self, state: ScanState) -> Optional[Container]:
+        container = self._docker_helper.check_container(state.container_id, CheckSource.Periodic)
+        with self._padlock:
+            state.last_checked = time.monotonic()
+            self._checks[state.priority] += 1
+            self._reschedule(state, state.last_checked)
+        if container is not None:
+            self._docker_helper.record_periodic_check(state.container_id)
+        return container
+
+    def get_recent_window_start(self) -> datetime.datetime:
+        # every running container is checked at least once within the interval of the lowest priority
+        return datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=self._interval_sec * max(self.interval_factors.values()))
+
+    def to_prometheus_stats_format(self) -> str:
+        with self._padlock:
+            queue_lengths = dict(self._queue_lengths)
+            checks = dict(self._checks)
+            tracked = {p: 0 for p in PRIORITIES}
+            for state in self._states.values():
+                tracked[state.priority] += 1
+        res = "# HELP scan_queue_length The number of due containers left for the next tick by the API budget.\n" \
+              "# TYPE scan_queue_length gauge\n"
+        res += "".join("scan_queue_length{{priority=\"{0}\"}} {1}\n".format(p, queue_lengths[p]) for p in PRIORITIES)
+        res += "# HELP scan_containers The number of running containers with the given check priority.\n" \
+               "# TYPE scan_containers gauge\n"
+        res += "".join("scan_containers{{priority=\"{0}\"}} {1}\n".format(p, tracked[p]) for p in PRIORITIES)
+        res += "# HELP scan_checks_total The total number of periodic checks run with the given priority.\n" \
+               "# TYPE scan_checks_total counter\n"
+        res += "".join("scan_checks_total{{priority=\"{0}\"}} {1}\n".format(p, checks[p]) for p in PRIORITIES)
+        res += "# HELP scan_deferred_checks_total The total number of due checks postponed by the API calls budget.\n" \
+               "# TYPE scan_deferred_checks_total counter\n" \
+               "scan_deferred_checks_total {0}\n".format(self.deferred_checks)
+        return res
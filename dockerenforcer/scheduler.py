@@ -0,0 +1,96 @@
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Tuple
+
+from rx.concurrency.schedulerbase import SchedulerBase
+from rx.disposables import SingleAssignmentDisposable, CompositeDisposable, AnonymousDisposable
+
+logger = logging.getLogger("docker_enforcer")
+
+
+class BoundedThreadPoolScheduler(SchedulerBase):
+    # Runs scheduled actions on at most max_workers threads, started when needed. At most max_queue actions wait
+    # for a free worker; a thread scheduling more is blocked until there's room, so a flood of docker events is
+    # held back in the events stream instead of piling up threads or memory. Actions scheduled by the pool's own
+    # workers are queued without waiting, as blocking a worker on its own queue could stall the whole pool.
+    def __init__(self, name: str, max_workers: int, max_queue: int = 0) -> None:
+        super().__init__()
+        self._condition = threading.Condition()
+        self._name: str = name
+        self._max_workers: int = max(1, max_workers)
+        self._max_queue: int = max_queue
+        self._queue: Deque[Tuple[Callable, Any, SingleAssignmentDisposable]] = deque()
+        self._worker_local = threading.local()
+        self._workers: int = 0
+        self._idle_workers: int = 0
+        self.backpressure_waits: int = 0
+
+    def schedule(self, action: Callable, state: Any = None) -> SingleAssignmentDisposable:
+        disposable = SingleAssignmentDisposable()
+        with self._condition:
+            if not getattr(self._worker_local, "is_worker", False):
+                waited = False
+                while 0 < self._max_queue <= len(self._queue):
+                    if not waited:
+                        waited = True
+                        self.backpressure_waits += 1
+                        logger.debug("[{0}] {1} queue is full, waiting for a free worker"
+                                     .format(threading.current_thread().name, self._name))
+                    self._condition.wait()
+            self._queue.append((action, state, disposable))
+            if self._idle_workers < len(self._queue) and self._workers < self._max_workers:
+                self._workers += 1
+                threading.Thread(target=self._work, name="{0}_{1}".format(self._name, self._workers),
+                                 daemon=True).start()
+            self._condition.notify_all()
+        return disposable
+
+    def schedule_relative(self, duetime: Any, action: Callable, state: Any = None) -> CompositeDisposable:
+        seconds = self.to_relative(duetime) / 1000.0
+        if seconds <= 0:
+            return self.schedule(action, state)
+        disposable = CompositeDisposable()
+        timer = threading.Timer(seconds, lambda: disposable.add(self.schedule(action, state)))
+        timer.daemon = True
+        timer.start()
+        disposable.add(AnonymousDisposable(timer.cancel))
+        return disposable
+
+    def schedule_absolute(self, duetime: Any, action: Callable, state: Any = None) -> CompositeDisposable:
+        return self.schedule_relative(self.to_datetime(duetime) - self.now, action, state)
+
+    def _work(self) -> None:
+        self._worker_local.is_worker = True
+        while True:
+            with self._condition:
+                self._idle_workers += 1
+                while not self._queue:
+                    self._condition.wait()
+                self._idle_workers -= 1
+                action, state, disposable = self._queue.popleft()
+                self._condition.notify_all()
+            if disposable.is_disposed:
+                continue
+            try:
+                disposable.disposable = self.invoke_action(action, state)
+            except Exception as e:
+                logger.error("Unexpected error in {0} worker: {1}".format(self._name, e))
+
+    def to_prometheus_stats_format(self) -> str:
+        with self._condition:
+            res = """# HELP {0}_workers The current number of {0} worker threads.
+# TYPE {0}_workers gauge
+{0}_workers {1}
+# HELP {0}_busy_workers The current number of {0} worker threads running an action.
+# TYPE {0}_busy_workers gauge
+{0}_busy_workers {2}
+# HELP {0}_queue_depth The current number of actions waiting for a free {0} worker.
+# TYPE {0}_queue_depth gauge
+{0}_queue_depth {3}
+# HELP {0}_backpressure_waits_total The total number of times scheduling waited for room in the {0} queue.
+# TYPE {0}_backpressure_waits_total counter
+{0}_backpressure_waits_total {4}
+""".format(self._name, self._workers, self._workers - self._idle_workers, len(self._queue),
+           self.backpressure_waits)
+        return res
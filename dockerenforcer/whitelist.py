@@ -0,0 +1,54 @@
+import logging
+import re
+from typing import Iterable, List, Pattern, Optional
+
+logger = logging.getLogger("docker_enforcer")
+
+_REGEX_SPECIAL_CHARS = re.compile(r"[.^$*+?{}\[\]\\|()]")
+_BACK_REFERENCE = re.compile(r"\\[1-9]|\(\?P=")
+_GLOBAL_FLAGS = re.compile(r"\(\?[aiLmsux]+\)")
+
+
+class WhitelistMatcher:
+    # Matches names against a whole whitelist at once: entries without any regex special characters are looked
+    # up in a set, all the other ones are merged into a single alternation regex
+    def __init__(self, patterns: Iterable[str]) -> None:
+        super().__init__()
+        patterns = list(patterns)
+        self._exact: frozenset = frozenset(p for p in patterns if not _REGEX_SPECIAL_CHARS.search(p))
+        regexes = [p for p in patterns if _REGEX_SPECIAL_CHARS.search(p)]
+        # back references are numbered per whole pattern, so they would break once merged with other entries, and
+        # global flags like (?i) would apply to all the other entries too
+        mergeable = [r for r in regexes if not self._needs_own_pattern(r)]
+        separate = [r for r in regexes if self._needs_own_pattern(r)]
+        self._merged: Optional[Pattern] = None
+        if mergeable:
+            try:
+                self._merged = re.compile("^(?:{0})$".format("|".join("(?:{0})".format(r) for r in mergeable)))
+            except re.error as e:
+                logger.debug("Can't merge whitelist regexes ({0}), matching them one by one".format(e))
+                separate = regexes
+        self._separate: List[Pattern] = [self._compile_anchored(r) for r in separate]
+        self._size: int = len(patterns)
+
+    @staticmethod
+    def _needs_own_pattern(regex: str) -> bool:
+        return bool(_BACK_REFERENCE.search(regex) or _GLOBAL_FLAGS.search(regex))
+
+    @staticmethod
+    def _compile_anchored(regex: str) -> Pattern:
+        # global flags have to stay at the start of the pattern (newer python versions reject them elsewhere)
+        flags = _GLOBAL_FLAGS.match(regex)
+        if flags is not None:
+            return re.compile("{0}^{1}$".format(flags.group(0), regex[flags.end():]))
+        return re.compile("^{0}$".format(regex))
+
+    def match(self, name: str) -> bool:
+        if name in self._exact:
+            return True
+        if self._merged is not None and self._merged.match(name):
+            return True
+        return any(r.match(name) for r in self._separate)
+
+    def __len__(self) -> int:
+        return self._size
@@ -4,9 +4,10 @@ import logging
 
 logger = logging.getLogger("docker_enforcer")
 
+# a rule without "methods" and "paths" is run for every API call, for example:
+#    {
+#        "name": "always false",
+#        "rule": lambda request: False
+#    }
 request_rules = [
-    {
-        "name": "always false",
-        "rule": lambda request: False
-    }
 ]
@@ -1,4 +1,5 @@
 import json
+from base64 import b64decode, b64encode
 import unittest
 
 import re
@@ -6,8 +7,9 @@ from unittest import mock
 
 from flask import Response
 
-from docker_enforcer import app, judge, config, requests_judge, trigger_handler
+from docker_enforcer import app, judge, config, requests_judge, trigger_handler, on_container_event
 from dockerenforcer.config import Mode
+from dockerenforcer.whitelist import WhitelistMatcher
 from test.test_helpers import ApiTestHelper, DefaultRulesHelper
 
 
@@ -42,8 +44,8 @@ class ApiContainerTest(unittest.TestCase):
 
     def setUp(self):
         judge._rules = []
-        judge._global_whitelist = []
-        judge._image_global_whitelist = []
+        judge._global_whitelist = WhitelistMatcher([])
+        judge._image_global_whitelist = WhitelistMatcher([])
         judge._per_rule_whitelist = {}
         judge._image_per_rule_whitelist = {}
         judge._custom_whitelist_rules = {}
@@ -80,6 +82,32 @@ class ApiContainerTest(unittest.TestCase):
         res = self.app.post('/AuthZPlugin.AuthZReq', data=ApiTestHelper.authz_req_copy_to_cont)
         self._check_response(res, False, "cp not allowed")
 
+    def test_request_rule_with_declared_paths(self):
+        requests_judge._rules = [{"name": "cp not allowed", "methods": ["GET", "HEAD"],
+                                  "paths": ["/containers/{id}/archive"], "rule": lambda r: True}]
+        res = self.app.post('/AuthZPlugin.AuthZReq', data=ApiTestHelper.authz_req_copy_to_cont)
+        self._check_response(res, False, "cp not allowed")
+        res = self.app.post('/AuthZPlugin.AuthZReq', data=ApiTestHelper.authz_req_run_with_tls)
+        self._check_response(res, True)
+
+    def test_request_without_declared_rules_allowed_early(self):
+        requests_judge._rules = [{"name": "cp not allowed", "methods": ["GET", "HEAD"],
+                                  "paths": ["/containers/{id}/archive"], "rule": lambda r: True}]
+        data = json.dumps({"RequestMethod": "GET", "RequestUri": "/v1.41/_ping"}).encode()
+        with mock.patch.object(requests_judge, 'should_be_killed') as should_be_killed:
+            res = self.app.post('/AuthZPlugin.AuthZReq', data=data)
+        self._check_response(res, True)
+        should_be_killed.assert_not_called()
+
+    def test_request_rule_reads_body(self):
+        requests_judge._rules = [{"name": "no tar uploads",
+                                  "rule": lambda r: r['requestmethod'] == 'PUT' and 'requestbody' in r
+                                  and b64decode(r['requestbody']).startswith(b'tar')}]
+        data = json.dumps({"RequestMethod": "PUT", "RequestUri": "/v1.30/containers/test/archive?path=%2Ftmp",
+                           "RequestBody": b64encode(b'tar' + b'\0' * 4096).decode()}).encode()
+        res = self.app.post('/AuthZPlugin.AuthZReq', data=data)
+        self._check_response(res, False, "no tar uploads")
+
     def test_trigger_when_rule_fails_run_with_mem_check(self):
         judge._rules = [self.mem_rule]
         trigger_handler._triggers = [self.test_trigger]
@@ -101,32 +129,56 @@ class ApiContainerTest(unittest.TestCase):
 
     def test_violates_rules_but_on_whitelist(self):
         judge._rules = [self.forbid_privileged_rule]
-        judge._global_whitelist = [re.compile('^docker_enforcer$')]
+        judge._global_whitelist = WhitelistMatcher(['docker_enforcer'])
         res = self.app.post('/AuthZPlugin.AuthZReq',
                             data=ApiTestHelper.authz_req_run_with_privileged_name_docker_enforcer)
         self._check_response(res, True)
 
     def test_violates_rules_but_on_image_whitelist(self):
         judge._rules = [self.forbid_privileged_rule]
-        judge._image_global_whitelist = [re.compile('^alpine$')]
+        judge._image_global_whitelist = WhitelistMatcher(['alpine'])
         res = self.app.post('/AuthZPlugin.AuthZReq',
                             data=ApiTestHelper.authz_req_run_with_privileged_name_test)
         self._check_response(res, True)
 
     def test_violates_rules_but_on_per_rule_regexp_whitelist(self):
         judge._rules = [self.forbid_privileged_rule]
-        judge._per_rule_whitelist = {self.forbid_privileged_rule['name']: [re.compile('^docker_enf.*$')]}
+        judge._per_rule_whitelist = {self.forbid_privileged_rule['name']: WhitelistMatcher(['docker_enf.*'])}
         res = self.app.post('/AuthZPlugin.AuthZReq',
                             data=ApiTestHelper.authz_req_run_with_privileged_name_docker_enforcer)
         self._check_response(res, True)
 
     def test_violates_rules_but_on_per_rule_regexp_image_whitelist(self):
         judge._rules = [self.forbid_privileged_rule]
-        judge._image_per_rule_whitelist = {self.forbid_privileged_rule['name']: [re.compile('^alp.*$')]}
+        judge._image_per_rule_whitelist = {self.forbid_privileged_rule['name']: WhitelistMatcher(['alp.*'])}
         res = self.app.post('/AuthZPlugin.AuthZReq',
                             data=ApiTestHelper.authz_req_run_with_privileged_name_test)
         self._check_response(res, True)
 
+    def test_create_verdicts_cached(self):
+        config.authz_verdict_cache_size = 10
+        try:
+            judge._rules = [self.forbid_privileged_rule]
+            judge._global_whitelist = WhitelistMatcher(['docker_enforcer'])
+            req = ApiTestHelper.authz_req_run_with_privileged_name_docker_enforcer
+            unnamed_req = req.replace(b'?name=docker_enforcer', b'')
+            for _ in range(2):
+                self._check_response(self.app.post('/AuthZPlugin.AuthZReq', data=req), True)
+            self.assertEqual(judge._verdicts.hits, 1)
+            # the same body, but the name isn't on the white list
+            for _ in range(2):
+                res = self.app.post('/AuthZPlugin.AuthZReq', data=unnamed_req)
+                self._check_response(res, False, self.forbid_privileged_rule['name'])
+            self.assertEqual(judge._verdicts.hits, 2)
+            # changed rules drop cached verdicts
+            judge._rules = [self.mem_rule]
+            res = self.app.post('/AuthZPlugin.AuthZReq', data=unnamed_req)
+            self._check_response(res, False, self.mem_rule['name'])
+            self.assertEqual(len(judge._verdicts), 1)
+        finally:
+            config.authz_verdict_cache_size = 0
+            judge._verdicts.clear()
+
     def test_violates_rules_but_on_custom_whitelist(self):
         judge._rules = [self.forbid_privileged_rule]
         judge._custom_whitelist_rules = [{
@@ -153,6 +205,51 @@ class ApiContainerTest(unittest.TestCase):
         self.assertEqual(det["violated_rule"], "must have memory limit")
         self.assertEqual(det["owner"], "client")
 
+    def test_detections_paginated(self):
+        judge._rules = [self.mem_rule]
+        self.app.post('/AuthZPlugin.AuthZReq', data=ApiTestHelper.authz_req_plain_run_with_tls)
+        log = self.app.get('/?limit=1&fields=id,count')
+        int_json = json.loads(log.data.decode(log.charset))
+        self.assertEqual(len(int_json["detections"]), 1)
+        self.assertEqual(set(int_json["detections"][0].keys()), {"id", "count"})
+        log = self.app.get('/?offset=1000')
+        self.assertEqual(json.loads(log.data.decode(log.charset))["detections"], [])
+
+    def test_authz_detections_dropped_on_destroy(self):
+        judge._rules = [self.mem_rule]
+        self.app.post('/AuthZPlugin.AuthZReq', data=ApiTestHelper.authz_req_plain_run_with_tls)
+        event = {"Type": "container", "Action": "destroy", "id": "cid",
+                 "Actor": {"ID": "cid", "Attributes": {"name": "<unnamed_container>"}}}
+        with mock.patch.object(config, "stats_drop_on_destroy", True):
+            on_container_event(event)
+        log = self.app.get('/')
+        self.assertEqual(json.loads(log.data.decode(log.charset))["detections"], [])
+
+    def test_rules_profile_disabled(self):
+        res = self.app.get('/debug/rules/profile')
+        self.assertEqual(json.loads(res.data.decode(res.charset)),
+                         {"enabled": False, "rules": [], "request_rules": []})
+
+    def test_metrics_instrumentation(self):
+        judge._rules = [self.mem_rule]
+        self.app.post('/AuthZPlugin.AuthZReq', data=ApiTestHelper.authz_req_plain_run_with_tls)
+        res = self.app.get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        data = res.data.decode(res.charset)
+        self.assertIn('rule_violations_total{rule="must have memory limit",source="authz_plugin"}', data)
+        self.assertIn('rule_evaluation_duration_seconds_count{rule="must have memory limit"}', data)
+        self.assertIn('authz_request_duration_seconds_count', data)
+        self.assertIn('pipeline_queue_depth', data)
+
+    def test_detections_since(self):
+        judge._rules = [self.mem_rule]
+        self.app.post('/AuthZPlugin.AuthZReq', data=ApiTestHelper.authz_req_plain_run_with_tls)
+        log = self.app.get('/?since=2000-01-01T00:00:00Z')
+        self.assertEqual(len(json.loads(log.data.decode(log.charset))["detections"]), 1)
+        log = self.app.get('/recent?since=9999-01-01T00:00:00')
+        self.assertEqual(json.loads(log.data.decode(log.charset))["detections"], [])
+        self.assertEqual(self.app.get('/?since=yesterday').status_code, 400)
+
     def test_handles_empty_when_default_action_accept(self):
         config.default_allow = True
         res = self.app.post('/AuthZPlugin.AuthZReq', data=ApiTestHelper.authz_req_empty)
@@ -194,6 +291,15 @@ class ApiInfoTest(unittest.TestCase):
         res = self.app.get('/rules', headers={"Accept": "text/html"})
         self._check_rules_response(res, "text/html")
 
+    def test_fetch_rules_html_not_modified(self):
+        res = self.app.get('/rules', headers={"Accept": "text/html"})
+        etag = res.headers["ETag"]
+        res = self.app.get('/rules', headers={"Accept": "text/html", "If-None-Match": etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b"")
+        res = self.app.get('/rules', headers={"If-None-Match": etag})
+        self._check_rules_response(res, "application/json", DefaultRulesHelper.rules_json)
+
     def test_fetch_triggers(self):
         res = self.app.get('/triggers')
         self._check_rules_response(res, "application/json", DefaultRulesHelper.triggers_json)
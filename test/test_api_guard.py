@@ -0,0 +1,156 @@
+import threading
+import time
+import unittest
+
+from docker.errors import NotFound
+from unittest.mock import MagicMock
+
+from dockerenforcer.api_guard import CallLimiter, CircuitBreaker, DockerApiGuard
+from dockerenforcer.config import Config, parse_call_limits
+
+
+class CallLimiterTests(unittest.TestCase):
+    def test_limits_calls_in_flight(self):
+        limiter = CallLimiter(max_in_flight=1)
+        limiter.acquire(False)
+        waiter = threading.Thread(target=limiter.acquire, args=(False,), daemon=True)
+        waiter.start()
+        waiter.join(0.1)
+        self.assertTrue(waiter.is_alive())
+        self.assertEqual(limiter.throttled, 1)
+        limiter.release()
+        waiter.join(5)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(limiter.in_flight, 1)
+
+    def test_limits_rate(self):
+        limiter = CallLimiter(rate_per_sec=20)
+        start = time.monotonic()
+        for _ in range(25):
+            limiter.acquire(False)
+            limiter.release()
+        # 20 calls fit in the bucket, the next 5 come at 20 per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_foreground_calls_go_first(self):
+        limiter = CallLimiter(max_in_flight=1)
+        limiter.acquire(False)
+        order = []
+
+        def call(background, name):
+            limiter.acquire(background)
+            order.append(name)
+            limiter.release()
+
+        background = threading.Thread(target=call, args=(True, "periodic"), daemon=True)
+        background.start()
+        time.sleep(0.05)
+        foreground = threading.Thread(target=call, args=(False, "event"), daemon=True)
+        foreground.start()
+        time.sleep(0.05)
+        limiter.release()
+        background.join(5)
+        foreground.join(5)
+        self.assertEqual(order, ["event", "periodic"])
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    def test_disabled_by_default(self):
+        breaker = CircuitBreaker(window_size=2)
+        for _ in range(5):
+            breaker.record(10, True)
+        self.assertFalse(breaker.enabled)
+        self.assertFalse(breaker.is_open())
+
+    def test_opens_on_latency(self):
+        breaker = CircuitBreaker(latency_threshold_sec=0.5, window_size=3, pause_sec=60)
+        breaker.record(0.1, False)
+        breaker.record(1, False)
+        self.assertFalse(breaker.is_open())
+        breaker.record(1, False)
+        self.assertTrue(breaker.is_open())
+        self.assertEqual(breaker.opened, 1)
+
+    def test_untimed_calls_only_count_for_errors(self):
+        breaker = CircuitBreaker(latency_threshold_sec=0.5, error_rate_threshold=0.5, window_size=3, pause_sec=60)
+        breaker.record(0.1, False)
+        for _ in range(5):
+            breaker.record(None, False)
+        self.assertFalse(breaker.is_open())
+        breaker.record(None, True)
+        breaker.record(None, True)
+        self.assertTrue(breaker.is_open())
+
+    def test_opens_on_error_rate(self):
+        breaker = CircuitBreaker(error_rate_threshold=0.5, window_size=4, pause_sec=60)
+        for failed in (False, False, False, True):
+            breaker.record(0.01, failed)
+        self.assertFalse(breaker.is_open())
+        breaker.record(0.01, True)
+        self.assertTrue(breaker.is_open())
+
+    def test_closes_after_pause(self):
+        breaker = CircuitBreaker(error_rate_threshold=0.5, window_size=1, pause_sec=0.05)
+        breaker.record(0.01, True)
+        self.assertTrue(breaker.is_open())
+        time.sleep(0.1)
+        self.assertFalse(breaker.is_open())
+
+
+class DockerApiGuardTests(unittest.TestCase):
+    def setUp(self):
+        self._config = Config()
+        self._config.docker_api_max_in_flight = {"stats": 2}
+        self._config.circuit_breaker_error_rate = 0.5
+        self._config.circuit_breaker_window = 2
+
+    def test_parse_call_limits(self):
+        self.assertEqual(parse_call_limits(""), {})
+        self.assertEqual(parse_call_limits("inspect=50, stats=2.5"), {"inspect": 50, "stats": 2.5})
+
+    def test_errors_pause_periodic_checks(self):
+        guard = DockerApiGuard(self._config)
+        for _ in range(2):
+            with self.assertRaises(ValueError), guard.call("stats"):
+                raise ValueError()
+        self.assertFalse(guard.periodic_checks_allowed())
+        self.assertIn("docker_api_circuit_open 1\n", guard.to_prometheus_stats_format())
+
+    def test_slow_untimed_calls_keep_periodic_checks(self):
+        self._config.circuit_breaker_latency_ms = 1
+        guard = DockerApiGuard(self._config)
+        for _ in range(2):
+            with guard.call("stats", timed=False):
+                time.sleep(0.01)
+        self.assertTrue(guard.periodic_checks_allowed())
+
+    def test_not_found_is_not_an_error(self):
+        guard = DockerApiGuard(self._config)
+        for _ in range(2):
+            with self.assertRaises(NotFound), guard.call("inspect"):
+                raise NotFound("gone")
+        self.assertTrue(guard.periodic_checks_allowed())
+
+    def test_in_flight_metrics(self):
+        guard = DockerApiGuard(self._config)
+        with guard.call("stats"):
+            stats = guard.to_prometheus_stats_format()
+        self.assertIn("docker_api_in_flight{call=\"stats\"} 1\n", stats)
+        self.assertIn("docker_api_throttled_total{call=\"stats\"} 0\n", stats)
+
+    def test_background_flag_is_per_thread(self):
+        guard = DockerApiGuard(self._config)
+        limiter = MagicMock()
+        guard._limiters["inspect"] = limiter
+
+        def call():
+            with guard.call("inspect"):
+                pass
+
+        with guard.background():
+            call()
+            other = threading.Thread(target=call, daemon=True)
+            other.start()
+            other.join(5)
+        limiter.acquire.assert_any_call(True)
+        limiter.acquire.assert_any_call(False)
@@ -0,0 +1,37 @@
+import json
+import unittest
+from base64 import b64encode
+
+from dockerenforcer.authz_request import AuthzRequest
+from .test_helpers import ApiTestHelper
+
+
+class AuthzRequestTests(unittest.TestCase):
+    def test_parse_without_body(self):
+        req = AuthzRequest.parse(ApiTestHelper.authz_req_copy_from_cont)
+        self.assertEqual(req["requestmethod"], "GET")
+        self.assertEqual(req["requestheaders"], {"user-agent": "Docker-Client/17.06.0-ce (linux)"})
+        self.assertFalse("requestbody" in req)
+        self.assertFalse(req.has_body())
+
+    def test_body_decoded_lazily(self):
+        req = AuthzRequest.parse(ApiTestHelper.authz_req_create_with_only_image)
+        self.assertEqual(req["requesturi"], "/containers/create")
+        self.assertEqual(req["requestheaders"]["content-length"], "18")
+        self.assertFalse(dict.__contains__(req, "requestbody"))
+        self.assertTrue("requestbody" in req)
+        self.assertEqual(req.body_json(), {"image": "ubuntu"})
+        self.assertFalse(dict.__contains__(req, "requestbody"))
+        self.assertEqual(req["requestbody"], "eyJJbWFnZSI6InVidW50dSJ9")
+        self.assertEqual(req.get("requestbody"), "eyJJbWFnZSI6InVidW50dSJ9")
+
+    def test_body_as_last_key(self):
+        body = b64encode(json.dumps({"HostConfig": {"Privileged": True}}).encode()).decode()
+        raw = json.dumps({"RequestMethod": "POST", "RequestUri": "/containers/create", "RequestBody": body}).encode()
+        req = AuthzRequest.parse(raw)
+        self.assertEqual(req.body_json(), {"hostconfig": {"privileged": True}})
+        self.assertEqual(req["requestmethod"], "POST")
+
+    def test_malformed(self):
+        with self.assertRaises(ValueError):
+            AuthzRequest.parse(ApiTestHelper.authz_req_malformed)
@@ -0,0 +1,76 @@
+import unittest
+from unittest import mock
+
+from dockerenforcer.cache import LruCache
+
+
+class LruCacheTests(unittest.TestCase):
+    def test_get_and_put(self):
+        cache = LruCache("test_cache")
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cache.hit_ratio(), 0.5)
+
+    def test_evicts_least_recently_used(self):
+        cache = LruCache("test_cache", max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertEqual(sorted(cache.keys()), ["a", "c"])
+        self.assertEqual(cache.evictions, 1)
+
+    def test_evicts_expired(self):
+        cache = LruCache("test_cache", ttl_sec=10)
+        with mock.patch("dockerenforcer.cache.time.monotonic", return_value=100):
+            cache.put("a", 1)
+        with mock.patch("dockerenforcer.cache.time.monotonic", return_value=105):
+            self.assertEqual(cache.get("a"), 1)
+        with mock.patch("dockerenforcer.cache.time.monotonic", return_value=111):
+            self.assertIsNone(cache.get("a"))
+        self.assertFalse("a" in cache)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_invalidate_and_retain_only(self):
+        cache = LruCache("test_cache")
+        for key in ["a", "b", "c"]:
+            cache.put(key, key)
+        self.assertTrue(cache.invalidate("a"))
+        self.assertFalse(cache.invalidate("a"))
+        cache.retain_only(["b"])
+        self.assertEqual(cache.keys(), ["b"])
+        self.assertEqual(cache.invalidations, 2)
+
+    def test_put_skipped_after_invalidation(self):
+        cache = LruCache("test_cache")
+        generation = cache.get_generation()
+        cache.invalidate("a")
+        self.assertFalse(cache.put("a", 1, generation))
+        self.assertTrue(cache.put("b", 2, generation))
+        self.assertTrue(cache.put("a", 3, cache.get_generation()))
+        generation = cache.get_generation()
+        cache.clear()
+        self.assertFalse(cache.put("b", 4, generation))
+        self.assertEqual(cache.keys(), [])
+
+    def test_invalidations_kept_bounded(self):
+        cache = LruCache("test_cache", max_entries=2)
+        generation = cache.get_generation()
+        for key in range(100):
+            cache.invalidate(key)
+        self.assertEqual(len(cache._invalidated), 2)
+        # the stamp of "a" isn't kept anymore, but the fetch started before the ones that were dropped
+        self.assertFalse(cache.put("a", 1, generation))
+        self.assertFalse(cache.put(99, 1, cache.get_generation() - 1))
+        self.assertTrue(cache.put("a", 1, cache.get_generation()))
+
+    def test_prometheus_stats_format(self):
+        cache = LruCache("test_cache")
+        cache.put("a", 1)
+        cache.get("a")
+        stats = cache.to_prometheus_stats_format()
+        self.assertIn("test_cache_hits_total 1\n", stats)
+        self.assertIn("test_cache_misses_total 0\n", stats)
+        self.assertIn("test_cache_entries 1\n", stats)
@@ -0,0 +1,141 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from unittest.mock import create_autospec
+
+import docker
+
+from dockerenforcer.cgroup_metrics import CgroupMetricsReader
+from dockerenforcer.config import Config, MetricsSource
+from dockerenforcer.docker_helper import DockerHelper
+
+
+class CgroupFixture:
+    cid = "7de82a4e90f1bd4fd022bcce298e7277b8aec009e222892e44769d6c636b8205"
+    proc_stat = "cpu  100 0 100 800 0 0 0 0 0 0\ncpu0 50 0 50 400 0 0 0 0 0 0\ncpu1 50 0 50 400 0 0 0 0 0 0\n" \
+                "intr 0\nctxt 0\n"
+
+    def __init__(self) -> None:
+        self.root = tempfile.mkdtemp()
+        self.proc_stat_path = os.path.join(self.root, "stat")
+        self.write(self.proc_stat_path, self.proc_stat)
+
+    def write(self, path: str, content: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            file.write(content)
+
+    def create_v1(self, container_dir: str) -> None:
+        memory = os.path.join(self.root, "memory", container_dir)
+        self.write(os.path.join(memory, "memory.usage_in_bytes"), "1048576\n")
+        self.write(os.path.join(memory, "memory.max_usage_in_bytes"), "2097152\n")
+        self.write(os.path.join(memory, "memory.limit_in_bytes"), "536870912\n")
+        self.write(os.path.join(memory, "memory.failcnt"), "0\n")
+        self.write(os.path.join(memory, "memory.stat"), "cache 4096\nrss 32768\n")
+        cpuacct = os.path.join(self.root, "cpuacct", container_dir)
+        self.write(os.path.join(cpuacct, "cpuacct.usage"), "29623824\n")
+        self.write(os.path.join(cpuacct, "cpuacct.usage_percpu"), "773217 28850607 \n")
+        self.write(os.path.join(cpuacct, "cpuacct.stat"), "user 2\nsystem 1\n")
+        cpu = os.path.join(self.root, "cpu", container_dir)
+        self.write(os.path.join(cpu, "cpu.stat"), "nr_periods 10\nnr_throttled 2\nthrottled_time 5000\n")
+        pids = os.path.join(self.root, "pids", container_dir)
+        self.write(os.path.join(pids, "pids.current"), "3\n")
+        self.write(os.path.join(pids, "pids.max"), "max\n")
+
+    def create_v2(self, container_dir: str) -> None:
+        self.write(os.path.join(self.root, "cgroup.controllers"), "cpu memory pids\n")
+        container = os.path.join(self.root, container_dir)
+        self.write(os.path.join(container, "memory.current"), "1048576\n")
+        self.write(os.path.join(container, "memory.max"), "536870912\n")
+        self.write(os.path.join(container, "memory.stat"), "anon 32768\nfile 4096\n")
+        self.write(os.path.join(container, "cpu.stat"), "usage_usec 29623\nuser_usec 20000\nsystem_usec 9623\n"
+                                                        "nr_periods 10\nnr_throttled 2\nthrottled_usec 5\n")
+        self.write(os.path.join(container, "pids.current"), "3\n")
+        self.write(os.path.join(container, "pids.max"), "100\n")
+
+    def reader(self) -> CgroupMetricsReader:
+        return CgroupMetricsReader(self.root, self.proc_stat_path)
+
+    def remove(self) -> None:
+        shutil.rmtree(self.root)
+
+
+class CgroupMetricsReaderTests(unittest.TestCase):
+    def setUp(self):
+        self._fixture = CgroupFixture()
+        self._ticks = os.sysconf('SC_CLK_TCK')
+
+    def tearDown(self):
+        self._fixture.remove()
+
+    def _assert_system_cpu(self, metrics):
+        self.assertEqual(metrics['cpu_stats']['system_cpu_usage'], 1000 * 10 ** 9 // self._ticks)
+        self.assertEqual(metrics['cpu_stats']['online_cpus'], 2)
+
+    def test_cgroup_v1_cgroupfs_driver(self):
+        self._fixture.create_v1(os.path.join("docker", CgroupFixture.cid))
+        metrics = self._fixture.reader().get_metrics(CgroupFixture.cid)
+        self.assertEqual(metrics['memory_stats']['usage'], 1048576)
+        self.assertEqual(metrics['memory_stats']['max_usage'], 2097152)
+        self.assertEqual(metrics['memory_stats']['limit'], 536870912)
+        self.assertEqual(metrics['memory_stats']['stats'], {'cache': 4096, 'rss': 32768})
+        self.assertEqual(metrics['cpu_stats']['cpu_usage']['total_usage'], 29623824)
+        self.assertEqual(metrics['cpu_stats']['cpu_usage']['percpu_usage'], [773217, 28850607])
+        self.assertEqual(metrics['cpu_stats']['cpu_usage']['usage_in_usermode'], 2 * 10 ** 9 // self._ticks)
+        self.assertEqual(metrics['cpu_stats']['throttling_data'],
+                         {'periods': 10, 'throttled_periods': 2, 'throttled_time': 5000})
+        self.assertEqual(metrics['pids_stats'], {'current': 3})
+        self._assert_system_cpu(metrics)
+
+    def test_cgroup_v1_systemd_driver(self):
+        self._fixture.create_v1(os.path.join("system.slice", "docker-{0}.scope".format(CgroupFixture.cid)))
+        metrics = self._fixture.reader().get_metrics(CgroupFixture.cid)
+        self.assertEqual(metrics['memory_stats']['usage'], 1048576)
+        self.assertEqual(metrics['cpu_stats']['cpu_usage']['total_usage'], 29623824)
+
+    def test_cgroup_v2(self):
+        self._fixture.create_v2(os.path.join("system.slice", "docker-{0}.scope".format(CgroupFixture.cid)))
+        metrics = self._fixture.reader().get_metrics(CgroupFixture.cid)
+        self.assertEqual(metrics['memory_stats']['usage'], 1048576)
+        self.assertEqual(metrics['memory_stats']['limit'], 536870912)
+        self.assertEqual(metrics['memory_stats']['stats'], {'anon': 32768, 'file': 4096})
+        self.assertEqual(metrics['cpu_stats']['cpu_usage'],
+                         {'total_usage': 29623000, 'usage_in_usermode': 20000000, 'usage_in_kernelmode': 9623000})
+        self.assertEqual(metrics['cpu_stats']['throttling_data'],
+                         {'periods': 10, 'throttled_periods': 2, 'throttled_time': 5000})
+        self.assertEqual(metrics['pids_stats'], {'current': 3, 'limit': 100})
+        self._assert_system_cpu(metrics)
+
+    def test_container_not_found(self):
+        self._fixture.create_v2(os.path.join("docker", CgroupFixture.cid))
+        self.assertIsNone(self._fixture.reader().get_metrics("other_container"))
+
+    def test_used_by_docker_helper(self):
+        self._fixture.create_v1(os.path.join("docker", CgroupFixture.cid))
+        config = Config()
+        config.metrics_source = MetricsSource.Cgroup
+        config.cgroup_root = self._fixture.root
+        client = create_autospec(docker.APIClient)
+        helper = DockerHelper(config, client)
+        helper.cpu_sample_interval_sec = 0
+        metrics = helper.get_metrics(CgroupFixture.cid)
+        client.stats.assert_not_called()
+        self.assertEqual(metrics['memory_stats']['usage'], 1048576)
+        self.assertEqual(metrics['precpu_stats']['cpu_usage'], metrics['cpu_stats']['cpu_usage'])
+
+    def test_first_check_takes_two_samples(self):
+        config = Config()
+        config.metrics_source = MetricsSource.Cgroup
+        config.cgroup_root = self._fixture.root
+        helper = DockerHelper(config, create_autospec(docker.APIClient))
+        helper.cpu_sample_interval_sec = 0
+        samples = [{'read': "t{0}".format(i), 'cpu_stats': {'system_cpu_usage': i * 100}} for i in range(3)]
+        helper._cgroup_metrics_reader.get_metrics = mock.Mock(side_effect=samples)
+        metrics = helper.get_metrics(CgroupFixture.cid)
+        self.assertEqual(metrics['precpu_stats'], {'system_cpu_usage': 0})
+        self.assertEqual(metrics['cpu_stats'], {'system_cpu_usage': 100})
+        metrics = helper.get_metrics(CgroupFixture.cid)
+        self.assertEqual(metrics['preread'], "t1")
+        self.assertEqual(metrics['cpu_stats'], {'system_cpu_usage': 200})
@@ -0,0 +1,145 @@
+import unittest
+from unittest.mock import create_autospec, patch
+
+import docker
+
+from dockerenforcer.config import Config
+from dockerenforcer.data_sources import get_rule_data_sources, DataSource, ALL_DATA_SOURCES, RuleUsage
+from dockerenforcer.docker_helper import DockerHelper, CheckSource
+from dockerenforcer.killer import Judge, TriggerHandler
+from . import test_helpers
+from .test_helpers import serve_raw_inspect_from_mock
+
+NAME_KEY = "name"
+
+
+def uses_too_much_memory(c):
+    return c.metrics['memory_stats']['usage'] > 1024 ** 3
+
+
+class CallableRule:
+    def __call__(self, c):
+        return False
+
+
+class DataSourcesTests(unittest.TestCase):
+    def test_params_rule(self):
+        sources = get_rule_data_sources(lambda c: c.params['hostconfig']['memory'] == 0)
+        self.assertEqual(sources, frozenset([DataSource.Params]))
+
+    def test_metrics_rule(self):
+        sources = get_rule_data_sources(lambda c: c.metrics['memory_stats']['usage'] > 1024 ** 3)
+        self.assertEqual(sources, frozenset([DataSource.Metrics]))
+
+    def test_position_rule(self):
+        self.assertEqual(get_rule_data_sources(lambda c: c.position >= 3), frozenset([DataSource.Position]))
+
+    def test_rule_not_using_container(self):
+        self.assertEqual(get_rule_data_sources(lambda c: False), frozenset())
+
+    def test_short_circuit_rule(self):
+        sources = get_rule_data_sources(lambda c: c.position > 3 or c.metrics['pids_stats']['current'] > 100)
+        self.assertEqual(sources, frozenset([DataSource.Position, DataSource.Metrics]))
+
+    def test_rule_using_helper_function(self):
+        sources = get_rule_data_sources(lambda c: uses_too_much_memory(c))
+        self.assertEqual(sources, frozenset([DataSource.Metrics]))
+
+    def test_rule_using_getattr(self):
+        self.assertEqual(get_rule_data_sources(lambda c: getattr(c, "metrics") is None),
+                         frozenset([DataSource.Metrics]))
+
+    def test_rule_using_container_name(self):
+        self.assertEqual(get_rule_data_sources(lambda c: str(c).startswith("test")), frozenset([DataSource.Params]))
+
+    def test_rule_not_a_function(self):
+        self.assertEqual(get_rule_data_sources(CallableRule()), ALL_DATA_SOURCES)
+
+    def test_custom_whitelist_rule(self):
+        sources = get_rule_data_sources(lambda c, r: r == "rule" and c.metrics["pids_stats"]["current"] > 1, "rule")
+        self.assertEqual(sources, frozenset([DataSource.Metrics]))
+
+
+class ContainerNameUsageTests(unittest.TestCase):
+    def test_name_not_read(self):
+        self.assertFalse(RuleUsage(lambda c: c.params['hostconfig']['privileged']).reads_container_name)
+
+    def test_name_read(self):
+        self.assertTrue(RuleUsage(lambda c: c.params['name'].startswith("prod")).reads_container_name)
+
+    def test_name_read_with_variable_key(self):
+        self.assertTrue(RuleUsage(lambda c: c.params[NAME_KEY] == "prod").reads_container_name)
+        self.assertTrue(RuleUsage(lambda c: c.params.get(NAME_KEY) == "prod").reads_container_name)
+
+    def test_helper_from_other_module_assumed_to_read_all(self):
+        usage = RuleUsage(lambda c: test_helpers.is_production(c) and c.params['hostconfig']['privileged'])
+        self.assertTrue(usage.reads_container_name)
+        self.assertEqual(usage.data_sources, ALL_DATA_SOURCES)
+
+    def test_failing_probe_assumed_to_read_all(self):
+        self.assertTrue(RuleUsage(lambda c: int(c.params['hostconfig']['memory']) == 0).reads_container_name)
+
+    def test_verdict_cache_keyed_on_name(self):
+        config = Config()
+        config.authz_verdict_cache_size = 10
+        rule = {"name": "privileged in production",
+                "rule": lambda c: test_helpers.is_production(c) and c.params['hostconfig']['privileged']}
+        judge = Judge([rule], "container", config, run_whitelists=False)
+        self.assertNotEqual(judge.get_verdict_cache_key(b"digest", "ci-1", ""),
+                            judge.get_verdict_cache_key(b"digest", "prod-1", ""))
+
+
+class JudgeDataSourcesTests(unittest.TestCase):
+    def test_params_needed_by_whitelists(self):
+        judge = Judge([{"name": "no more than 3", "rule": lambda c: c.position >= 3}], "container", Config())
+        self.assertEqual(judge.data_sources, frozenset([DataSource.Params, DataSource.Position]))
+
+    def test_no_whitelists(self):
+        judge = Judge([{"name": "no more than 3", "rule": lambda c: c.position >= 3}], "container", Config(),
+                      run_whitelists=False)
+        self.assertEqual(judge.data_sources, frozenset([DataSource.Position]))
+
+    def test_custom_whitelist_sources(self):
+        judge = Judge([{"name": "no more than 3", "rule": lambda c: c.position >= 3}], "container", Config(),
+                      custom_whitelist_rules=[{"name": "low memory", "rule": lambda c, r: uses_too_much_memory(c)}])
+        self.assertEqual(judge.data_sources, ALL_DATA_SOURCES)
+
+
+class TriggerDataSourcesTests(unittest.TestCase):
+    def test_default_triggers(self):
+        self.assertFalse(DataSource.Metrics in TriggerHandler().data_sources)
+
+    def test_default_triggers_without_stdlib_module_names(self):
+        # python < 3.10 has no sys.stdlib_module_names, stdlib modules are found by their location there
+        with patch("dockerenforcer.data_sources._STDLIB_MODULES", frozenset(["builtins"])), \
+                patch("dockerenforcer.data_sources._stdlib_modules_found", set()):
+            self.assertFalse(DataSource.Metrics in TriggerHandler().data_sources)
+            self.assertEqual(get_rule_data_sources(lambda c: docker.utils.parse_repository_tag(c.params["x"])),
+                             ALL_DATA_SOURCES)
+
+    def test_trigger_reading_metrics_not_run(self):
+        runs = []
+        handler = TriggerHandler()
+        handler._triggers = [{"name": "log memory",
+                              "trigger": lambda v: runs.append(v.subject.metrics['memory_stats']['usage'])}]
+        self.assertEqual(handler.data_sources, frozenset([DataSource.Metrics]))
+        self.assertEqual(runs, [])
+
+    def test_trigger_reading_all_attributes(self):
+        handler = TriggerHandler()
+        handler._triggers = [{"name": "dump", "trigger": lambda v: print(vars(v.subject))}]
+        self.assertEqual(handler.data_sources, ALL_DATA_SOURCES)
+
+
+class DockerHelperDataSourcesTests(unittest.TestCase):
+    def test_metrics_not_fetched_when_not_used(self):
+        client = create_autospec(docker.APIClient)
+        serve_raw_inspect_from_mock(client)
+        client.inspect_container.return_value = {"Id": "cid", "Name": "/test"}
+        helper = DockerHelper(Config(), client)
+        helper.limit_data_sources(frozenset([DataSource.Params]))
+        container = helper.check_container("cid", CheckSource.Periodic)
+        client.inspect_container.assert_called_once_with("cid")
+        client.stats.assert_not_called()
+        self.assertEqual(container.params["name"], "/test")
+        self.assertEqual(container.metrics, {})
@@ -1,11 +1,15 @@
+import datetime
+import json
+import threading
 import unittest
 from copy import copy
-from unittest.mock import create_autospec
+from unittest.mock import create_autospec, patch
 
 import docker
 
 from dockerenforcer.config import Config
 from dockerenforcer.docker_helper import Container, CheckSource, DockerHelper
+from .test_helpers import serve_raw_inspect_from_mock
 
 
 class ContainerTests(unittest.TestCase):
@@ -22,6 +26,7 @@ class DockerHelperTests(unittest.TestCase):
     def setUp(self):
         self._config = Config()
         self._client = create_autospec(docker.APIClient)
+        serve_raw_inspect_from_mock(self._client)
         self._helper = DockerHelper(self._config, self._client)
         self._cid = "cont_id1"
         self._cid2 = "cont_id2"
@@ -33,6 +38,21 @@ class DockerHelperTests(unittest.TestCase):
         self._helper.kill_container(c)
         self._client.stop.assert_called_once_with(self._cid)
 
+    def test_periodic_checks_paused_by_circuit_breaker(self):
+        self._config.disable_metrics = True
+        self._config.circuit_breaker_error_rate = 0.5
+        self._config.circuit_breaker_window = 1
+        helper = DockerHelper(self._config, self._client)
+        self._client.containers.side_effect = ValueError("daemon overloaded")
+        self.assertEqual(list(helper.check_containers(CheckSource.Periodic)), [])
+        self.assertFalse(helper.periodic_checks_allowed())
+        self._client.containers.reset_mock()
+        self.assertEqual(list(helper.check_containers(CheckSource.Periodic)), [])
+        self._client.containers.assert_not_called()
+        self.assertIsNone(helper.check_container(self._cid, CheckSource.Periodic))
+        self._client.inspect_container.return_value = self._params
+        self.assertIsNotNone(helper.check_container(self._cid, CheckSource.Event))
+
     def test_get_params_no_cache(self):
         self._client.inspect_container.return_value = self._params
         params = self._helper.get_params(self._cid)
@@ -47,6 +67,22 @@ class DockerHelperTests(unittest.TestCase):
         self.assertDictEqual(params, self._helper.rename_keys_to_lower(copy(self._params)))
         self.assertDictEqual(self._helper._params_cache[self._cid], self._helper.rename_keys_to_lower(copy(self._params)))
 
+    def test_get_params_invalidated_while_fetched(self):
+        self._config.cache_params = True
+
+        def inspect(cid):
+            # an 'update' event comes while the inspect call is in flight
+            self._helper.on_container_event({'Type': 'container', 'Action': 'update', 'id': cid})
+            return self._params
+
+        self._client.inspect_container.side_effect = inspect
+        self._helper.get_params(self._cid)
+        self.assertFalse(self._cid in self._helper._params_cache)
+        self._client.inspect_container.side_effect = None
+        self._client.inspect_container.return_value = self._params
+        self._helper.get_params(self._cid)
+        self.assertTrue(self._cid in self._helper._params_cache)
+
     def test_get_params_from_cache_and_remove(self):
         self._config.cache_params = True
         self._helper._params_cache[self._cid] = self._params
@@ -66,6 +102,18 @@ class DockerHelperTests(unittest.TestCase):
         self._helper.purge_cache([self._cid])
         self.assertFalse(self._cid2 in self._helper._params_cache)
 
+    def test_cache_invalidated_by_events(self):
+        self._config.cache_params = True
+        self._helper._params_cache[self._cid] = self._params
+        self._helper._params_cache[self._cid2] = self._params2
+        self._helper.on_container_event({'Type': 'container', 'Action': 'exec_start', 'id': self._cid})
+        self._helper.on_container_event({'Type': 'network', 'Action': 'destroy', 'id': self._cid})
+        self.assertTrue(self._cid in self._helper._params_cache)
+        self._helper.on_container_event({'Type': 'container', 'Action': 'update', 'id': self._cid})
+        self.assertFalse(self._cid in self._helper._params_cache)
+        self._helper.on_container_event({'Type': 'container', 'Action': 'rename', 'id': self._cid2})
+        self.assertFalse(self._cid2 in self._helper._params_cache)
+
     def test_check_containers(self):
         self._config.disable_metrics = True
         self._client.containers.return_value = [{'Id': self._cid}, {'Id': self._cid2}]
@@ -81,18 +129,209 @@ class DockerHelperTests(unittest.TestCase):
         self.assertEqual(containers[1].check_source, CheckSource.Periodic)
         self.assertDictEqual(containers[1].params, self._helper.rename_keys_to_lower(copy(self._params2)))
 
+    def test_check_containers_in_buckets(self):
+        self._config.disable_metrics = True
+        self._config.run_periodic = True
+        ids = ["cid{0}".format(i) for i in range(20)]
+        self._client.containers.return_value = [{'Id': cid} for cid in ids]
+        self._client.inspect_container.side_effect = lambda cid: {"id": cid}
+        checked = [[c.cid for c in self._helper.check_containers(CheckSource.Periodic, bucket, 3)]
+                   for bucket in range(3)]
+        self.assertEqual(sorted(cid for bucket in checked for cid in bucket), sorted(ids))
+        self.assertTrue(all(0 < len(bucket) < len(ids) for bucket in checked))
+        self.assertEqual([self._helper.get_scan_bucket(cid, 3) for cid in checked[1]], [1] * len(checked[1]))
+        stats = self._helper.to_prometheus_stats_format()
+        self.assertIn("periodic_check_running_containers 20\n", stats)
+        self.assertIn("periodic_check_covered_containers 20\n", stats)
+
+    def test_check_cycle_ends_with_last_bucket(self):
+        self._config.disable_metrics = True
+        self._client.containers.return_value = [{'Id': "cid{0}".format(i)} for i in range(20)]
+        self._client.inspect_container.side_effect = lambda cid: {"id": cid}
+        for bucket in range(2):
+            list(self._helper.check_containers(CheckSource.Periodic, bucket, 3))
+        self.assertEqual(self._helper.last_check_containers_run_end_timestamp, datetime.datetime.min)
+        list(self._helper.check_containers(CheckSource.Periodic, 2, 3))
+        self.assertGreater(self._helper.last_check_containers_run_end_timestamp,
+                           self._helper.last_check_containers_run_start_timestamp)
+
+    def test_skipped_bucket_checked_with_next_one(self):
+        self._config.disable_metrics = True
+        self._config.run_periodic = True
+        ids = ["cid{0}".format(i) for i in range(20)]
+        self._client.containers.return_value = [{'Id': cid} for cid in ids]
+        self._client.inspect_container.side_effect = lambda cid: {"id": cid}
+        self._helper._check_in_progress = True
+        self.assertEqual(list(self._helper.check_containers(CheckSource.Periodic, 1, 3)), [])
+        self._helper._check_in_progress = False
+        checked = [c.cid for c in self._helper.check_containers(CheckSource.Periodic, 2, 3)]
+        self.assertEqual(sorted(checked), sorted(cid for cid in ids if self._helper.get_scan_bucket(cid, 3) > 0))
+        self.assertIn("periodic_check_skipped_buckets_total 1\n", self._helper.to_prometheus_stats_format())
+
+    def test_bucket_skipped_by_circuit_breaker_checked_with_next_one(self):
+        self._config.disable_metrics = True
+        ids = ["cid{0}".format(i) for i in range(20)]
+        self._client.containers.return_value = [{'Id': cid} for cid in ids]
+        self._client.inspect_container.side_effect = lambda cid: {"id": cid}
+        self._helper._api_guard.circuit_breaker.is_open = lambda: True
+        self.assertEqual(list(self._helper.check_containers(CheckSource.Periodic, 0, 3)), [])
+        self._helper._api_guard.circuit_breaker.is_open = lambda: False
+        checked = [c.cid for c in self._helper.check_containers(CheckSource.Periodic, 1, 3)]
+        self.assertEqual(sorted(checked), sorted(cid for cid in ids if self._helper.get_scan_bucket(cid, 3) < 2))
+        self.assertIn("periodic_check_skipped_buckets_total 1\n", self._helper.to_prometheus_stats_format())
+
+    def test_check_containers_concurrently(self):
+        self._config.disable_metrics = True
+        self._config.scan_concurrency = 2
+        all_params = {self._cid: self._params, self._cid2: self._params2}
+        barrier = threading.Barrier(2, timeout=5)
+
+        def inspect_in_parallel(cid):
+            barrier.wait()
+            return all_params[cid]
+
+        self._client.containers.return_value = [{'Id': self._cid}, {'Id': self._cid2}]
+        self._client.inspect_container.side_effect = inspect_in_parallel
+        containers = list(self._helper.check_containers(CheckSource.Periodic))
+        self.assertEqual(len(containers), 2)
+        for container in containers:
+            self.assertEqual(container.check_source, CheckSource.Periodic)
+            self.assertDictEqual(container.params,
+                                 self._helper.rename_keys_to_lower(copy(all_params[container.cid])))
+        self.assertTrue(self._helper.last_periodic_run_ok)
+        self.assertGreaterEqual(self._helper.last_check_containers_run_end_timestamp,
+                                self._helper.last_check_containers_run_start_timestamp)
+
+    def test_get_metrics(self):
+        self._client.stats.return_value = {"cpu_stats": {"cpu_usage": {"total_usage": 10}}}
+        metrics = self._helper.get_metrics(self._cid)
+        self._client.stats.assert_called_once_with(container=self._cid, stream=False)
+        self.assertDictEqual(metrics, {"cpu_stats": {"cpu_usage": {"total_usage": 10}}})
+
+    def test_get_metrics_one_shot_not_supported(self):
+        self._config.stats_one_shot = True
+        self._client.api_version = "1.40"
+        self._helper.get_metrics(self._cid)
+        self._client.stats.assert_called_once_with(container=self._cid, stream=False)
+        self._client._get.assert_not_called()
+
+    def test_get_metrics_one_shot(self):
+        self._config.stats_one_shot = True
+        self._client.api_version = "1.41"
+        first = {"read": "t1", "cpu_stats": {"cpu_usage": {"total_usage": 10}},
+                 "precpu_stats": {"cpu_usage": {"total_usage": 5}}}
+        second = {"read": "t2", "cpu_stats": {"cpu_usage": {"total_usage": 30}}, "precpu_stats": {}}
+        self._client.stats.return_value = first
+        self._client._result.return_value = second
+        # without a previous sample, the first check gets both samples from the regular call
+        metrics = self._helper.get_metrics(self._cid)
+        self._client.stats.assert_called_once_with(container=self._cid, stream=False)
+        self._client._get.assert_not_called()
+        self.assertEqual(metrics["precpu_stats"], {"cpu_usage": {"total_usage": 5}})
+        metrics = self._helper.get_metrics(self._cid)
+        self.assertEqual(self._client.stats.call_count, 1)
+        self.assertEqual(self._client._get.call_args[1]["params"], {'stream': False, 'one-shot': True})
+        self.assertEqual(metrics["preread"], "t1")
+        self.assertEqual(metrics["precpu_stats"], {"cpu_usage": {"total_usage": 10}})
+        self.assertEqual(metrics["cpu_stats"], {"cpu_usage": {"total_usage": 30}})
+        self._helper.purge_previous_cpu_stats([self._cid2])
+        self.assertFalse(self._cid in self._helper._previous_cpu_stats)
+
+    def test_purge_previous_cpu_stats_while_checking(self):
+        stopped = threading.Event()
+
+        def check():
+            i = 0
+            while not stopped.is_set():
+                self._helper._set_previous_cpu_stats("cid{0}".format(i % 1000), {})
+                i += 1
+
+        checker = threading.Thread(target=check, daemon=True)
+        checker.start()
+        try:
+            for _ in range(200):
+                self._helper.purge_previous_cpu_stats([self._cid])
+        finally:
+            stopped.set()
+            checker.join(5)
+
     def test_get_events(self):
         res = [
             {u'from': u'image/with:tag', u'id': self._cid, u'status': u'start', u'time': 1423339459},
             {u'from': u'image/with:tag', u'id': self._cid2, u'status': u'start', u'time': 1423339459}
             ]
-        self._client.events.return_value = res
+        streams = [res, []]
+
+        def events(since, filters, decode):
+            if len(streams) == 1:
+                self._helper.stop_events()
+            return streams.pop(0)
+        self._client.events.side_effect = events
+        self._helper.events_reconnect_delay_sec = 0
         events = list(self._helper.get_events_observable())
-        self._client.events.assert_called_once_with(decode=True)
+        self._client.events.assert_called_with(since="1423339459.000000000", filters=self._helper.get_event_filters(),
+                                               decode=True)
+        self.assertEqual(self._client.events.call_args_list[0][1]["since"], None)
         self.assertEqual(len(events), 2)
         self.assertEqual(events[0]['id'], self._cid)
         self.assertEqual(events[1]['id'], self._cid2)
 
+    def test_get_events_replays_gap_without_duplicates(self):
+        first = [{'id': self._cid, 'Action': 'start', 'timeNano': 1000000000005},
+                 {'id': self._cid2, 'Action': 'start', 'timeNano': 1000000000007}]
+        replayed = [{'id': self._cid2, 'Action': 'start', 'timeNano': 1000000000007},
+                    {'id': self._cid, 'Action': 'die', 'timeNano': 1000000000007},
+                    {'id': self._cid, 'Action': 'destroy', 'timeNano': 1000000000009}]
+
+        def broken_stream():
+            yield from first
+            raise docker.errors.APIError("connection lost")
+
+        streams = [broken_stream(), replayed]
+
+        def events(since, filters, decode):
+            if len(streams) == 1:
+                self._helper.stop_events()
+            return streams.pop(0)
+        self._client.events.side_effect = events
+        self._helper.events_reconnect_delay_sec = 0
+        events = list(self._helper.get_events_observable())
+        self.assertEqual(self._client.events.call_args[1]["since"], "1000.000000007")
+        self.assertEqual([(e['id'], e['Action']) for e in events],
+                         [(self._cid, 'start'), (self._cid2, 'start'), (self._cid, 'die'), (self._cid, 'destroy')])
+
+    def test_get_events_replays_gap_before_first_event(self):
+        def broken_stream():
+            raise docker.errors.APIError("connection lost")
+            yield
+
+        streams = [broken_stream(), broken_stream(), [{'id': self._cid, 'Action': 'start', 'timeNano': 1}]]
+
+        def events(since, filters, decode):
+            if len(streams) == 1:
+                self._helper.stop_events()
+            return streams.pop(0)
+        self._client.events.side_effect = events
+        self._helper.events_reconnect_delay_sec = 0
+        with patch("time.time_ns", return_value=1000000000005):
+            events = list(self._helper.get_events_observable())
+        self.assertEqual([c[1]["since"] for c in self._client.events.call_args_list],
+                         [None, "1000.000000005", "1000.000000005"])
+        self.assertEqual([(e['id'], e['Action']) for e in events], [(self._cid, 'start')])
+
+    def test_event_filters(self):
+        self._config.cache_params = False
+        self._config.run_start_events = True
+        self.assertEqual(self._helper.get_event_filters(), {'type': ['container'], 'event': ['destroy', 'start']})
+        self._config.cache_params = True
+        self.assertEqual(self._helper.get_event_filters()['event'], ['destroy', 'die', 'rename', 'start', 'update'])
+
+    def test_loads_with_lower_keys(self):
+        params = {"Privileged": True, "CapAdd": ["SYS_ADMIN"], "HostConfig": {"MOUNTS": [{"TESTLIST0KEY": "..."}]},
+                  "Labels": {"Com.Example.Label": "Value"}}
+        self.assertDictEqual(self._helper.loads_with_lower_keys(json.dumps(params)),
+                             self._helper.rename_keys_to_lower(params))
+
     def test_rename_keys_to_lower(self):
         params = {"Privileged": True, "CapAdd": ["SYS_ADMIN"], "HostConfig": {"MOUNTS": [{"TESTLIST0KEY": "..."}, {"TESTLIST1KEY": "..."}]}, "TEST2KEY": "TEST2VALUE"}
         params = self._helper.rename_keys_to_lower(params)
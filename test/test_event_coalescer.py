@@ -0,0 +1,39 @@
+import threading
+import time
+import unittest
+
+from rx.subjects import Subject
+
+from dockerenforcer.event_coalescer import EventCoalescer
+
+
+class EventCoalescerTests(unittest.TestCase):
+    def test_merges_events_within_window(self):
+        coalescer = EventCoalescer(0.05)
+        ids = Subject()
+        checked = []
+        subscription = coalescer.coalesce(ids).subscribe(checked.append)
+        for cid in ["cid1", "cid2", "cid1", "cid1", "cid2"]:
+            ids.on_next(cid)
+        time.sleep(0.3)
+        self.assertEqual(checked, ["cid1", "cid2"])
+        ids.on_next("cid1")
+        time.sleep(0.3)
+        self.assertEqual(checked, ["cid1", "cid2", "cid1"])
+        self.assertEqual((coalescer.received, coalescer.merged), (6, 3))
+        self.assertIn("container_events_merged_total 3\n", coalescer.to_prometheus_stats_format())
+        subscription.dispose()
+
+    def test_take_due_waits_for_window(self):
+        coalescer = EventCoalescer(0.05)
+        stopped = threading.Event()
+        start = time.monotonic()
+        coalescer.add("cid1")
+        self.assertEqual(coalescer.take_due(stopped), ["cid1"])
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+    def test_disabled(self):
+        coalescer = EventCoalescer(0)
+        ids = Subject()
+        self.assertIs(coalescer.coalesce(ids), ids)
+        self.assertEqual(coalescer.to_prometheus_stats_format(), "")
@@ -1,10 +1,28 @@
+import json
 from copy import copy
+from unittest import mock
 
 from dockerenforcer.config import Config
 from dockerenforcer.docker_helper import Container, CheckSource, DockerHelper
 from dockerenforcer.killer import Judge
 
 
+def serve_raw_inspect_from_mock(client):
+    # DockerHelper decodes raw inspect responses itself; build them from the mocked APIClient.inspect_container
+    def get(url, **kwargs):
+        response = mock.Mock()
+        if url.startswith("/containers/") and url.endswith("/json"):
+            response.content = json.dumps(client.inspect_container(url.split("/")[2]))
+        return response
+
+    client._url.side_effect = lambda path, *args: path.format(*args)
+    client._get.side_effect = get
+
+
+def is_production(container):
+    return container.params['name'].startswith("prod")
+
+
 class RulesTestHelper:
     def __init__(self, rules, config=Config(), container_count=1, mem_limit=0, cpu_share=0, cpu_period=0, cpu_quota=0,
                  mem_usage=0, container_params={}):
@@ -96,7 +114,7 @@ class RulesTestHelper:
                          'tx_bytes': 578, 'rx_packets': 80, 'tx_errors': 0}}, 'read': '2016-10-27T19:30:13.751688232Z'}
         self.containers = []
         for cnt in range(container_count):
-            self.containers.append(Container(cid, DockerHelper(None, None).rename_keys_to_lower(copy(params)), metrics, cnt, check_source=CheckSource.Event))
+            self.containers.append(Container(cid, DockerHelper.rename_keys_to_lower(copy(params)), metrics, cnt, check_source=CheckSource.Event))
 
     def get_verdicts(self):
         return list(map(lambda c: self.judge.should_be_killed(c), self.containers))
@@ -129,4 +147,4 @@ class ApiTestHelper:
 class DefaultRulesHelper:
     rules_json = b'"rules = [\\n    {\\n        \\"name\\": \\"always false\\",\\n        \\"rule\\": lambda container: False\\n    }\\n]\\n"'
     triggers_json = b'"import json\\nimport threading\\nimport logging\\n\\n\\nlogger = logging.getLogger(\\"docker_enforcer\\")\\n\\ntriggers = [\\n    {\\n        \\"name\\": \\"additional log verdict\\",\\n        \\"trigger\\": lambda v: logger.debug(\\"[{0}] Trigger: container {1} is detected to violate the rule \\\\\\"{2}\\\\\\".\\"\\n                                          .format(threading.current_thread().name, v.subject, json.dumps(v.reasons)))\\n    }\\n]\\n"'
-    request_rules = b'"import json\\nimport threading\\nimport logging\\n\\nlogger = logging.getLogger(\\"docker_enforcer\\")\\n\\nrequest_rules = [\\n    {\\n        \\"name\\": \\"always false\\",\\n        \\"rule\\": lambda request: False\\n    }\\n]\\n"'
+    request_rules = b'"import json\\nimport threading\\nimport logging\\n\\nlogger = logging.getLogger(\\"docker_enforcer\\")\\n\\n# a rule without \\"methods\\" and \\"paths\\" is run for every API call, for example:\\n#    {\\n#        \\"name\\": \\"always false\\",\\n#        \\"rule\\": lambda request: False\\n#    }\\nrequest_rules = [\\n]\\n"'
@@ -1,6 +1,11 @@
+import datetime
+import json
+import threading
+import time
 import unittest
 from dockerenforcer.config import Config
-from dockerenforcer.killer import StatusDictionary
+from dockerenforcer.docker_helper import Container, CheckSource
+from dockerenforcer.killer import StatusDictionary, Judge, Verdict, Stat
 from .test_helpers import RulesTestHelper
 
 
@@ -159,3 +164,241 @@ class WhitelistTests(TestsWithVerdicts):
         self.wl_config.image_white_list = ["busy.*|must have CPU limit"]
         self.assertFalse(RulesTestHelper(self.rules, config=self.wl_config, cpu_period=0, cpu_quota=0)
                          .get_verdicts()[0].verdict)
+
+
+class IncrementalChecksTests(unittest.TestCase):
+    def setUp(self):
+        self.config = Config()
+        self.config.incremental_checks = True
+        self.config.stop_on_first_violation = False
+        # rules can't reference self, as its methods could read anything from the container, nor strings like
+        # "metrics", as they could be used as keys
+        calls = self._counts = [0, 0]
+
+        def count(rule_index):
+            calls[rule_index] += 1
+            return True
+
+        self.rules = [
+            {"name": "must have memory limit", "rule": lambda c: count(0)
+                and c.params['hostconfig']['memory'] == 0},
+            {"name": "uses over 1GB of RAM", "rule": lambda c: count(1)
+                and c.metrics['memory_stats']['usage'] > 1024 ** 3},
+        ]
+        self.judge = Judge(self.rules, "container", self.config, run_whitelists=False)
+        # the rules were already run once when the judge probed them for the data they read
+        calls[:] = [0, 0]
+        self.params = {"name": "test", "hostconfig": {"memory": 0}}
+
+    @property
+    def calls(self):
+        return {"params": self._counts[0], "metrics": self._counts[1]}
+
+    def _check(self, params, mem_usage):
+        container = Container("cid", params, {"memory_stats": {"usage": mem_usage}}, 0, CheckSource.Periodic)
+        return self.judge.should_be_killed(container)
+
+    def test_reuses_results_when_nothing_changed(self):
+        self.assertEqual(self._check(self.params, 1).reasons, ["must have memory limit"])
+        self.assertEqual(self._check(self.params, 1).reasons, ["must have memory limit"])
+        self.assertEqual(self.calls, {"params": 1, "metrics": 1})
+
+    def test_reruns_only_rules_reading_changed_data(self):
+        self._check(self.params, 1)
+        verdict = self._check(self.params, 2 * 1024 ** 3)
+        self.assertEqual(verdict.reasons, ["must have memory limit", "uses over 1GB of RAM"])
+        self.assertEqual(self.calls, {"params": 1, "metrics": 2})
+
+        verdict = self._check({"name": "test", "hostconfig": {"memory": 1024}}, 2 * 1024 ** 3)
+        self.assertEqual(verdict.reasons, ["uses over 1GB of RAM"])
+        self.assertEqual(self.calls, {"params": 2, "metrics": 2})
+
+    def test_forget_container(self):
+        self._check(self.params, 1)
+        self.judge.forget_container("cid")
+        self._check(self.params, 1)
+        self.assertEqual(self.calls, {"params": 2, "metrics": 2})
+
+    def test_forget_container_when_disabled(self):
+        self.config.incremental_checks = False
+        for i in range(10):
+            self.judge.forget_container("cid{0}".format(i))
+        self.assertEqual(len(self.judge._evaluations._invalidated), 0)
+
+    def test_not_used_for_authz_requests(self):
+        for _ in range(2):
+            container = Container("cid", self.params, {}, 0, CheckSource.AuthzPlugin)
+            self.judge.should_be_killed(container)
+        self.assertEqual(self.calls["params"], 2)
+
+
+class RuleProfilingTests(unittest.TestCase):
+    def setUp(self):
+        self.config = Config()
+        self.config.stop_on_first_violation = False
+        self.rules = [{"name": "slow", "rule": lambda c: time.sleep(0.005) or True},
+                      {"name": "fast", "rule": lambda c: True}]
+        self.whitelist_rules = [{"name": "never", "rule": lambda c, r: False}]
+
+    def _check(self, judge):
+        container = Container("cid", {"name": "test", "config": {"image": "busybox"}}, {}, 0, CheckSource.Periodic)
+        return judge.should_be_killed(container)
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(Judge(self.rules, "container", self.config).profiler)
+
+    def test_ranking(self):
+        self.config.rules_profiling = True
+        judge = Judge(self.rules, "container", self.config, custom_whitelist_rules=self.whitelist_rules)
+        self._check(judge)
+        self._check(judge)
+        ranking = judge.profiler.get_ranking()
+        self.assertEqual([(p["type"], p["name"]) for p in ranking][0], ("rule", "slow"))
+        self.assertEqual({(p["type"], p["name"]): p["calls"] for p in ranking},
+                         {("rule", "slow"): 2, ("rule", "fast"): 2, ("whitelist_rule", "never"): 4})
+        self.assertGreaterEqual(ranking[0]["max_ms"], 5)
+
+    def test_skips_rule_over_budget(self):
+        self.config.rule_time_budget_ms = 1
+        self.config.rule_time_budget_skip_after = 2
+        judge = Judge(self.rules, "container", self.config, run_whitelists=False)
+        self.assertEqual(self._check(judge).reasons, ["slow", "fast"])
+        self.assertEqual(self._check(judge).reasons, ["slow", "fast"])
+        self.assertEqual(self._check(judge).reasons, ["fast"])
+        slow = judge.profiler.get_ranking()[0]
+        self.assertEqual((slow["name"], slow["calls"], slow["budget_overruns"], slow["skipped"]),
+                         ("slow", 2, 2, True))
+
+
+class ReadRecordingList(list):
+    def __init__(self, items, read):
+        super().__init__(items)
+        self._read = read
+
+    def __getitem__(self, index):
+        self._read.append(index)
+        return super().__getitem__(index)
+
+
+class StatusDictionaryTests(unittest.TestCase):
+    def setUp(self):
+        self.status = StatusDictionary()
+        self.verdict = Verdict(True, Container("cid1", {"name": "test1", "config": {"image": "busybox", "labels": {}}},
+                                               {}, 0, CheckSource.Periodic), ["rule"])
+
+    def test_snapshot_reused_until_next_write(self):
+        self.status.register_killed(self.verdict)
+        snapshot = self.status.copy()
+        self.assertIs(snapshot, self.status.copy())
+        self.assertEqual(snapshot.version, 1)
+        self.status.register_killed(self.verdict)
+        self.assertIsNot(snapshot, self.status.copy())
+        self.assertEqual(self.status.copy().version, 2)
+
+    def test_snapshot_not_changed_by_writes(self):
+        self.status.register_killed(self.verdict)
+        snapshot = self.status.copy()
+        self.status.register_killed(self.verdict)
+        self.assertEqual(list(snapshot.get_items())[0][1].counter, 1)
+        self.assertEqual(list(self.status.copy().get_items())[0][1].counter, 2)
+
+    def test_reads_dont_wait_for_writers(self):
+        self.status.register_killed(self.verdict)
+        with self.status._padlock:
+            reader = threading.Thread(target=lambda: self.status.copy().to_json_detail_stats(lambda s: True, False,
+                                                                                             False), daemon=True)
+            reader.start()
+            reader.join(5)
+            self.assertFalse(reader.is_alive())
+
+    def test_snapshot_kept_when_log_compacted(self):
+        for cid in ["cid1", "cid2"]:
+            self.status.register_killed(self._verdict_for(cid))
+        snapshot = self.status.copy()
+        for _ in range(200):
+            self.status.register_killed(self._verdict_for("cid1"))
+        self.status.forget("cid2")
+        self.assertLess(len(self.status._log), 100)
+        self.assertEqual([(k, v.counter) for k, v in snapshot.get_items()], [("cid1", 1), ("cid2", 1)])
+        self.assertEqual([(k, v.counter) for k, v in self.status.copy().get_items()], [("cid1", 201)])
+
+    def test_json_detail_stats_since_reads_only_newer_entries(self):
+        start = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+        stats = {"cid{0}".format(i): Stat("cid{0}".format(i), 1, start + datetime.timedelta(seconds=i), ("rule",))
+                 for i in range(1000)}
+        status = StatusDictionary(stats)
+        timestamps = status._timestamps
+        status.register_killed(self._verdict_for("cid1000"))
+        # the time index is extended by each write, not rebuilt
+        self.assertIs(status._timestamps, timestamps)
+        snapshot = status.copy()
+        read = []
+        snapshot._log = ReadRecordingList(snapshot._log, read)
+        since = start + datetime.timedelta(seconds=998)
+        page = json.loads("".join(snapshot.iter_json_detail_stats(lambda s: True, False, False, since=since)))
+        self.assertEqual([d["id"] for d in page], ["cid999", "cid1000"])
+        self.assertEqual(read, [999, 1000])
+
+    def _verdict_for(self, cid):
+        return Verdict(True, Container(cid, {"name": cid, "config": {"image": "busybox", "labels": {}}}, {}, 0,
+                                       CheckSource.Periodic), ["rule"])
+
+    def test_max_entries(self):
+        status = StatusDictionary(max_entries=2)
+        for cid in ["cid1", "cid2", "cid1", "cid3"]:
+            status.register_killed(self._verdict_for(cid))
+        snapshot = status.copy()
+        self.assertEqual([k for k, _ in snapshot.get_items()], ["cid1", "cid3"])
+        self.assertEqual(snapshot.evictions, 1)
+        self.assertEqual(snapshot.total_recorded, 3)
+
+    def test_max_age(self):
+        expired = datetime.datetime.utcnow() - datetime.timedelta(seconds=61)
+        status = StatusDictionary({"cid1": Stat("cid1", 1, expired)}, max_age_sec=60)
+        self.assertEqual(len(status.copy()), 0)
+        status.register_killed(self._verdict_for("cid2"))
+        snapshot = status.copy()
+        self.assertEqual([k for k, _ in snapshot.get_items()], ["cid2"])
+        self.assertEqual(snapshot.evictions, 1)
+
+    def test_forget(self):
+        self.status.register_killed(self.verdict)
+        self.status.forget("cid1")
+        self.status.forget("cid1")
+        self.assertEqual(len(self.status.copy()), 0)
+        self.assertIn("stats_evictions_total 1\n", self.status.copy().to_prometheus_stats_format())
+        self.assertIn("containers_stopped_total 1\n", self.status.copy().to_prometheus_stats_format())
+
+    def test_repeated_values_shared(self):
+        for cid in ["cid1", "cid2"]:
+            params = {"name": cid, "config": {"image": "".join(["busy", "box"]), "labels": {"project": "ci"}}}
+            self.status.register_killed(Verdict(True, Container(cid, params, {}, 0, CheckSource.Periodic),
+                                                ["rule"]))
+        first, second = [v for _, v in self.status.copy().get_items()]
+        self.assertIs(first.image, second.image)
+        self.assertIs(first.labels, second.labels)
+        self.assertEqual(first.labels, {"project": "ci"})
+        self.assertEqual(first.reasons, ("rule",))
+
+    def test_json_detail_stats_paginated(self):
+        for cid in ["cid1", "cid2", "cid3", "cid4"]:
+            self.status.register_killed(self._verdict_for(cid))
+        snapshot = self.status.copy()
+        page = json.loads("".join(snapshot.iter_json_detail_stats(lambda s: s.name != "cid2", False, False,
+                                                                  offset=1, limit=1)))
+        self.assertEqual([d["id"] for d in page], ["cid3"])
+        page = json.loads("".join(snapshot.iter_json_detail_stats(lambda s: True, True, False,
+                                                                  fields=["id", "violated_rule", "x"])))
+        self.assertEqual(page[0], {"id": "cid1", "violated_rule": ["rule"]})
+        self.assertEqual(json.loads(StatusDictionary().to_json_detail_stats(lambda s: True, False, True)), [])
+
+    def test_json_detail_stats_since(self):
+        for cid in ["cid1", "cid2", "cid3", "cid1"]:
+            self.status.register_killed(self._verdict_for(cid))
+        snapshot = self.status.copy()
+        since = dict(snapshot.get_items())["cid2"].last_timestamp
+        page = json.loads("".join(snapshot.iter_json_detail_stats(lambda s: True, False, False, since=since)))
+        self.assertEqual([d["id"] for d in page], ["cid3", "cid1"])
+        page = json.loads("".join(snapshot.iter_json_detail_stats(lambda s: True, False, False,
+                                                                  since=datetime.datetime.max)))
+        self.assertEqual(page, [])
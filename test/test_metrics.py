@@ -0,0 +1,36 @@
+import unittest
+
+from dockerenforcer.metrics import Counter, Histogram
+
+
+class MetricsTests(unittest.TestCase):
+    def test_counter_format(self):
+        counter = Counter("violations_total", "Violations.", ["rule"])
+        counter.inc("mem")
+        counter.inc("mem")
+        counter.inc("say \"hi\"", amount=3)
+        self.assertEqual(counter.get("mem"), 2)
+        self.assertEqual(counter.to_prometheus_stats_format(),
+                         "# HELP violations_total Violations.\n# TYPE violations_total counter\n"
+                         "violations_total{rule=\"mem\"} 2\nviolations_total{rule=\"say \\\"hi\\\"\"} 3\n")
+
+    def test_histogram_format(self):
+        histogram = Histogram("latency_seconds", "Latency.", [0.1, 1])
+        histogram.observe(0.1)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        self.assertEqual(histogram.get_count(), 3)
+        self.assertEqual(histogram.to_prometheus_stats_format(),
+                         "# HELP latency_seconds Latency.\n# TYPE latency_seconds histogram\n"
+                         "latency_seconds_bucket{le=\"0.1\"} 1\nlatency_seconds_bucket{le=\"1\"} 2\n"
+                         "latency_seconds_bucket{le=\"+Inf\"} 3\nlatency_seconds_sum 5.6\n"
+                         "latency_seconds_count 3\n")
+
+    def test_histogram_time_with_labels(self):
+        histogram = Histogram("call_seconds", "Calls.", [1], ["call"])
+        with self.assertRaises(ValueError):
+            with histogram.time("stop"):
+                raise ValueError()
+        self.assertEqual(histogram.get_count("stop"), 1)
+        self.assertEqual(histogram.get_count("inspect"), 0)
+        self.assertIn("call_seconds_bucket{call=\"stop\",le=\"1\"} 1\n", histogram.to_prometheus_stats_format())
@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+
+from dockerenforcer.render_cache import RenderCache
+
+
+class RenderCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = RenderCache(2)
+        self.renders = 0
+
+    def _render(self, data):
+        self.renders += 1
+        return "<pre>{0}</pre>".format(data)
+
+    def test_renders_once_per_body(self):
+        etag = RenderCache.etag("{}", "JsonLexer")
+        self.assertEqual(self.cache.render(etag, "{}", self._render), "<pre>{}</pre>")
+        self.assertEqual(self.cache.render(etag, "{}", self._render), "<pre>{}</pre>")
+        self.assertEqual(self.renders, 1)
+
+    def test_disabled(self):
+        cache = RenderCache(0)
+        cache.render("tag", "{}", self._render)
+        cache.render("tag", "{}", self._render)
+        self.assertEqual(self.renders, 2)
+        self.assertEqual(cache.to_prometheus_stats_format(), "")
+
+    def test_etag_depends_on_data_and_variant(self):
+        self.assertEqual(RenderCache.etag("a", "json"), RenderCache.etag("a", "json"))
+        self.assertNotEqual(RenderCache.etag("a", "json"), RenderCache.etag("b", "json"))
+        self.assertNotEqual(RenderCache.etag("a", "json"), RenderCache.etag("a", "JsonLexer"))
+
+    def test_reads_file_again_when_changed(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as file:
+            file.write("rules = []")
+        try:
+            self.assertEqual(self.cache.read_file(file.name), "rules = []")
+            with open(file.name, "w") as changed:
+                changed.write("rules = [1]")
+            os.utime(file.name, ns=(0, 1))
+            self.assertEqual(self.cache.read_file(file.name), "rules = [1]")
+        finally:
+            os.unlink(file.name)
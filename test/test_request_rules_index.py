@@ -0,0 +1,47 @@
+import unittest
+
+from dockerenforcer.request_rules_index import RequestRulesIndex, compile_path_pattern
+
+
+def make_rule(name, **kwargs):
+    rule = {"name": name, "rule": lambda r: True}
+    rule.update(kwargs)
+    return rule
+
+
+class PathPatternTests(unittest.TestCase):
+    def test_placeholder_matches_one_segment(self):
+        pattern = compile_path_pattern("/containers/{id}/archive")
+        self.assertTrue(pattern.match("/containers/test/archive"))
+        self.assertFalse(pattern.match("/containers/test/logs"))
+        self.assertFalse(pattern.match("/containers/a/b/archive"))
+
+    def test_literal_segments_are_escaped(self):
+        pattern = compile_path_pattern("/v1.41/_ping")
+        self.assertTrue(pattern.match("/_ping"))
+        self.assertFalse(compile_path_pattern("/containers/json").match("/containers/jsonx"))
+
+
+class RequestRulesIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.undeclared = make_rule("undeclared")
+        self.cp = make_rule("cp", methods=["get", "HEAD", "PUT"], paths=["/containers/{id}/archive"])
+        self.exec = make_rule("exec", paths=["/containers/{id}/exec", "/exec/{id}/start"])
+        self.pull = make_rule("pull", methods=["POST"])
+        self.index = RequestRulesIndex([self.cp, self.undeclared, self.exec, self.pull])
+
+    def _names(self, method, path):
+        return [r["name"] for r in self.index.rules_for(method, path)]
+
+    def test_declared_rules_run_only_for_matching_requests(self):
+        self.assertEqual(self._names("GET", "/v1.30/containers/test/archive"), ["cp", "undeclared"])
+        self.assertEqual(self._names("GET", "/v1.30/containers/json"), ["undeclared"])
+        self.assertEqual(self._names("DELETE", "/containers/test/archive"), ["undeclared"])
+
+    def test_rules_keep_their_order(self):
+        self.assertEqual(self._names("POST", "/containers/test/exec"), ["undeclared", "exec", "pull"])
+        self.assertEqual(self._names("POST", "/v1.41/exec/123/start"), ["undeclared", "exec", "pull"])
+
+    def test_unknown_requests(self):
+        self.assertEqual(self._names("PATCH", "/unknown/path"), ["undeclared"])
+        self.assertEqual(self._names("POST", "/unknown/path"), ["undeclared", "pull"])
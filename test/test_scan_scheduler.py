@@ -0,0 +1,90 @@
+import datetime
+import time
+import unittest
+from unittest.mock import create_autospec
+
+from dockerenforcer.docker_helper import CheckSource, Container, DockerHelper
+from dockerenforcer.killer import Verdict
+from dockerenforcer.scan_scheduler import PriorityScanScheduler, ScanPriority
+
+
+class PriorityScanSchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.helper = create_autospec(DockerHelper, instance=True)
+        self.helper.api_calls_per_check.return_value = 1
+        self.helper.periodic_checks_allowed.return_value = True
+        self.helper.list_running_containers.return_value = ["cid1", "cid2", "cid3"]
+        self.helper.check_container.side_effect = lambda cid, source: Container(cid, {"name": cid}, {}, 0, source)
+        self.scheduler = PriorityScanScheduler(self.helper, interval_sec=100, tick_sec=0.05)
+
+    def _tick(self, violating=()):
+        checked = []
+        for container in self.scheduler.check_due_containers():
+            checked.append(container.cid)
+            self.scheduler.on_verdict(Verdict(container.cid in violating, container, ["rule"]))
+        return checked
+
+    def test_checks_all_then_only_due(self):
+        self.assertEqual(self._tick(), ["cid1", "cid2", "cid3"])
+        self.assertEqual(self._tick(), [])
+        self.helper.check_container.assert_called_with("cid3", CheckSource.Periodic)
+
+    def test_changed_and_violating_containers_go_first(self):
+        self._tick(violating=["cid3"])
+        self.scheduler.on_container_changed("cid2")
+        for state in self.scheduler._states.values():
+            state.next_due = 0
+        self.assertEqual(self._tick(), ["cid2", "cid3", "cid1"])
+        priorities = {cid: state.priority for cid, state in self.scheduler._states.items()}
+        self.assertEqual(priorities, {"cid1": ScanPriority.Normal, "cid2": ScanPriority.High,
+                                      "cid3": ScanPriority.Elevated})
+        self.assertLess(self.scheduler._states["cid2"].next_due, self.scheduler._states["cid1"].next_due)
+
+    def test_long_compliant_containers_checked_less_often(self):
+        for _ in range(PriorityScanScheduler.low_priority_after_checks):
+            for state in self.scheduler._states.values():
+                state.next_due = 0
+            self._tick()
+        state = self.scheduler._states["cid1"]
+        self.assertEqual(state.priority, ScanPriority.Low)
+        self.assertAlmostEqual(state.next_due - state.last_checked, 200)
+
+    def test_api_budget_defers_checks(self):
+        scheduler = PriorityScanScheduler(self.helper, interval_sec=100, tick_sec=0.05, api_calls_per_sec=3)
+        start = time.monotonic()
+        checked = [c.cid for c in scheduler.check_due_containers()]
+        self.assertEqual(checked, ["cid1", "cid2"])
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(scheduler.deferred_checks, 1)
+        self.assertIn("scan_queue_length{priority=\"normal\"} 1\n", scheduler.to_prometheus_stats_format())
+
+    def test_paused_by_circuit_breaker(self):
+        self.helper.periodic_checks_allowed.return_value = False
+        self.assertEqual(list(self.scheduler.check_due_containers()), [])
+        self.helper.list_running_containers.assert_not_called()
+
+    def test_tick_is_a_periodic_run(self):
+        self.helper.start_periodic_run.return_value = 1.0
+        self._tick()
+        self.helper.start_periodic_run.assert_called_once_with()
+        self.helper.finish_periodic_run.assert_called_once_with(True, 1.0)
+        self.helper.list_running_containers.return_value = None
+        self._tick()
+        self.helper.finish_periodic_run.assert_called_with(False, 1.0)
+
+    def test_concurrent_checks(self):
+        def check(cid, source):
+            time.sleep(0.1)
+            return Container(cid, {"name": cid}, {}, 0, source)
+
+        self.helper.check_container.side_effect = check
+        scheduler = PriorityScanScheduler(self.helper, interval_sec=100, tick_sec=0.05, concurrency=3)
+        start = time.monotonic()
+        checked = sorted(c.cid for c in scheduler.check_due_containers())
+        self.assertLess(time.monotonic() - start, 0.25)
+        self.assertEqual(checked, ["cid1", "cid2", "cid3"])
+        self.assertIn("scan_checks_total{priority=\"normal\"} 3\n", scheduler.to_prometheus_stats_format())
+
+    def test_recent_window_covers_low_priority_interval(self):
+        age = datetime.datetime.utcnow() - self.scheduler.get_recent_window_start()
+        self.assertAlmostEqual(age.total_seconds(), 200, delta=1)
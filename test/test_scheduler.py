@@ -0,0 +1,61 @@
+import threading
+import time
+import unittest
+
+from rx import Observable
+
+from dockerenforcer.scheduler import BoundedThreadPoolScheduler
+
+
+class BoundedThreadPoolSchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.threads = set()
+
+    def _blocking_action(self, scheduler, state):
+        self.threads.add(threading.current_thread().name)
+        self.release.wait(5)
+
+    def test_uses_at_most_max_workers(self):
+        scheduler = BoundedThreadPoolScheduler("test_pool", 2)
+        for _ in range(5):
+            scheduler.schedule(self._blocking_action)
+        time.sleep(0.1)
+        self.assertEqual(len(self.threads), 2)
+        self.assertIn("test_pool_queue_depth 3\n", scheduler.to_prometheus_stats_format())
+        self.release.set()
+
+    def test_blocks_when_queue_full(self):
+        scheduler = BoundedThreadPoolScheduler("test_pool", 1, max_queue=1)
+        scheduler.schedule(self._blocking_action)
+        time.sleep(0.1)
+        scheduler.schedule(self._blocking_action)
+        producer = threading.Thread(target=scheduler.schedule, args=(self._blocking_action,), daemon=True)
+        producer.start()
+        producer.join(0.2)
+        self.assertTrue(producer.is_alive())
+        self.assertEqual(scheduler.backpressure_waits, 1)
+        self.release.set()
+        producer.join(5)
+        self.assertFalse(producer.is_alive())
+
+    def test_workers_dont_wait_for_queue(self):
+        scheduler = BoundedThreadPoolScheduler("test_pool", 1, max_queue=1)
+        done = threading.Event()
+
+        def reschedule(_, count):
+            if count == 0:
+                done.set()
+            else:
+                scheduler.schedule(reschedule, count - 1)
+                scheduler.schedule(lambda s, st: None)
+        scheduler.schedule(reschedule, 3)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(scheduler.backpressure_waits, 0)
+
+    def test_runs_observable_start(self):
+        scheduler = BoundedThreadPoolScheduler("test_pool", 2)
+        results = Observable.from_iterable([1, 2, 3]) \
+            .flat_map(lambda x: Observable.start(lambda: x * 2, scheduler=scheduler)) \
+            .to_blocking()
+        self.assertEqual(sorted(results), [2, 4, 6])
@@ -0,0 +1,47 @@
+import unittest
+
+from dockerenforcer.whitelist import WhitelistMatcher
+
+
+class WhitelistMatcherTests(unittest.TestCase):
+    def test_exact_names(self):
+        matcher = WhitelistMatcher(["docker_enforcer", "test-1"])
+        self.assertTrue(matcher.match("docker_enforcer"))
+        self.assertTrue(matcher.match("test-1"))
+        self.assertFalse(matcher.match("docker_enforcer2"))
+
+    def test_regexes_are_anchored(self):
+        matcher = WhitelistMatcher(["docker_enf.*", "test[0-9]"])
+        self.assertTrue(matcher.match("docker_enforcer"))
+        self.assertTrue(matcher.match("test7"))
+        self.assertFalse(matcher.match("my_docker_enforcer"))
+        self.assertFalse(matcher.match("test77"))
+
+    def test_alternatives_stay_within_entry(self):
+        matcher = WhitelistMatcher(["a|b", "c"])
+        self.assertTrue(matcher.match("b"))
+        self.assertFalse(matcher.match("ac"))
+
+    def test_back_references(self):
+        matcher = WhitelistMatcher(["(x+)-\\1", "y.*"])
+        self.assertTrue(matcher.match("xx-xx"))
+        self.assertFalse(matcher.match("xx-x"))
+        self.assertTrue(matcher.match("yes"))
+
+    def test_global_flags_stay_within_entry(self):
+        matcher = WhitelistMatcher(["(?i)foo.*", "bar.*"])
+        self.assertTrue(matcher.match("FOO1"))
+        self.assertTrue(matcher.match("bar1"))
+        self.assertFalse(matcher.match("BAR1"))
+        self.assertIsNotNone(matcher._merged)
+
+    def test_regexes_that_cant_be_merged(self):
+        matcher = WhitelistMatcher(["(?P<n>a+)bc", "(?P<n>d).f"])
+        self.assertTrue(matcher.match("aabc"))
+        self.assertTrue(matcher.match("def"))
+        self.assertFalse(matcher.match("abcd"))
+
+    def test_empty(self):
+        matcher = WhitelistMatcher([])
+        self.assertEqual(len(matcher), 0)
+        self.assertFalse(matcher.match("anything"))